@@ -0,0 +1,129 @@
+"""Контроль нагрузки: выбор уровня качества рендеринга и отказ при перегрузке.
+
+Перед рендерингом контроллер оценивает, когда пользователь получит
+результат: сколько работы уже впереди (число задач на среднее время задачи,
+делённое на число процессов) плюс время самого рендеринга по недавнему
+коэффициенту реального времени эффекта на каждом уровне качества.
+Выбирается лучший уровень, укладывающийся в target_seconds; если не
+укладывается ни один — самый дешёвый. Уровни, которые для эффектов запроса
+делают ту же работу, что и предыдущий (effects.tier_work), пропускаются.
+Если очередь работы длиннее reject_seconds или очередь пула заполнена,
+запрос отклоняется: лучше сразу попросить повторить позже, чем ответить
+по таймауту.
+
+Задачами впереди считаются не только задачи пула, но и принятые, но ещё
+не дошедшие до него запросы (скачивание и декодирование идут до постановки
+в очередь): их счётчик увеличивает choose и уменьшает release.
+
+Коэффициенты реального времени — скользящие средние по завершённым
+задачам (observe); для уровня без измерений берётся оценка полного
+качества, умноженная на QualityTier.cost.
+"""
+import logging
+from effects import QUALITY_TIERS, TIERS, tier_work
+
+logger = logging.getLogger(__name__)
+
+# Вес нового измерения в скользящих средних
+SMOOTHING = 0.2
+# Коэффициент реального времени, пока по эффекту нет ни одного измерения
+DEFAULT_RTF = 0.2
+# Среднее время задачи, пока нет измерений, секунды
+DEFAULT_JOB_SECONDS = 2.0
+
+
+class AdmissionController:
+    """Выбирает уровень качества для задач пула pool по оценке времени ответа."""
+
+    def __init__(self, pool, target_seconds, reject_seconds):
+        self.pool = pool
+        self.target_seconds = target_seconds
+        self.reject_seconds = reject_seconds
+        self._rtf = {}
+        self._job_seconds = None
+        self.admitted = 0
+        self.rejected = 0
+
+    def observe(self, effect, tier, audio_seconds, render_seconds):
+        """Учитывает завершённый рендеринг эффекта на уровне tier."""
+        if self._job_seconds is None:
+            self._job_seconds = render_seconds
+        else:
+            self._job_seconds += SMOOTHING * (render_seconds - self._job_seconds)
+        if audio_seconds <= 0:
+            return
+        rtf = render_seconds / audio_seconds
+        previous = self._rtf.get((effect, tier))
+        self._rtf[(effect, tier)] = rtf if previous is None else previous + SMOOTHING * (rtf - previous)
+
+    def rtf(self, effect, tier):
+        """Ожидаемый коэффициент реального времени эффекта на уровне tier."""
+        known = self._rtf.get((effect, tier))
+        if known is not None:
+            return known
+        full = self._rtf.get((effect, QUALITY_TIERS[0].name), DEFAULT_RTF)
+        return full * TIERS[tier].cost
+
+    def jobs_ahead(self):
+        """Задачи, принятые раньше и ещё не выполненные."""
+        return max(self.admitted, self.pool.queue_depth + self.pool.in_flight)
+
+    def backlog_seconds(self):
+        """Сколько секунд пройдёт, прежде чем новая задача попадёт в рабочий процесс."""
+        ahead = self.jobs_ahead() - self.pool.size + 1
+        if ahead <= 0:
+            return 0.0
+        job_seconds = DEFAULT_JOB_SECONDS if self._job_seconds is None else self._job_seconds
+        return ahead * job_seconds / self.pool.size
+
+    def estimate(self, effect_ids, duration, tier):
+        """Ожидаемое время до результата для эффектов effect_ids на уровне tier."""
+        max_seconds = TIERS[tier].max_seconds
+        seconds = min(duration, max_seconds) if max_seconds else duration
+        # Эффекты одного запроса рендерятся параллельно, сколько позволяет пул
+        render = sum(self.rtf(effect, tier) for effect in effect_ids) * seconds
+        return self.backlog_seconds() + render / min(len(effect_ids), self.pool.size)
+
+    def choose(self, effect_ids, duration, can_reject=True):
+        """Уровень качества для запроса или None, если бот перегружен и запрос нужно отклонить.
+
+        Уже принятые задачи (can_reject=False) при перегрузке получают самый
+        дешёвый уровень. Принятый запрос нужно завершить вызовом release(len(effect_ids)).
+        """
+        queued = self.jobs_ahead() - self.pool.size + len(effect_ids)
+        saturated = queued > self.pool.max_queue or (
+            self.reject_seconds and self.backlog_seconds() > self.reject_seconds)
+        if saturated and can_reject:
+            self.rejected += 1
+            return None
+        tier = QUALITY_TIERS[-1].name if saturated else self._best_tier(effect_ids, duration)
+        self.admitted += len(effect_ids)
+        return tier
+
+    def _best_tier(self, effect_ids, duration):
+        """Лучший уровень, укладывающийся в target_seconds, иначе самый дешёвый."""
+        if not self.target_seconds:
+            return QUALITY_TIERS[0].name
+        previous = None
+        for tier in QUALITY_TIERS:
+            work = [tier_work(effect, tier.name) for effect in effect_ids]
+            # Уровень, который для этих эффектов не дешевле предыдущего, ничего не даёт
+            if work == previous:
+                continue
+            previous = work
+            if self.estimate(effect_ids, duration, tier.name) <= self.target_seconds:
+                return tier.name
+        return QUALITY_TIERS[-1].name
+
+    def release(self, count=1):
+        """Отмечает завершение принятого запроса из count задач."""
+        self.admitted = max(0, self.admitted - count)
+
+    def stats(self):
+        return {
+            'admitted': self.admitted,
+            'backlog_seconds': round(self.backlog_seconds(), 2),
+            'job_seconds': self._job_seconds,
+            'rtf': {f"{effect}@{tier}": round(value, 4) for (effect, tier), value in self._rtf.items()},
+            'rejected': self.rejected,
+        }
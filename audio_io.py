@@ -0,0 +1,149 @@
+"""Декодирование и кодирование голосовых сообщений через ffmpeg в памяти.
+
+ffmpeg запускается асинхронно, данные передаются через stdin/stdout,
+поэтому ни временные файлы, ни блокирующие вызовы в event loop не нужны.
+Между этапами обработки аудио передаётся как AudioBuffer.
+"""
+import asyncio
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Частота дискретизации Opus в Telegram
+OPUS_SAMPLE_RATE = 48000
+# Частоты, которые libopus принимает без передискретизации
+OPUS_INPUT_RATES = (8000, 12000, 16000, 24000, 48000)
+# Частота декодирования по умолчанию: родная частота Opus, без передискретизации
+PROCESSING_SAMPLE_RATE = OPUS_SAMPLE_RATE
+
+
+class FfmpegError(Exception):
+    """ffmpeg завершился с ошибкой или не уложился в отведённое время."""
+
+
+class AudioBuffer:
+    """Моно PCM float32 и его частота дискретизации.
+
+    На границе с кодеком сэмплы не копируются, если формат совпадает:
+    from_pcm строит массив поверх байтов ffmpeg (только для чтения), pcm
+    отдаёт memoryview того же массива. Для s16le нужно одно преобразование.
+    """
+
+    __slots__ = ('samples', 'sample_rate')
+
+    def __init__(self, samples, sample_rate):
+        # Массив float32 принимается как есть, без копии
+        self.samples = np.asarray(samples, dtype=np.float32)
+        self.sample_rate = sample_rate
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __repr__(self):
+        return f"AudioBuffer({len(self.samples)} сэмплов, {self.sample_rate} Гц)"
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    @classmethod
+    def from_pcm(cls, data, sample_rate, pcm_format='f32le'):
+        """Буфер из сырого PCM ffmpeg ('f32le' или 's16le')."""
+        if pcm_format == 'f32le':
+            return cls(np.frombuffer(memoryview(data), dtype='<f4'), sample_rate)
+        if pcm_format == 's16le':
+            pcm = np.frombuffer(memoryview(data), dtype='<i2')
+            return cls(pcm * np.float32(1.0 / 32768), sample_rate)
+        raise ValueError(f"Неподдерживаемый формат PCM: {pcm_format}")
+
+    def pcm(self, pcm_format='f32le'):
+        """Сэмплы в формате PCM ffmpeg как memoryview ('f32le' или 's16le')."""
+        if pcm_format == 'f32le':
+            return memoryview(np.ascontiguousarray(self.samples, dtype='<f4')).cast('B')
+        if pcm_format == 's16le':
+            pcm = np.clip(self.samples, -1.0, 1.0) * np.float32(32767)
+            return memoryview(pcm.astype('<i2')).cast('B')
+        raise ValueError(f"Неподдерживаемый формат PCM: {pcm_format}")
+
+
+def decode_args(sample_rate, pcm_format='f32le', max_seconds=None):
+    """Аргументы ffmpeg: OGG/Opus из stdin -> моно PCM (f32le или s16le) в stdout.
+
+    max_seconds — декодировать только начало сообщения.
+    """
+    limit = ['-t', f"{max_seconds:g}"] if max_seconds else []
+    return [
+        '-i', 'pipe:0',
+        *limit,
+        '-f', pcm_format,
+        '-acodec', f"pcm_{pcm_format}",
+        '-ar', str(sample_rate),
+        '-ac', '1',
+        'pipe:1'
+    ]
+
+
+def encode_args(pcm_format, sample_rate):
+    """Аргументы ffmpeg: моно PCM из stdin -> OGG/Opus в stdout.
+
+    Частоты из OPUS_INPUT_RATES кодируются как есть, остальные приводятся к 48 кГц.
+    """
+    output_rate = sample_rate if sample_rate in OPUS_INPUT_RATES else OPUS_SAMPLE_RATE
+    return [
+        '-f', pcm_format,
+        '-ar', str(sample_rate),
+        '-ac', '1',
+        '-i', 'pipe:0',
+        '-acodec', 'libopus',
+        '-ar', str(output_rate),
+        '-ac', '1',
+        '-f', 'ogg',
+        'pipe:1'
+    ]
+
+
+def ogg_duration(ogg_data):
+    """Длительность OGG/Opus в секундах по гранулярной позиции последней страницы."""
+    last_page = ogg_data.rfind(b'OggS')
+    head = ogg_data.find(b'OpusHead')
+    if last_page < 0 or head < 0:
+        return 0.0
+    granule = int.from_bytes(ogg_data[last_page + 6:last_page + 14], 'little')
+    pre_skip = int.from_bytes(ogg_data[head + 10:head + 12], 'little')
+    # Позиция в Opus всегда считается на 48 кГц, начальные pre_skip сэмплов отбрасываются
+    return max(0, granule - pre_skip) / OPUS_SAMPLE_RATE
+
+
+async def run_ffmpeg(args, data, timeout):
+    """Прогоняет data через ffmpeg (stdin -> stdout) и возвращает вывод."""
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', *args,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(data), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise FfmpegError(f"ffmpeg не завершился за {timeout} сек")
+    if process.returncode != 0:
+        raise FfmpegError(f"Ошибка ffmpeg: {stderr.decode(errors='replace')}")
+    return stdout
+
+
+async def decode_voice(ogg_data, timeout, sample_rate=PROCESSING_SAMPLE_RATE, pcm_format='f32le', max_seconds=None):
+    """Декодирует OGG/Opus (или первые max_seconds секунд) в моно AudioBuffer."""
+    pcm = await run_ffmpeg(decode_args(sample_rate, pcm_format, max_seconds), ogg_data, timeout)
+    audio = AudioBuffer.from_pcm(pcm, sample_rate, pcm_format)
+    logger.debug(f"Декодировано {len(audio)} сэмплов с частотой {sample_rate}")
+    return audio
+
+
+async def encode_voice(audio, timeout, pcm_format='f32le'):
+    """Кодирует AudioBuffer в OGG/Opus для send_voice."""
+    ogg_data = await run_ffmpeg(encode_args(pcm_format, audio.sample_rate), audio.pcm(pcm_format), timeout)
+    logger.debug(f"Закодировано в OGG: {len(ogg_data)} байт")
+    return ogg_data
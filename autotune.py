@@ -0,0 +1,124 @@
+"""Автотюн на вокодере WORLD (pyworld).
+
+F0 извлекается через harvest (качественный режим) или dio + stonemask
+(быстрый режим), притягивается к нотам тональности и голос
+ресинтезируется через synthesize с исходными огибающей и апериодичностью.
+В быстром режиме кадры вдвое длиннее, а вместо дорогого d4c апериодичность
+берётся из флага вокализации (0 для голоса, 1 для шума).
+"""
+import numpy as np
+import pyworld as pw
+
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+SCALES = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),
+    'chromatic': tuple(range(12)),
+}
+
+# Диапазон поиска F0 (C2 - C7, как в прежней реализации на pyin)
+F0_FLOOR = 65.4
+F0_CEIL = 2093.0
+FRAME_PERIOD = 5.0
+FAST_FRAME_PERIOD = 10.0
+
+
+def hz_to_midi(f0):
+    return 69.0 + 12.0 * np.log2(f0 / 440.0)
+
+
+def midi_to_hz(midi):
+    return 440.0 * np.power(2.0, (midi - 69.0) / 12.0)
+
+
+def parse_key(value):
+    """Разбирает строку вида 'C# minor' в (тоника, лад); 'auto' или пустая строка -> None."""
+    if not value or value.strip().lower() == 'auto':
+        return None
+    parts = value.split()
+    tonic = NOTE_NAMES.index(parts[0].upper())
+    scale = parts[1].lower() if len(parts) > 1 else 'major'
+    if scale not in SCALES:
+        raise ValueError(f"Неизвестный лад: {scale}")
+    return tonic, scale
+
+
+def extract_f0(samples, sample_rate, fast=False):
+    """Возвращает (f0, t); 0 в невокализованных кадрах."""
+    x = np.ascontiguousarray(samples, dtype=np.float64)
+    if fast:
+        f0, t = pw.dio(x, sample_rate, f0_floor=F0_FLOOR, f0_ceil=F0_CEIL, frame_period=FAST_FRAME_PERIOD)
+        f0 = pw.stonemask(x, f0, t, sample_rate)
+    else:
+        f0, t = pw.harvest(x, sample_rate, f0_floor=F0_FLOOR, f0_ceil=F0_CEIL, frame_period=FRAME_PERIOD)
+    return f0, t
+
+
+def extract_envelopes(x, f0, t, sample_rate, fast=False):
+    """Возвращает (спектральная огибающая, апериодичность) для кадров F0.
+
+    В быстром режиме апериодичность берётся из флага вокализации вместо d4c.
+    """
+    spectral_envelope = pw.cheaptrick(x, f0, t, sample_rate)
+    if fast:
+        aperiodicity = np.where((f0 > 0)[:, None], 0.0, 1.0) * np.ones_like(spectral_envelope)
+    else:
+        aperiodicity = pw.d4c(x, f0, t, sample_rate)
+    return spectral_envelope, aperiodicity
+
+
+def resynthesize(f0, spectral_envelope, aperiodicity, sample_rate, length, fast=False):
+    """Синтезирует голос с новой F0 и приводит его к length сэмплам float32."""
+    frame_period = FAST_FRAME_PERIOD if fast else FRAME_PERIOD
+    y = pw.synthesize(f0, spectral_envelope, aperiodicity, sample_rate, frame_period=frame_period)
+    if len(y) < length:
+        y = np.pad(y, (0, length - len(y)))
+    return y[:length].astype(np.float32)
+
+
+def detect_key(f0):
+    """Подбирает тонику и лад, в которые попадает больше всего вокализованных кадров."""
+    voiced = f0[f0 > 0]
+    if not len(voiced):
+        return 0, 'chromatic'
+    pitch_classes = np.round(hz_to_midi(voiced)).astype(int) % 12
+    histogram = np.bincount(pitch_classes, minlength=12)
+    best = None
+    for scale in ('major', 'minor'):
+        for tonic in range(12):
+            score = histogram[[(tonic + step) % 12 for step in SCALES[scale]]].sum()
+            if best is None or score > best[0]:
+                best = (score, tonic, scale)
+    return best[1], best[2]
+
+
+def snap_to_scale(f0, tonic, scale, strength=1.0):
+    """Притягивает вокализованные кадры F0 к ближайшим нотам лада."""
+    snapped = f0.copy()
+    voiced = f0 > 0
+    if not voiced.any():
+        return snapped
+    midi = hz_to_midi(f0[voiced])
+    classes = np.array([(tonic + step) % 12 for step in SCALES[scale]], dtype=np.float64)
+    # Для каждого кадра ближайшая нота каждого класса, затем ближайшая из них
+    candidates = classes[None, :] + 12.0 * np.round((midi[:, None] - classes[None, :]) / 12.0)
+    nearest = candidates[np.arange(len(midi)), np.argmin(np.abs(candidates - midi[:, None]), axis=1)]
+    snapped[voiced] = midi_to_hz(midi + strength * (nearest - midi))
+    return snapped
+
+
+def autotune(samples, sample_rate, key=None, fast=False, strength=1.0, shift_semitones=0.0):
+    """Автотюн сигнала.
+
+    key — (тоника, лад) или None для автоопределения по F0.
+    shift_semitones — дополнительная транспозиция после коррекции.
+    """
+    x = np.ascontiguousarray(samples, dtype=np.float64)
+    f0, t = extract_f0(x, sample_rate, fast=fast)
+    tonic, scale = key if key is not None else detect_key(f0)
+    target = snap_to_scale(f0, tonic, scale, strength)
+    if shift_semitones:
+        target = target * 2.0 ** (shift_semitones / 12.0)
+    spectral_envelope, aperiodicity = extract_envelopes(x, f0, t, sample_rate, fast=fast)
+    return resynthesize(target, spectral_envelope, aperiodicity, sample_rate, len(x), fast=fast)
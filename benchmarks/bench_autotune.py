@@ -0,0 +1,57 @@
+"""Сравнение скорости автотюна: прежний путь librosa.pyin + pitch_shift и WORLD.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_autotune.py --durations 5 30 60
+"""
+import argparse
+import time
+import librosa
+
+from common import synthetic_voice
+import autotune
+import effects
+
+
+def legacy_pyin_path(samples, sample_rate):
+    """Прежняя реализация: pyin (результат не использовался) и сдвиг на 12/24 октавы."""
+    librosa.pyin(
+        samples,
+        fmin=librosa.note_to_hz('C2'),
+        fmax=librosa.note_to_hz('C7'),
+        frame_length=2048,
+        hop_length=512
+    )
+    return librosa.effects.pitch_shift(samples, sr=sample_rate, n_steps=12, bins_per_octave=24)
+
+
+def world_quality(samples, sample_rate):
+    return autotune.autotune(samples, sample_rate, fast=False, shift_semitones=6.0)
+
+
+def world_fast(samples, sample_rate):
+    return autotune.autotune(samples, sample_rate, fast=True, shift_semitones=6.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--durations', type=float, nargs='+', default=[5.0, 30.0])
+    parser.add_argument('--sample-rate', type=int, default=effects.EFFECT_SAMPLE_RATES['autotune'])
+    parser.add_argument('--skip-legacy', action='store_true', help='не запускать медленный путь pyin')
+    args = parser.parse_args()
+
+    engines = [('world-fast', world_fast), ('world-quality', world_quality)]
+    if not args.skip_legacy:
+        engines.append(('pyin+pitch_shift', legacy_pyin_path))
+
+    print(f"{'движок':<20}{'длина, с':>10}{'время, с':>12}{'RTF':>10}")
+    for duration in args.durations:
+        samples = synthetic_voice(duration, args.sample_rate)
+        for name, engine in engines:
+            started = time.perf_counter()
+            engine(samples, args.sample_rate)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<20}{duration:>10.1f}{elapsed:>12.2f}{elapsed / duration:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
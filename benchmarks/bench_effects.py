@@ -0,0 +1,199 @@
+"""Бенчмарк эффектов и кодека на синтетическом голосе разной длины.
+
+Каждое измерение выполняется в отдельном процессе, чтобы пиковый RSS
+относился только к нему. Результаты можно сохранить как базовую линию
+и сравнивать с ней последующие запуски:
+
+    python benchmarks/bench_effects.py --save benchmarks/baseline.json
+    python benchmarks/bench_effects.py --compare benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+from common import synthetic_voice
+import audio_io
+import config
+import effects
+import filtergraph
+import streaming
+
+SAMPLE_RATE = audio_io.PROCESSING_SAMPLE_RATE
+DEFAULT_DURATIONS = [1.0, 10.0, 60.0, 600.0]
+FFMPEG_TIMEOUT = 600.0
+
+
+def _change_pitch_up(samples, ogg_data):
+    return effects.change_pitch(audio_io.AudioBuffer(samples, SAMPLE_RATE), 4)
+
+
+def _decode(samples, ogg_data):
+    return asyncio.run(audio_io.decode_voice(ogg_data, FFMPEG_TIMEOUT, SAMPLE_RATE))
+
+
+def _encode(samples, ogg_data):
+    return asyncio.run(audio_io.encode_voice(audio_io.AudioBuffer(samples, SAMPLE_RATE), FFMPEG_TIMEOUT))
+
+
+def _effect(effect):
+    def run(samples, ogg_data):
+        return effects.EFFECT_FUNCTIONS[effect](audio_io.AudioBuffer(samples, effects.processing_rate(effect)))
+    return run
+
+
+def _stream(effect):
+    def run(samples, ogg_data):
+        return streaming.render_stream(ogg_data, effect, effects.processing_rate(effect),
+                                       config.STREAM_BLOCK_SECONDS, FFMPEG_TIMEOUT)
+    return run
+
+
+def _pipeline(effect):
+    """OGG -> OGG через NumPy, как в боте: декодирование, эффект, кодирование."""
+    def run(samples, ogg_data):
+        audio = asyncio.run(audio_io.decode_voice(ogg_data, FFMPEG_TIMEOUT, effects.processing_rate(effect)))
+        processed, _ = effects.render_effect(audio, effect)
+        return asyncio.run(audio_io.encode_voice(processed, FFMPEG_TIMEOUT))
+    return run
+
+
+def _filtergraph(effect):
+    def run(samples, ogg_data):
+        return filtergraph.render_filtergraph(ogg_data, effect, effects.processing_rate(effect), FFMPEG_TIMEOUT)
+    return run
+
+
+# Имя -> (функция, нужен ли готовый OGG, частота входного PCM)
+BENCHMARKS = {
+    'robot': (_effect('robot'), False, effects.processing_rate('robot')),
+    'musical': (_effect('musical'), False, effects.processing_rate('musical')),
+    'autotune': (_effect('autotune'), False, effects.processing_rate('autotune')),
+    'rough': (_effect('rough'), False, effects.processing_rate('rough')),
+    'pitch_up': (_effect('pitch_up'), False, effects.processing_rate('pitch_up')),
+    'change_pitch': (_change_pitch_up, False, SAMPLE_RATE),
+    'ffmpeg_decode': (_decode, True, SAMPLE_RATE),
+    'ffmpeg_encode': (_encode, False, SAMPLE_RATE),
+    # Потоковая обработка: OGG -> OGG с декодированием и кодированием внутри
+    'stream_robot': (_stream('robot'), True, SAMPLE_RATE),
+    'stream_autotune': (_stream('autotune'), True, SAMPLE_RATE),
+    'stream_pitch_up': (_stream('pitch_up'), True, SAMPLE_RATE),
+    # Бэкенды эффекта от OGG до OGG: NumPy против одного фильтрграфа ffmpeg
+    'pipeline_robot': (_pipeline('robot'), True, SAMPLE_RATE),
+    'pipeline_musical': (_pipeline('musical'), True, SAMPLE_RATE),
+    'pipeline_rough': (_pipeline('rough'), True, SAMPLE_RATE),
+    'filtergraph_robot': (_filtergraph('robot'), True, SAMPLE_RATE),
+    'filtergraph_musical': (_filtergraph('musical'), True, SAMPLE_RATE),
+    'filtergraph_rough': (_filtergraph('rough'), True, SAMPLE_RATE),
+}
+
+
+def _current_rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def _prepare_ogg(duration):
+    """Готовит OGG в родительском процессе, чтобы PCM не попадал в пиковый RSS измерения."""
+    return _encode(synthetic_voice(duration, SAMPLE_RATE), None)
+
+
+def _measure(name, duration, ogg_data, connection):
+    """Выполняется в дочернем процессе: одно измерение с замером памяти."""
+    function, needs_ogg, sample_rate = BENCHMARKS[name]
+    samples = None if needs_ogg else synthetic_voice(duration, sample_rate)
+    rss_before = _current_rss_kb()
+    started = time.perf_counter()
+    function(samples, ogg_data)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    connection.send({
+        'wall_seconds': elapsed,
+        'rtf': elapsed / duration,
+        'peak_rss_mb': peak / 1024.0,
+        'peak_rss_delta_mb': max(0, peak - rss_before) / 1024.0,
+    })
+    connection.close()
+
+
+def run_one(name, duration, ogg_data=None):
+    context = multiprocessing.get_context('fork')
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(name, duration, ogg_data, child))
+    process.start()
+    child.close()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Печатает изменения относительно базовой линии; возвращает число регрессий."""
+    regressions = 0
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        ratio = current['wall_seconds'] / previous['wall_seconds'] if previous['wall_seconds'] else 1.0
+        memory_ratio = (current['peak_rss_delta_mb'] / previous['peak_rss_delta_mb']
+                        if previous['peak_rss_delta_mb'] else 1.0)
+        flag = ''
+        if ratio > 1.0 + tolerance or memory_ratio > 1.0 + tolerance:
+            flag = '  <-- регрессия'
+            regressions += 1
+        print(f"{key:<28} время x{ratio:.2f}  память x{memory_ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=DEFAULT_DURATIONS)
+    parser.add_argument('--repeat', type=int, default=1, help='повторов на измерение (берётся лучшее время)')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='запустить только эти измерения')
+    parser.add_argument('--save', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', help='сравнить с сохранённой базовой линией')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='допустимое замедление (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    effects.preload_waveforms()
+    # Измерения наследуют прогретый процесс, как задачи в рабочих процессах бота
+    effects.warm_up()
+    names = args.only or list(BENCHMARKS)
+    results = {}
+    print(f"{'измерение':<20}{'длина, с':>10}{'время, с':>12}{'RTF':>10}{'пик RSS, МБ':>14}{'прирост, МБ':>14}")
+    for duration in args.durations:
+        ogg_data = _prepare_ogg(duration) if any(BENCHMARKS[name][1] for name in names) else None
+        for name in names:
+            runs = [run_one(name, duration, ogg_data) for _ in range(max(1, args.repeat))]
+            result = min(runs, key=lambda run: run['wall_seconds'])
+            results[f"{name}@{duration:g}s"] = result
+            print(f"{name:<20}{duration:>10g}{result['wall_seconds']:>12.3f}{result['rtf']:>10.4f}"
+                  f"{result['peak_rss_mb']:>14.1f}{result['peak_rss_delta_mb']:>14.1f}")
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results,
+            }, output, indent=2, sort_keys=True)
+        print(f"Результаты сохранены в {args.save}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Найдено регрессий: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""Общие утилиты бенчмарков: синтетический голос и путь к модулям бота."""
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def synthetic_voice(duration, sample_rate, seed=0):
+    """Гармонический сигнал с плавающей F0, слогами и шумом, похожий на речь."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    f0 = 140.0 + 30.0 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3.0 * t) ** 2
+    signal = 0.2 * envelope * voice + 0.01 * rng.standard_normal(len(t))
+    return signal.astype(np.float32)
+
+
+def percentile(values, q):
+    """Перцентиль q (0-100) списка значений."""
+    return float(np.percentile(values, q)) if len(values) else 0.0
@@ -0,0 +1,278 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Небольшой HTTP/1.1 сервер на asyncio (с keep-alive, как у настоящего Bot API)
+реализует методы, которые вызывает бот: getMe, getUpdates (long polling),
+getFile и скачивание файла, sendMessage, sendVoice, sendAudio, sendMediaGroup,
+editMessageText, editMessageMedia, answerCallbackQuery и deleteMessage;
+остальные методы отвечают true. Голосовые отдаются из заранее подготовленных
+OGG/Opus: file_id вида '<имя>:<что угодно>' скачивается как файл voices[имя].
+С edit_media=False editMessageMedia отвечает ошибкой 400, как если бы
+Telegram не позволял заменить голосовое.
+
+inject_error заставляет следующие вызовы метода ответить 429 с retry_after
+или 5xx (телом не в JSON, как от прокси), чтобы проверить повторы клиента.
+Для каждого метода запоминается, через какие соединения он вызывался
+(connections), — так видно, в какой пул соединений попал запрос.
+
+Обновления для бота кладутся через push_update. О каждом вызове бота
+сообщается функции on_call(method, params, result), чтобы тест мог
+дождаться клавиатуры или результата в нужном чате.
+"""
+import asyncio
+import collections
+import email
+import itertools
+import json
+import logging
+import time
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Voicer', 'username': 'voicer_load_test_bot'}
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class ApiError(Exception):
+    """Ответ Bot API с ошибкой: ok=false, error_code и description."""
+
+    def __init__(self, code, description):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+class _Request:
+    __slots__ = ('method', 'path', 'headers', 'body')
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+
+async def _read_request(reader):
+    """Читает один запрос соединения; None, если клиент закрыл соединение."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path = request_line.decode('latin-1').split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b''.join(chunks)
+    else:
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Слишком большой запрос: {length} байт")
+        body = await reader.readexactly(length) if length else b''
+    return _Request(method, path.split('?')[0], headers, body)
+
+
+def parse_params(request):
+    """Параметры метода из тела запроса: form-urlencoded, multipart или JSON.
+
+    Для файлов multipart вместо содержимого возвращается его размер в байтах.
+    """
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(request.body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + request.body)
+        params = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            params[name] = len(payload) if part.get_filename() else payload.decode()
+        return params
+    return dict(parse_qsl(request.body.decode()))
+
+
+def _json_param(params, name):
+    value = params.get(name)
+    return json.loads(value) if isinstance(value, str) and value[:1] in '[{' else value
+
+
+class FakeBotApi:
+    """Заглушка Bot API: voices — {имя: (OGG, длительность в секундах)}."""
+
+    def __init__(self, voices, on_call=None, edit_media=True):
+        self.voices = voices
+        self.on_call = on_call
+        self.edit_media = edit_media
+        self.calls = collections.Counter()
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000000)
+        self._file_ids = itertools.count(1)
+        self._connection_ids = itertools.count(1)
+        self._faults = collections.defaultdict(collections.deque)
+        self.connections = collections.defaultdict(set)
+        self._new_updates = asyncio.Condition()
+        self._server = None
+
+    async def push_update(self, update):
+        """Ставит обновление в очередь getUpdates; возвращает его update_id."""
+        update = dict(update, update_id=next(self._update_ids))
+        async with self._new_updates:
+            self._updates.append(update)
+            self._new_updates.notify_all()
+        return update['update_id']
+
+    def inject_error(self, method, code, count=1, retry_after=None):
+        """Следующие count вызовов method ('file' — скачивание файла) отвечают ошибкой code."""
+        for _ in range(count):
+            self._faults[method].append((code, retry_after))
+
+    def _fault_response(self, endpoint):
+        if not self._faults[endpoint]:
+            return None
+        code, retry_after = self._faults[endpoint].popleft()
+        if code >= 500:
+            return f"{code} Error", 'text/html', f"<html><body>{code} Error</body></html>".encode()
+        body = {'ok': False, 'error_code': code, 'description': f"Too Many Requests: retry after {retry_after}"}
+        if retry_after is not None:
+            body['parameters'] = {'retry_after': retry_after}
+        return f"{code} Error", 'application/json', json.dumps(body).encode()
+
+    def _message(self, params, **fields):
+        chat_id = int(params.get('chat_id', 0))
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': BOT_USER,
+        }
+        message.update(fields)
+        return message
+
+    def _sent_file(self, kind):
+        index = next(self._file_ids)
+        return {'file_id': f"{kind}-{index}", 'file_unique_id': f"{kind}-u{index}", 'duration': 1}
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        async with self._new_updates:
+            # Подтверждённые ботом обновления (update_id < offset) больше не нужны
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+            limit = int(params.get('limit') or 100)
+            return self._updates[:limit]
+
+    async def call(self, method, params):
+        """Результат метода Bot API (поле result ответа)."""
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'getFile':
+            name = params['file_id'].split(':')[0]
+            ogg_data, _ = self.voices[name]
+            return {
+                'file_id': params['file_id'],
+                'file_unique_id': params['file_id'],
+                'file_size': len(ogg_data),
+                'file_path': f"voice/{name}.oga",
+            }
+        if method == 'sendMessage':
+            fields = {'text': params.get('text', '')}
+            if params.get('reply_markup'):
+                fields['reply_markup'] = _json_param(params, 'reply_markup')
+            return self._message(params, **fields)
+        if method == 'sendVoice':
+            return self._message(params, voice=self._sent_file('voice'), caption=params.get('caption', ''))
+        if method == 'sendAudio':
+            return self._message(params, audio=self._sent_file('audio'), caption=params.get('caption', ''))
+        if method == 'sendMediaGroup':
+            media = _json_param(params, 'media') or []
+            return [self._message(params, audio=self._sent_file('audio'), caption=item.get('caption', ''))
+                    for item in media]
+        if method == 'editMessageText':
+            message = self._message(params, text=params.get('text', ''))
+            message['message_id'] = int(params.get('message_id', message['message_id']))
+            return message
+        if method == 'editMessageMedia':
+            if not self.edit_media:
+                raise ApiError(400, "Bad Request: message can't be edited")
+            media = _json_param(params, 'media') or {}
+            message = self._message(params, audio=self._sent_file('audio'), caption=media.get('caption', ''))
+            message['message_id'] = int(params.get('message_id', message['message_id']))
+            return message
+        # answerCallbackQuery, deleteMessage, deleteWebhook и прочие
+        return True
+
+    async def _respond(self, request, connection):
+        is_file = request.method == 'GET' and request.path.startswith('/file/')
+        endpoint = 'file' if is_file else request.path.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        self.connections[endpoint].add(connection)
+        fault = self._fault_response(endpoint)
+        if fault is not None:
+            return fault
+        if is_file:
+            name = request.path.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+            if name not in self.voices:
+                return '404 Not Found', 'text/plain', b'not found'
+            return '200 OK', 'audio/ogg', self.voices[name][0]
+        method = endpoint
+        params = parse_params(request)
+        try:
+            result = await self.call(method, params)
+        except ApiError as e:
+            body = {'ok': False, 'error_code': e.code, 'description': e.description}
+            return f"{e.code} Error", 'application/json', json.dumps(body).encode()
+        if self.on_call is not None:
+            self.on_call(method, params, result)
+        return '200 OK', 'application/json', json.dumps({'ok': True, 'result': result}).encode()
+
+    async def _handle(self, reader, writer):
+        connection = next(self._connection_ids)
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                status, content_type, body = await self._respond(request, connection)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            logger.debug(f"Соединение с заглушкой Bot API закрыто: {str(e)}")
+        except asyncio.CancelledError:
+            # Незавершённый long polling при остановке теста
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,364 @@
+"""Нагрузочный тест бота целиком: настоящий main.py против заглушки Bot API.
+
+Бот запускается отдельным процессом (python main.py) с TELEGRAM_API_URL,
+указывающим на локальную заглушку (fake_bot_api.py), поэтому работают все
+его части: long polling, обработчики Application, пул рендеринга, ffmpeg,
+отправка результатов. Каждый сценарий — один пользователь в своём чате:
+ответ на голосовое с упоминанием бота, затем нажатие кнопки эффекта.
+Сценарии запускаются с заданной частотой независимо от того, успел ли бот
+ответить на предыдущие.
+
+Задержка сценария — от нажатия кнопки до удаления ботом сообщения с кнопками
+после отправки результата; время до первого звука — до первого sendVoice
+(предпросмотра при прогрессивной отправке), sendAudio или sendMediaGroup. Ошибкой
+считается сообщение об ошибке в editMessageText, отказом — ответ «бот
+перегружен» на нажатие, таймаутом — отсутствие результата за --timeout
+секунд. По каждому эффекту печатаются p50/p95/p99 задержки, время до первого
+звука, пропускная способность и доля ошибок.
+
+Сценарии строятся из синтетических голосовых (--durations) или из
+записанных обновлений (--updates, JSON Lines с объектами Update, например
+из getUpdates): каждое нажатие кнопки сопоставляется последнему ответу на
+голосовое в том же чате, голосовое заменяется подготовленным той же длины.
+
+    python benchmarks/load_test.py --scenarios 200 --rate 5 --durations 5 30
+    python benchmarks/load_test.py --effects robot all --bot-env RENDER_WORKERS=4
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, percentile, synthetic_voice
+from fake_bot_api import BOT_USER, FakeBotApi
+import audio_io
+import effects
+
+TOKEN = '123456:load-test'
+CHAT_ID_BASE = 100000
+# Тексты хода обработки в сообщении с кнопками, а не ошибки
+PROGRESS_PREFIXES = ('Ваш запрос в очереди', 'Обработка')
+ENCODE_TIMEOUT = 600.0
+DEFAULT_DURATIONS = [5.0, 20.0]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Scenario:
+    """Один пользователь: голосовое, эффект и ожидаемые ответы бота."""
+
+    def __init__(self, index, voice, effect, reuse_voice=False):
+        self.index = index
+        self.chat_id = CHAT_ID_BASE + index
+        self.voice = voice
+        self.effect = effect
+        self.reuse_voice = reuse_voice
+        loop = asyncio.get_running_loop()
+        self.keyboard = loop.create_future()
+        self.outcome = loop.create_future()
+        self.clicked = None
+        self.keyboard_latency = None
+        self.latency = None
+        self.first_audio = None
+
+    def voice_message(self):
+        name, duration = self.voice
+        # Уникальный file_unique_id, чтобы результат не брался из кэша бота
+        unique_id = name if self.reuse_voice else f"{name}-{self.index}"
+        return {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': self.chat_id, 'type': 'private'},
+            'from': self.user(),
+            'voice': {'file_id': f"{name}:{self.index}", 'file_unique_id': unique_id,
+                      'duration': int(round(duration)), 'mime_type': 'audio/ogg'},
+        }
+
+    def user(self):
+        return {'id': self.chat_id, 'is_bot': False, 'first_name': f"user{self.index}"}
+
+    def reply_update(self):
+        mention = f"@{BOT_USER['username']}"
+        return {'message': {
+            'message_id': 2,
+            'date': int(time.time()),
+            'chat': {'id': self.chat_id, 'type': 'private'},
+            'from': self.user(),
+            'text': mention,
+            'entities': [{'type': 'mention', 'offset': 0, 'length': len(mention)}],
+            'reply_to_message': self.voice_message(),
+        }}
+
+    def callback_update(self, keyboard_message):
+        return {'callback_query': {
+            'id': str(self.index),
+            'from': self.user(),
+            'chat_instance': str(self.chat_id),
+            'message': keyboard_message,
+            'data': self.effect,
+        }}
+
+    def resolve(self, outcome):
+        if not self.outcome.done():
+            if outcome == 'ok':
+                self.latency = time.perf_counter() - self.clicked
+            self.outcome.set_result(outcome)
+
+
+class Harness:
+    """Связывает вызовы бота к заглушке со сценариями по chat_id."""
+
+    def __init__(self):
+        self.scenarios = {}
+        self.errors = collections.Counter()
+
+    def on_call(self, method, params, result):
+        if method == 'answerCallbackQuery':
+            # В ответе на нажатие нет chat_id: id нажатия — номер сценария
+            chat_id = CHAT_ID_BASE + int(params.get('callback_query_id') or -CHAT_ID_BASE)
+        else:
+            chat_id = int(params.get('chat_id') or 0)
+        scenario = self.scenarios.get(chat_id)
+        if scenario is None:
+            return
+        if method == 'sendMessage' and 'reply_markup' in result and not scenario.keyboard.done():
+            scenario.keyboard.set_result(result)
+        elif method in ('sendVoice', 'sendAudio', 'sendMediaGroup'):
+            if scenario.first_audio is None and scenario.clicked is not None:
+                scenario.first_audio = time.perf_counter() - scenario.clicked
+        elif method == 'deleteMessage' and scenario.first_audio is not None:
+            # Сообщение с кнопками удаляется после отправки полного результата
+            scenario.resolve('ok')
+        elif method == 'editMessageText' and scenario.clicked is not None:
+            text = params.get('text', '')
+            if not text.startswith(PROGRESS_PREFIXES):
+                self.errors[text] += 1
+                scenario.resolve('error')
+        elif method == 'answerCallbackQuery' and params.get('text'):
+            self.errors[params['text']] += 1
+            scenario.resolve('rejected')
+
+    async def run(self, api, scenario, timeout):
+        self.scenarios[scenario.chat_id] = scenario
+        started = time.perf_counter()
+        try:
+            await api.push_update(scenario.reply_update())
+            keyboard = await asyncio.wait_for(asyncio.shield(scenario.keyboard), timeout)
+            scenario.keyboard_latency = time.perf_counter() - started
+            scenario.clicked = time.perf_counter()
+            await api.push_update(scenario.callback_update(keyboard))
+            await asyncio.wait_for(asyncio.shield(scenario.outcome), timeout)
+        except asyncio.TimeoutError:
+            scenario.resolve('timeout')
+
+
+def prepare_voices(durations, paths):
+    """Подготовленные голосовые: {имя: (OGG, длительность)}."""
+    voices = {}
+    for duration in durations:
+        pcm = audio_io.AudioBuffer(synthetic_voice(duration, audio_io.OPUS_SAMPLE_RATE), audio_io.OPUS_SAMPLE_RATE)
+        voices[f"synthetic{duration:g}s"] = (
+            asyncio.run(audio_io.encode_voice(pcm, ENCODE_TIMEOUT)), duration
+        )
+    for path in paths:
+        with open(path, 'rb') as source:
+            ogg_data = source.read()
+        voices[os.path.splitext(os.path.basename(path))[0].replace(':', '_')] = (
+            ogg_data, audio_io.ogg_duration(ogg_data)
+        )
+    return voices
+
+
+def nearest_voice(voices, duration):
+    return min(voices.items(), key=lambda item: abs(item[1][1] - duration))[0]
+
+
+def recorded_plan(path, voices):
+    """(голосовое, эффект) для каждого нажатия кнопки из записанных обновлений."""
+    replies = {}
+    plan = []
+    with open(path) as source:
+        for line in source:
+            line = line.strip()
+            if not line:
+                continue
+            update = json.loads(line)
+            message = update.get('message') or {}
+            voice = (message.get('reply_to_message') or {}).get('voice')
+            if voice is not None:
+                replies[message['chat']['id']] = nearest_voice(voices, voice.get('duration', 0))
+                continue
+            query = update.get('callback_query')
+            if query and query.get('data'):
+                chat_id = ((query.get('message') or {}).get('chat') or {}).get('id')
+                if chat_id in replies:
+                    plan.append((replies[chat_id], query['data']))
+    return plan
+
+
+def synthetic_plan(voices, effect_ids, count, seed):
+    rng = random.Random(seed)
+    names = list(voices)
+    return [(rng.choice(names), effect_ids[index % len(effect_ids)]) for index in range(count)]
+
+
+async def scrape_metrics(port):
+    """Текст эндпоинта /metrics бота или пустая строка, если он недоступен."""
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        return ''
+    try:
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return response.partition(b'\r\n\r\n')[2].decode()
+
+
+async def wait_ready(process, metrics_port, timeout):
+    """Ждёт, пока рабочие процессы бота прогреются (метрика voicer_startup_seconds{phase="workers"})."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Бот завершился с кодом {process.returncode}")
+        if 'phase="workers"' in await scrape_metrics(metrics_port):
+            return
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Бот не прогрелся за {timeout} сек")
+
+
+def start_bot(api_port, metrics_port, extra_env, workdir):
+    env = dict(os.environ)
+    env.update(
+        TELEGRAM_TOKEN=TOKEN,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+        METRICS_HOST='127.0.0.1',
+        METRICS_PORT=str(metrics_port),
+        UPDATE_MODE='polling',
+        RUN_MODE='single',
+        INLINE_STORAGE_CHAT_ID='0',
+    )
+    env.update(extra_env)
+    log = open(os.path.join(workdir, 'stderr.log'), 'wb')
+    # Рабочий каталог — временный, чтобы bot.log и файлы SQLite не попали в репозиторий
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+async def stop_bot(process, timeout=30.0):
+    """Останавливает бота по SIGINT; заглушка продолжает отвечать, пока он завершается."""
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        deadline = time.monotonic() + timeout
+        while process.poll() is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def report(scenarios, elapsed, errors):
+    by_effect = collections.defaultdict(list)
+    for scenario in scenarios:
+        by_effect[scenario.effect].append(scenario)
+    by_effect['итого'] = list(scenarios)
+    print(f"{'эффект':<12}{'всего':>7}{'ok':>6}{'ошибки':>8}{'отказы':>8}{'таймауты':>10}"
+          f"{'p50, с':>9}{'p95, с':>9}{'p99, с':>9}{'звук p50':>10}{'звук p95':>10}{'в сек':>8}{'ошибок':>8}")
+    for effect, group in by_effect.items():
+        outcomes = collections.Counter(scenario.outcome.result() for scenario in group)
+        latencies = [scenario.latency for scenario in group if scenario.latency is not None]
+        first_audio = [scenario.first_audio for scenario in group if scenario.first_audio is not None]
+        failed = len(group) - outcomes['ok']
+        print(f"{effect:<12}{len(group):>7}{outcomes['ok']:>6}{outcomes['error']:>8}{outcomes['rejected']:>8}"
+              f"{outcomes['timeout']:>10}{percentile(latencies, 50):>9.2f}{percentile(latencies, 95):>9.2f}"
+              f"{percentile(latencies, 99):>9.2f}{percentile(first_audio, 50):>10.2f}{percentile(first_audio, 95):>10.2f}"
+              f"{outcomes['ok'] / elapsed:>8.2f}{failed / len(group):>8.1%}")
+    keyboard = [scenario.keyboard_latency for scenario in scenarios if scenario.keyboard_latency is not None]
+    if keyboard:
+        print(f"Клавиатура эффектов, с: p50 {percentile(keyboard, 50):.3f}, p95 {percentile(keyboard, 95):.3f}, "
+              f"p99 {percentile(keyboard, 99):.3f}")
+    for text, count in errors.most_common():
+        print(f"  {count} x {text}")
+
+
+async def run(args, voices, plan):
+    harness = Harness()
+    api = FakeBotApi(voices, on_call=harness.on_call, edit_media=not args.no_edit_media)
+    api_port = await api.start('127.0.0.1', args.port)
+    metrics_port = free_port()
+    workdir = tempfile.mkdtemp(prefix='voicer-load-')
+    extra_env = dict(item.split('=', 1) for item in args.bot_env)
+    process = start_bot(api_port, metrics_port, extra_env, workdir)
+    print(f"Бот запущен (pid {process.pid}), журнал: {workdir}")
+    try:
+        await wait_ready(process, metrics_port, args.startup_timeout)
+        print(f"Бот готов, сценариев: {len(plan)}, частота: {args.rate:g} в сек")
+        scenarios = [Scenario(index, (name, voices[name][1]), effect, args.reuse_voices)
+                     for index, (name, effect) in enumerate(plan)]
+        tasks = []
+        started = time.perf_counter()
+        for scenario in scenarios:
+            tasks.append(asyncio.create_task(harness.run(api, scenario, args.timeout)))
+            await asyncio.sleep(1.0 / args.rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        report(scenarios, elapsed, harness.errors)
+        tiers = [line for line in (await scrape_metrics(metrics_port)).splitlines()
+                 if line.startswith('voicer_render_tier_total{')]
+        if tiers:
+            print("Уровни качества: " + ', '.join(line.split('{', 1)[1].replace('"', '').replace('}', ':') for line in tiers))
+        print(f"Запросов к заглушке: {dict(api.calls)}")
+    finally:
+        await stop_bot(process)
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', type=int, default=50, help='сколько сценариев без --updates')
+    parser.add_argument('--rate', type=float, default=2.0, help='сценариев в секунду')
+    parser.add_argument('--effects', nargs='+', default=list(effects.EFFECT_FUNCTIONS),
+                        help="эффекты по кругу; 'all' — все эффекты сразу")
+    parser.add_argument('--durations', type=float, nargs='+',
+                        help='длительности синтетических голосовых в секундах (по умолчанию 5 и 20 без --voice)')
+    parser.add_argument('--voice', nargs='*', default=[], help='свои OGG/Opus файлы голосовых')
+    parser.add_argument('--updates', help='файл JSON Lines с записанными обновлениями')
+    parser.add_argument('--reuse-voices', action='store_true',
+                        help='одинаковые голосовые у всех сценариев (проверяет кэш результатов)')
+    parser.add_argument('--timeout', type=float, default=120.0, help='ожидание результата сценария, сек')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--port', type=int, default=0, help='порт заглушки Bot API (0 — любой свободный)')
+    parser.add_argument('--bot-env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help='переменные окружения бота, например RENDER_WORKERS=4')
+    parser.add_argument('--no-edit-media', action='store_true',
+                        help='editMessageMedia отвечает ошибкой: предпросмотр не заменяется, а дополняется')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    durations = args.durations if args.durations or args.voice else DEFAULT_DURATIONS
+    voices = prepare_voices(durations or [], args.voice)
+    if args.updates:
+        plan = recorded_plan(args.updates, voices)
+    else:
+        plan = synthetic_plan(voices, args.effects, args.scenarios, args.seed)
+    if not plan:
+        sys.exit("Нет сценариев для проигрывания")
+    asyncio.run(run(args, voices, plan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Проигрывает записанные обновления Telegram в вебхук бота.
+
+Обновления читаются из файла JSON Lines (по одному объекту Update в строке,
+например сохранённые из getUpdates) или генерируются как команды /start.
+Каждое отправляется POST-запросом с заголовком секретного токена, как это
+делает Telegram; в конце печатаются коды ответов и задержки:
+
+    UPDATE_MODE=webhook WEBHOOK_SECRET=test WEBHOOK_LISTEN=127.0.0.1 python main.py
+    python benchmarks/replay_webhook.py --secret test --count 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import httpx
+
+from common import percentile
+
+
+def synthetic_updates(count, chat_id=1000):
+    """Команды /start от разных пользователей."""
+    now = int(time.time())
+    for index in range(count):
+        user = {'id': chat_id + index, 'is_bot': False, 'first_name': f'user{index}'}
+        yield {
+            'update_id': index + 1,
+            'message': {
+                'message_id': index + 1,
+                'date': now,
+                'chat': {'id': chat_id + index, 'type': 'private'},
+                'from': user,
+                'text': '/start',
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+            },
+        }
+
+
+def recorded_updates(path):
+    with open(path) as source:
+        for line in source:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+async def replay(url, secret, updates, concurrency):
+    statuses = collections.Counter()
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def post(update):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=update, headers=headers)
+                    statuses[response.status_code] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - started
+    return statuses, latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default='', help='значение WEBHOOK_SECRET бота')
+    parser.add_argument('--updates', help='файл JSON Lines с записанными обновлениями')
+    parser.add_argument('--count', type=int, default=100, help='сколько команд /start сгенерировать без --updates')
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    updates = list(recorded_updates(args.updates) if args.updates else synthetic_updates(args.count))
+    statuses, latencies, elapsed = asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+    print(f"Отправлено обновлений: {len(updates)} за {elapsed:.2f} сек ({len(updates) / elapsed:.1f} в сек)")
+    print("Ответы: " + ', '.join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    if latencies:
+        print(f"Задержка, мс: p50 {percentile(latencies, 50) * 1000:.1f}, "
+              f"p95 {percentile(latencies, 95) * 1000:.1f}, p99 {percentile(latencies, 99) * 1000:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""HTTP-клиент Bot API: отдельные пулы соединений и повторы при 429/5xx.
+
+Методы Bot API, скачивание файлов и загрузка медиа идут через разные пулы
+соединений (httpx держит их открытыми между запросами), поэтому большие
+загрузки и скачивания не занимают соединения, нужные для answerCallbackQuery
+или editMessageText. getUpdates, как и в python-telegram-bot, использует
+свой объект запросов. Ответы 429 и 5xx повторяются с экспоненциальной
+задержкой со случайным разбросом; retry_after из ответа Telegram
+соблюдается, а если он больше max_wait, ошибка RetryAfter сразу уходит
+вызывающему коду.
+
+Методы, отправляющие или изменяющие сообщения, после 5xx не повторяются:
+502 или 504 от прокси может прийти, когда Telegram уже принял запрос,
+и повтор отправил бы пользователю дубликат. 429 означает, что запрос
+не выполнен, поэтому повторяется для всех методов.
+"""
+import asyncio
+import json
+import logging
+import random
+from telegram.request import HTTPXRequest
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Методы, повтор которых после 5xx может выполнить их второй раз
+NON_IDEMPOTENT_PREFIXES = ('send', 'editMessage', 'forwardMessage', 'copyMessage')
+
+
+def _is_retryable(code, endpoint):
+    if code == 429:
+        return True
+    return code >= 500 and not endpoint.startswith(NON_IDEMPOTENT_PREFIXES)
+
+
+def _endpoint(url, method):
+    # Файлы скачиваются GET-запросом по пути файла, а не метода
+    return url.rsplit('/', 1)[-1] if method == 'POST' else 'file'
+
+
+class RetryingRequest(HTTPXRequest):
+    """HTTPXRequest, повторяющий запросы после ответов 429 и 5xx."""
+
+    def __init__(self, retries=3, backoff=0.5, max_wait=30.0, **kwargs):
+        super().__init__(**kwargs)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+
+    def retry_delay(self, payload, attempt):
+        """Пауза перед повтором или None, если ждать дольше max_wait."""
+        try:
+            parameters = json.loads(payload.decode('utf-8')).get('parameters') or {}
+        except (ValueError, AttributeError):
+            # 5xx от прокси часто приходит не в JSON
+            parameters = {}
+        retry_after = parameters.get('retry_after')
+        if retry_after:
+            if retry_after > self.max_wait:
+                return None
+            return retry_after + random.uniform(0, self.backoff)
+        # Экспоненциальная задержка с полным разбросом, чтобы повторы не шли волной
+        return random.uniform(0, min(self.max_wait, self.backoff * 2 ** attempt))
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        endpoint = _endpoint(url, method)
+        attempt = 0
+        while True:
+            code, payload = await super().do_request(url, method, request_data, **timeouts)
+            if not _is_retryable(code, endpoint) or attempt >= self.retries:
+                return code, payload
+            delay = self.retry_delay(payload, attempt)
+            if delay is None:
+                return code, payload
+            attempt += 1
+            metrics.API_RETRIES.inc(endpoint=endpoint, status=str(code))
+            logger.warning(f"Bot API {endpoint} ответил {code}, повтор {attempt} из {self.retries} "
+                           f"через {delay:.2f} сек")
+            await asyncio.sleep(delay)
+
+
+class PooledRequest(RetryingRequest):
+    """Запросы методов Bot API со своим пулом; скачивание и загрузка медиа — в отдельных пулах."""
+
+    def __init__(self, downloads, uploads, **kwargs):
+        super().__init__(**kwargs)
+        self.downloads = downloads
+        self.uploads = uploads
+
+    async def initialize(self):
+        await asyncio.gather(super().initialize(), self.downloads.initialize(), self.uploads.initialize())
+
+    async def shutdown(self):
+        await asyncio.gather(super().shutdown(), self.downloads.shutdown(), self.uploads.shutdown())
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        if method == 'GET':
+            return await self.downloads.do_request(url, method, request_data, **timeouts)
+        if request_data is not None and request_data.multipart_data:
+            return await self.uploads.do_request(url, method, request_data, **timeouts)
+        return await super().do_request(url, method, request_data, **timeouts)
+
+
+def _options(pool_size, read_timeout, write_timeout, **kwargs):
+    return dict(
+        connection_pool_size=pool_size,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        connect_timeout=config.BOT_API_TIMEOUT,
+        pool_timeout=config.BOT_API_POOL_TIMEOUT,
+        http_version=config.BOT_API_HTTP_VERSION,
+        retries=config.BOT_API_RETRIES,
+        backoff=config.BOT_API_BACKOFF,
+        max_wait=config.BOT_API_MAX_RETRY_WAIT,
+        **kwargs
+    )
+
+
+def build_requests():
+    """Возвращает (запросы методов Bot API, запросы getUpdates) по настройкам config."""
+    downloads = RetryingRequest(**_options(
+        config.DOWNLOAD_POOL_SIZE, config.DOWNLOAD_TIMEOUT, config.BOT_API_TIMEOUT
+    ))
+    uploads = RetryingRequest(**_options(
+        config.UPLOAD_POOL_SIZE, config.UPLOAD_TIMEOUT, config.UPLOAD_TIMEOUT,
+        media_write_timeout=config.UPLOAD_TIMEOUT
+    ))
+    request = PooledRequest(downloads, uploads, **_options(
+        config.BOT_API_POOL_SIZE, config.BOT_API_TIMEOUT, config.BOT_API_TIMEOUT
+    ))
+    # Long polling держит одно соединение; к read_timeout библиотека добавляет timeout опроса
+    get_updates = RetryingRequest(**_options(1, config.GET_UPDATES_TIMEOUT, config.BOT_API_TIMEOUT))
+    return request, get_updates
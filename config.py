@@ -0,0 +1,163 @@
+"""Настройки бота, читаемые из переменных окружения (.env)."""
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+# Адрес Bot API (пусто - api.telegram.org); например, локальный сервер или заглушка для тестов
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+
+# HTTP-клиент Bot API: отдельные пулы соединений для методов Bot API, скачивания
+# файлов и загрузки медиа; таймауты в секундах. HTTP/2 ('2') требует пакет h2
+BOT_API_HTTP_VERSION = os.getenv('BOT_API_HTTP_VERSION', '1.1')
+BOT_API_POOL_SIZE = _env_int('BOT_API_POOL_SIZE', 64)
+BOT_API_TIMEOUT = _env_float('BOT_API_TIMEOUT', 10.0)
+# Сколько ждать свободного соединения пула, прежде чем считать запрос неудачным
+BOT_API_POOL_TIMEOUT = _env_float('BOT_API_POOL_TIMEOUT', 5.0)
+GET_UPDATES_TIMEOUT = _env_float('GET_UPDATES_TIMEOUT', 10.0)
+DOWNLOAD_POOL_SIZE = _env_int('DOWNLOAD_POOL_SIZE', 16)
+DOWNLOAD_TIMEOUT = _env_float('DOWNLOAD_TIMEOUT', 30.0)
+UPLOAD_POOL_SIZE = _env_int('UPLOAD_POOL_SIZE', 16)
+UPLOAD_TIMEOUT = _env_float('UPLOAD_TIMEOUT', 60.0)
+# Повторы после ответов 429 и 5xx: сколько раз, база экспоненциальной задержки
+# и наибольшее ожидание (больший retry_after не ждём, ошибка уходит вызывающему)
+BOT_API_RETRIES = _env_int('BOT_API_RETRIES', 3)
+BOT_API_BACKOFF = _env_float('BOT_API_BACKOFF', 0.5)
+BOT_API_MAX_RETRY_WAIT = _env_float('BOT_API_MAX_RETRY_WAIT', 30.0)
+
+# Приём обновлений: 'polling' (по умолчанию) или 'webhook'
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')
+# Адрес, на котором слушает сервер вебхука, и путь запроса
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = _env_int('WEBHOOK_PORT', 8443)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Публичный HTTPS-адрес вебхука; если задан, бот регистрирует его через setWebhook
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (обязателен в режиме webhook)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Сколько обновлений обрабатывать одновременно
+CONCURRENT_UPDATES = _env_int('CONCURRENT_UPDATES', 32)
+
+# Максимальное время одного вызова ffmpeg (декодирование/кодирование)
+FFMPEG_TIMEOUT = _env_float('FFMPEG_TIMEOUT', 60.0)
+
+# Пул рендеринга эффектов
+RENDER_WORKERS = _env_int('RENDER_WORKERS', os.cpu_count() or 1)
+RENDER_QUEUE_SIZE = _env_int('RENDER_QUEUE_SIZE', 32)
+RENDER_JOB_TIMEOUT = _env_float('RENDER_JOB_TIMEOUT', 120.0)
+# С какой позиции в очереди сообщать пользователю, что запрос ждёт
+QUEUE_NOTICE_POSITION = _env_int('QUEUE_NOTICE_POSITION', 1)
+
+# Частота обработки: 'effect' - своя для каждого эффекта, 'native' - 48 кГц
+# для всех (как у Opus), число - одна частота в герцах для всех эффектов
+PROCESSING_RATE = os.getenv('PROCESSING_RATE', 'effect')
+
+# Бэкенд эффектов: 'numpy' (по умолчанию) или 'ffmpeg' - весь эффект одним
+# фильтрграфом в процессе ffmpeg; для отдельных эффектов - 'robot=ffmpeg,rough=ffmpeg'
+EFFECT_BACKEND = os.getenv('EFFECT_BACKEND', 'numpy')
+
+# Потоковая обработка: сообщения не короче STREAMING_MIN_SECONDS (0 - выключена)
+# обрабатываются блоками по STREAM_BLOCK_SECONDS с постоянным расходом памяти
+STREAMING_MIN_SECONDS = _env_float('STREAMING_MIN_SECONDS', 60.0)
+STREAM_BLOCK_SECONDS = _env_float('STREAM_BLOCK_SECONDS', 2.0)
+
+# Режим запуска: 'single' - всё в одном процессе, 'front' - приём обновлений и
+# постановка задач в общую очередь, 'worker' - рендеринг задач из очереди
+RUN_MODE = os.getenv('RUN_MODE', 'single')
+# Общая очередь задач (SQLite в режиме WAL) для режимов front/worker на одной машине
+JOB_QUEUE_DB = os.getenv('JOB_QUEUE_DB', 'jobs.db')
+# Очередь на Redis для рабочих процессов на нескольких машинах, например redis://queue:6379/0;
+# если задан, используется вместо JOB_QUEUE_DB (нужен пакет redis)
+JOB_QUEUE_URL = os.getenv('JOB_QUEUE_URL', '')
+# Через сколько секунд без продления аренды задачу забирает другой рабочий процесс
+JOB_VISIBILITY_TIMEOUT = _env_float('JOB_VISIBILITY_TIMEOUT', 60.0)
+JOB_MAX_ATTEMPTS = _env_int('JOB_MAX_ATTEMPTS', 3)
+# Пауза между опросами пустой очереди
+JOB_POLL_INTERVAL = _env_float('JOB_POLL_INTERVAL', 0.5)
+
+# Автотюн: 'fast' (dio + stonemask) или 'quality' (harvest + d4c)
+AUTOTUNE_MODE = os.getenv('AUTOTUNE_MODE', 'fast')
+# Тональность автотюна, например 'C major' или 'A minor'; 'auto' - определять по голосу
+AUTOTUNE_KEY = os.getenv('AUTOTUNE_KEY', 'auto')
+
+# Сдвиг тона (эффекты 'выше'/'ниже'): движок 'wsola' (быстрый, во временной области),
+# 'world' (вокодер WORLD, сохраняет форманты) или 'librosa' (фазовый вокодер, эталон)
+PITCH_ENGINE = os.getenv('PITCH_ENGINE', 'wsola')
+# На сколько полутонов эффекты поднимают и опускают голос
+PITCH_SEMITONES = _env_int('PITCH_SEMITONES', 4)
+
+# Контроль нагрузки: под нагрузкой эффекты рендерятся на более дешёвых уровнях
+# качества, чтобы ожидаемое время ответа (очередь + рендеринг) не превышало
+# ADMISSION_TARGET_SECONDS (0 - всегда полное качество); если очередь работы
+# больше ADMISSION_REJECT_SECONDS, новые запросы отклоняются (0 - не отклонять)
+ADMISSION_TARGET_SECONDS = _env_float('ADMISSION_TARGET_SECONDS', 20.0)
+ADMISSION_REJECT_SECONDS = _env_float('ADMISSION_REJECT_SECONDS', 90.0)
+# Частоты обработки пониженного и минимального уровней и сколько секунд
+# сообщения обрабатывать на минимальном уровне (0 - целиком)
+ADMISSION_REDUCED_RATE = _env_int('ADMISSION_REDUCED_RATE', 24000)
+ADMISSION_MINIMAL_RATE = _env_int('ADMISSION_MINIMAL_RATE', 16000)
+ADMISSION_MAX_SECONDS = _env_float('ADMISSION_MAX_SECONDS', 30.0)
+
+# Кэш результатов: размер LRU в памяти и путь к SQLite (пусто - без диска)
+RESULT_CACHE_SIZE = _env_int('RESULT_CACHE_SIZE', 1024)
+RESULT_CACHE_DB = os.getenv('RESULT_CACHE_DB', '')
+
+# Ожидающие выбора эффекта сообщения: максимум записей и путь к SQLite (пусто - только память)
+SESSION_CAPACITY = _env_int('SESSION_CAPACITY', 10000)
+SESSION_DB = os.getenv('SESSION_DB', '')
+
+# Инлайн-режим: чат (например, закрытый канал), куда бот загружает заранее
+# отрендеренные варианты ради file_id (0 - без предварительного рендеринга)
+INLINE_STORAGE_CHAT_ID = _env_int('INLINE_STORAGE_CHAT_ID', 0)
+# Сколько последних голосовых пользователя предлагать в инлайн-режиме
+INLINE_RECENT_VOICES = _env_int('INLINE_RECENT_VOICES', 3)
+# Сколько готовых вариантов хранить и как долго (в секундах)
+INLINE_CACHE_SIZE = _env_int('INLINE_CACHE_SIZE', 5000)
+INLINE_MAX_AGE = _env_float('INLINE_MAX_AGE', 7 * 24 * 60 * 60.0)
+# Голосовые длиннее этого заранее не рендерятся
+INLINE_MAX_SECONDS = _env_float('INLINE_MAX_SECONDS', 60.0)
+# Максимальная длина очереди предварительного рендеринга
+INLINE_PRERENDER_QUEUE = _env_int('INLINE_PRERENDER_QUEUE', 100)
+
+# Справедливость между чатами: за круг обслуживания чат получает столько секунд аудио
+FAIR_QUANTUM_SECONDS = _env_float('FAIR_QUANTUM_SECONDS', 30.0)
+# Ограничение частоты запросов на рендеринг (в минуту, 0 - без ограничения) и сколько запросов подряд можно сразу
+RATE_LIMIT_USER_PER_MINUTE = _env_float('RATE_LIMIT_USER_PER_MINUTE', 10.0)
+RATE_LIMIT_USER_BURST = _env_int('RATE_LIMIT_USER_BURST', 5)
+RATE_LIMIT_CHAT_PER_MINUTE = _env_float('RATE_LIMIT_CHAT_PER_MINUTE', 30.0)
+RATE_LIMIT_CHAT_BURST = _env_int('RATE_LIMIT_CHAT_BURST', 10)
+
+# Прогрессивная отправка сообщений от PROGRESSIVE_MIN_SECONDS секунд (0 - выключена):
+# сначала предпросмотр первых PREVIEW_SECONDS секунд на частоте PREVIEW_RATE, затем полная версия
+PROGRESSIVE_MIN_SECONDS = _env_float('PROGRESSIVE_MIN_SECONDS', 0.0)
+PREVIEW_SECONDS = _env_float('PREVIEW_SECONDS', 5.0)
+PREVIEW_RATE = _env_int('PREVIEW_RATE', 16000)
+# Как часто (не чаще, в секундах) обновлять ход обработки в сообщении с кнопками
+PROGRESS_INTERVAL = _env_float('PROGRESS_INTERVAL', 3.0)
+
+# Логирование: уровень, уровень логов HTTP-библиотек, файл с ротацией (пусто - только консоль)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_HTTP_LEVEL = os.getenv('LOG_HTTP_LEVEL', 'WARNING').upper()
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_MAX_BYTES = _env_int('LOG_MAX_BYTES', 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = _env_int('LOG_BACKUP_COUNT', 5)
+# Формат записей: text или json (одна строка JSON на запись)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Доля успешных задач, записи о которых попадают в лог (ошибки пишутся всегда)
+LOG_JOB_SAMPLE_RATE = _env_float('LOG_JOB_SAMPLE_RATE', 1.0)
+
+# Эндпоинт метрик Prometheus (порт 0 - выключен)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = _env_int('METRICS_PORT', 9464)
@@ -0,0 +1,144 @@
+"""Векторизованная обработка динамики на NumPy.
+
+Замена pydub.effects.compress_dynamic_range и normalize для массивов float32
+в диапазоне [-1, 1]. Семантика параметров та же, что у pydub: порог в dBFS,
+ratio, attack и release в миллисекундах; огибающая считается как RMS
+по окну длиной attack перед текущим сэмплом. Компрессор хранит состояние
+между блоками и подходит для потоковой обработки.
+"""
+import numpy as np
+
+
+def db_to_gain(db):
+    return np.power(10.0, np.asarray(db) / 20.0)
+
+
+def gain_reduction_db(envelope, threshold, ratio):
+    """Требуемое ослабление в дБ для каждого сэмпла (0 ниже порога)."""
+    threshold_level = db_to_gain(threshold)
+    above = envelope > threshold_level
+    reduction = np.zeros(len(envelope))
+    reduction[above] = (1.0 - 1.0 / ratio) * 20.0 * np.log10(envelope[above] / threshold_level)
+    return reduction
+
+
+class Compressor:
+    """Компрессор с параметрами pydub.effects.compress_dynamic_range.
+
+    Состояние (хвост окна огибающей, пиковый детектор восстановления,
+    фильтр атаки) переносится между вызовами process, поэтому сигнал можно
+    обрабатывать блоками с тем же результатом, что и целиком.
+    """
+
+    def __init__(self, sample_rate, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0):
+        self.threshold = threshold
+        self.ratio = ratio
+        self.window = max(1, int(sample_rate * attack / 1000.0))
+        self.release_samples = max(1, int(sample_rate * release / 1000.0))
+        attack_samples = sample_rate * attack / 1000.0
+        self.attack_coeff = np.exp(-1.0 / attack_samples) if attack_samples > 0 else 0.0
+        # Накопленная энергия сигнала в последних window + 1 позициях и число
+        # обработанных сэмплов: RMS по окну перед текущим сэмплом
+        self._energy = np.zeros(1)
+        self._count = 0
+        # Пиковый детектор: накопленная сумма ослабления и текущий максимум
+        self._reduction_sum = 0.0
+        self._peak = 0.0
+        self._attack_state = np.zeros(1)
+
+    def envelope(self, block):
+        """RMS по окну window, заканчивающемуся перед каждым сэмплом."""
+        # Сумма продолжается с прошлого блока в том же порядке, что и для всего сигнала,
+        # поэтому результат по блокам совпадает с результатом целиком до бита
+        totals = np.cumsum(np.concatenate((self._energy[-1:], np.square(block, dtype=np.float64))))
+        energy = np.concatenate((self._energy[:-1], totals))
+        offset = self._count - (len(self._energy) - 1)
+        end = np.arange(self._count, self._count + len(block))
+        start = np.maximum(end - self.window, 0)
+        count = np.maximum(end - start, 1)
+        self._count += len(block)
+        self._energy = energy[-(self.window + 1):]
+        return np.sqrt(np.maximum(energy[end - offset] - energy[start - offset], 0.0) / count)
+
+    def follow_release(self, reduction):
+        """Пиковый детектор с восстановлением со скоростью reduction / release за сэмпл.
+
+        Векторная форма рекурсии pydub: ослабление убывает на накопленную сумму
+        требуемого ослабления, поэтому ниже порога (reduction == 0) оно удерживается.
+        """
+        sums = np.cumsum(np.concatenate(([self._reduction_sum], reduction)))[1:]
+        budget = sums / self.release_samples
+        held = reduction + budget
+        held[0] = max(held[0], self._peak)
+        np.maximum.accumulate(held, out=held)
+        self._reduction_sum = sums[-1]
+        self._peak = held[-1]
+        return held - budget
+
+    def follow_attack(self, reduction):
+        """Ослабление нарастает не быстрее, чем за attack миллисекунд."""
+        coeff = self.attack_coeff
+        # scipy.signal импортируется почти секунду, поэтому только при первой обработке
+        from scipy.signal import lfilter
+        smoothed, self._attack_state = lfilter([1.0 - coeff], [1.0, -coeff], reduction, zi=self._attack_state)
+        return np.minimum(reduction, smoothed)
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if not len(block):
+            return block
+        reduction = gain_reduction_db(self.envelope(block), self.threshold, self.ratio)
+        reduction = self.follow_attack(self.follow_release(reduction))
+        # Усиление в float32 сразу: без промежуточного float64 того же размера, что и блок
+        return block * db_to_gain(-reduction).astype(np.float32)
+
+
+def compress_dynamic_range(samples, sample_rate, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0):
+    """Компрессор с параметрами pydub.effects.compress_dynamic_range для всего сигнала."""
+    return Compressor(sample_rate, threshold, ratio, attack, release).process(samples)
+
+
+def normalize(samples, headroom=0.1, out=None):
+    """Пиковая нормализация до -headroom dBFS (как pydub.effects.normalize).
+
+    out=samples нормализует на месте, без нового массива.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+    if peak == 0.0:
+        return samples
+    return np.multiply(samples, np.float32(db_to_gain(-headroom) / peak), out=out)
+
+
+def normalize_rms(samples, target=-20.0, headroom=0.1):
+    """Нормализация по RMS до target dBFS с ограничением пика -headroom dBFS."""
+    samples = np.asarray(samples, dtype=np.float32)
+    if not len(samples):
+        return samples
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+    peak = float(np.max(np.abs(samples)))
+    if rms == 0.0:
+        return samples
+    gain = min(db_to_gain(target) / rms, db_to_gain(-headroom) / peak)
+    return samples * np.float32(gain)
+
+
+class RunningNormalizer:
+    """Пиковая нормализация для потоковой обработки.
+
+    Пик всего сигнала заранее неизвестен, поэтому усиление считается по
+    максимуму, накопленному к концу текущего блока: оно только убывает и
+    никогда не даёт превысить -headroom dBFS.
+    """
+
+    def __init__(self, headroom=0.1):
+        self.ceiling = float(db_to_gain(-headroom))
+        self._peak = 0.0
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if len(block):
+            self._peak = max(self._peak, float(np.max(np.abs(block))))
+        if self._peak == 0.0:
+            return block
+        return block * np.float32(self.ceiling / self._peak)
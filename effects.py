@@ -0,0 +1,371 @@
+"""Аудиоэффекты и задача рендеринга голосового сообщения.
+
+Функции этого модуля выполняются в рабочих процессах пула рендеринга
+(см. workers.py), поэтому модуль не должен иметь побочных эффектов при
+импорте. Тяжёлые библиотеки (scipy, librosa, pyworld, soundfile)
+импортируются внутри функций, которым они нужны: бот стартует без них,
+а рабочие процессы загружают их при прогреве (см. warm_up).
+"""
+import os
+import math
+import time
+import tempfile
+import logging
+import traceback
+import numpy as np
+import config
+from audio_io import AudioBuffer, OPUS_SAMPLE_RATE
+import dynamics
+import oscillators
+
+logger = logging.getLogger(__name__)
+
+# Слои генераторов для эффектов: (тип, частота, усиление в дБ)
+ROBOT_LAYER = (('square', 2000, -10.0), ('noise', None, -15.0))
+MUSICAL_LAYER = tuple(('sine', freq, -10.0) for freq in (440, 880, 1320, 1760, 2200)) + (('sine', 8, -15.0),)
+AUTOTUNE_LAYER = (('sine', 10, -15.0),)
+ROUGH_LAYER = (('square', 1500, -5.0), ('noise', None, -10.0))
+
+# Транспозиция автотюна в полутонах (прежний pitch_shift на 12 шагов из 24 на октаву)
+AUTOTUNE_SHIFT = 6.0
+
+# Во сколько раз эффект робота поднимает частоту дискретизации
+ROBOT_RATE_FACTOR = 1.5
+
+# Длительность синтетического клипа для прогрева рабочих процессов, секунды
+WARM_UP_SECONDS = 0.5
+
+# Частота, на которой эффект обрабатывает сигнал. Простым эффектам нужна
+# родная частота Opus (без передискретизации при декодировании и кодировании),
+# анализ WORLD в автотюне и сдвиге тона вдвое дешевле на 24 кГц, а речи этого достаточно
+EFFECT_SAMPLE_RATES = {
+    'robot': OPUS_SAMPLE_RATE,
+    'musical': OPUS_SAMPLE_RATE,
+    'autotune': 24000,
+    'rough': OPUS_SAMPLE_RATE,
+    'pitch_up': 24000,
+    'pitch_down': 24000,
+}
+
+# Слой генераторов каждого эффекта (для предварительного построения таблиц)
+EFFECT_LAYERS = {
+    'robot': ROBOT_LAYER,
+    'musical': MUSICAL_LAYER,
+    'autotune': AUTOTUNE_LAYER,
+    'rough': ROUGH_LAYER,
+}
+
+# Эффекты сдвига тона (см. pitch_shift.py)
+PITCH_EFFECTS = ('pitch_up', 'pitch_down')
+
+# Эффекты, которые можно выполнить фильтрграфом ffmpeg (см. filtergraph.py)
+FILTERGRAPH_EFFECTS = ('robot', 'musical', 'rough')
+
+class QualityTier:
+    """Уровень качества рендеринга, на который бот переходит под нагрузкой.
+
+    sample_rate — предельная частота обработки (None — без ограничения),
+    fast — быстрый анализ автотюна и самый дешёвый движок сдвига тона,
+    max_seconds — обрабатывается только начало сообщения (None — целиком),
+    cost — примерная доля вычислений полного качества, пока нет измерений.
+    """
+
+    __slots__ = ('name', 'sample_rate', 'fast', 'max_seconds', 'cost')
+
+    def __init__(self, name, sample_rate, fast, max_seconds, cost):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.fast = fast
+        self.max_seconds = max_seconds
+        self.cost = cost
+
+    def __repr__(self):
+        return f"QualityTier({self.name})"
+
+
+# Уровни качества от полного к самому дешёвому (см. admission.py)
+QUALITY_TIERS = (
+    QualityTier('full', None, False, None, 1.0),
+    QualityTier('reduced', config.ADMISSION_REDUCED_RATE, True, None, 0.5),
+    QualityTier('minimal', config.ADMISSION_MINIMAL_RATE, True, config.ADMISSION_MAX_SECONDS or None, 0.3),
+)
+FULL_TIER = 'full'
+# Предпросмотр начала длинного сообщения при прогрессивной отправке (см. main.py)
+PREVIEW_TIER = 'preview'
+TIERS = {tier.name: tier for tier in QUALITY_TIERS + (
+    QualityTier(PREVIEW_TIER, config.PREVIEW_RATE, True, config.PREVIEW_SECONDS, 0.3),
+)}
+# Движок сдвига тона на пониженных уровнях качества
+FAST_PITCH_ENGINE = 'wsola'
+
+def processing_rate(effect, tier=FULL_TIER):
+    """Частота декодирования и обработки для эффекта согласно config.PROCESSING_RATE и уровню качества."""
+    policy = config.PROCESSING_RATE
+    if policy == 'effect':
+        rate = EFFECT_SAMPLE_RATES.get(effect, OPUS_SAMPLE_RATE)
+    elif policy == 'native':
+        rate = OPUS_SAMPLE_RATE
+    else:
+        rate = int(policy)
+    limit = TIERS[tier].sample_rate
+    return min(rate, limit) if limit else rate
+
+def effect_options(effect, tier=FULL_TIER):
+    """Именованные аргументы функции эффекта для уровня качества."""
+    if not TIERS[tier].fast:
+        return {}
+    if effect == 'autotune':
+        return {'fast': True}
+    if effect in PITCH_EFFECTS:
+        return {'engine': FAST_PITCH_ENGINE}
+    return {}
+
+def tier_work(effect, tier=FULL_TIER):
+    """Что на самом деле меняет уровень качества для эффекта: частота, настройки, длительность.
+
+    Уровни с одинаковой работой для эффекта стоят одинаково: например, при
+    AUTOTUNE_MODE=fast быстрый анализ и так включён, а частота автотюна уже 24 кГц.
+    """
+    options = effect_options(effect, tier)
+    if effect == 'autotune':
+        options = {'fast': options.get('fast', config.AUTOTUNE_MODE == 'fast')}
+    elif effect in PITCH_EFFECTS:
+        options = {'engine': options.get('engine', config.PITCH_ENGINE)}
+    return processing_rate(effect, tier), tuple(sorted(options.items())), TIERS[tier].max_seconds
+
+def effect_backend(effect):
+    """Бэкенд эффекта согласно config.EFFECT_BACKEND: 'numpy' или 'ffmpeg'.
+
+    Более поздние записи списка переопределяют ранние; эффекты, которые
+    фильтрграф не поддерживает, всегда обрабатываются в NumPy.
+    """
+    backend = 'numpy'
+    for item in config.EFFECT_BACKEND.split(','):
+        name, _, value = item.strip().rpartition('=')
+        if name in ('', effect) and value:
+            backend = value
+    return 'ffmpeg' if backend == 'ffmpeg' and effect in FILTERGRAPH_EFFECTS else 'numpy'
+
+def effect_params(effect):
+    """Параметры, влияющие на результат эффекта (входят в ключ кэша результатов)."""
+    params = (processing_rate(effect),)
+    if effect_backend(effect) != 'numpy':
+        params += (effect_backend(effect),)
+    if effect == 'autotune':
+        params += (config.AUTOTUNE_MODE, config.AUTOTUNE_KEY, AUTOTUNE_SHIFT)
+    if effect in PITCH_EFFECTS:
+        params += (config.PITCH_ENGINE, config.PITCH_SEMITONES)
+    return params
+
+def preload_waveforms():
+    """Заранее строит таблицы генераторов на частотах обработки эффектов."""
+    for effect, components in EFFECT_LAYERS.items():
+        sample_rate = processing_rate(effect)
+        if effect == 'robot':
+            sample_rate = int(sample_rate * ROBOT_RATE_FACTOR)
+        oscillators.layer(components, sample_rate)
+
+def apply_robot_effect(audio):
+    """Применяет максимально радикальный эффект робота к аудио."""
+    try:
+        # Изменяем высоту тона для механического звука: те же сэмплы
+        # интерпретируются с частотой в 1.5 раза выше
+        robot_rate = int(audio.sample_rate * ROBOT_RATE_FACTOR)
+        # Слой накладывается на месте, поэтому в свою копию: вход может быть только для чтения
+        samples = audio.samples.copy()
+        
+        # Добавляем квадратную волну и шум
+        oscillators.add_layer(samples, ROBOT_LAYER, robot_rate)
+        
+        # Компрессия
+        samples = dynamics.compress_dynamic_range(samples, robot_rate, threshold=-30.0, ratio=20.0)
+        
+        # Нормализация
+        return AudioBuffer(dynamics.normalize(samples, out=samples), audio.sample_rate)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в apply_robot_effect: {str(e)}")
+        raise
+
+def apply_musical_voice_effect(audio):
+    """Применяет максимально радикальный музыкальный эффект к аудио."""
+    try:
+        samples = audio.samples.copy()
+        
+        # Добавляем гармоники и вибрато
+        oscillators.add_layer(samples, MUSICAL_LAYER, audio.sample_rate)
+        
+        # Компрессия
+        samples = dynamics.compress_dynamic_range(samples, audio.sample_rate, threshold=-20.0, ratio=12.0)
+        
+        # Нормализация
+        return AudioBuffer(dynamics.normalize(samples, out=samples), audio.sample_rate)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в apply_musical_voice_effect: {str(e)}")
+        raise
+
+def apply_autotune_effect(audio, fast=None):
+    """Применяет максимально радикальный эффект автотюна к аудио.
+
+    fast — быстрый анализ F0 (по умолчанию согласно config.AUTOTUNE_MODE).
+    """
+    import autotune
+    try:
+        # Притягиваем F0 к нотам тональности и транспонируем на полоктавы вверх
+        samples = autotune.autotune(
+            audio.samples,
+            audio.sample_rate,
+            key=autotune.parse_key(config.AUTOTUNE_KEY),
+            fast=config.AUTOTUNE_MODE == 'fast' if fast is None else fast,
+            shift_semitones=AUTOTUNE_SHIFT
+        )
+        
+        # Добавляем вибрато
+        oscillators.add_layer(samples, AUTOTUNE_LAYER, audio.sample_rate)
+        
+        # Компрессия
+        samples = dynamics.compress_dynamic_range(samples, audio.sample_rate, threshold=-25.0, ratio=15.0)
+        
+        # Нормализация
+        return AudioBuffer(dynamics.normalize(samples, out=samples), audio.sample_rate)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в apply_autotune_effect: {str(e)}")
+        raise
+
+def apply_rough_voice_effect(audio):
+    """Применяет максимально радикальный эффект грубого голоса к аудио."""
+    try:
+        # Добавляем искажение: +20 дБ с ограничением (в новом массиве, вход не меняется)
+        samples = audio.samples * np.float32(10.0)
+        np.clip(samples, -1.0, 1.0, out=samples)
+        
+        # Добавляем квадратную волну и шум
+        oscillators.add_layer(samples, ROUGH_LAYER, audio.sample_rate)
+        
+        # Компрессия
+        samples = dynamics.compress_dynamic_range(samples, audio.sample_rate, threshold=-25.0, ratio=15.0)
+        
+        # Нормализация
+        return AudioBuffer(dynamics.normalize(samples, out=samples), audio.sample_rate)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в apply_rough_voice_effect: {str(e)}")
+        raise
+
+def apply_pitch_up_effect(audio, engine=None):
+    """Поднимает голос на PITCH_SEMITONES полутонов."""
+    return change_pitch(audio, config.PITCH_SEMITONES, engine)
+
+def apply_pitch_down_effect(audio, engine=None):
+    """Опускает голос на PITCH_SEMITONES полутонов."""
+    return change_pitch(audio, -config.PITCH_SEMITONES, engine)
+
+def change_pitch(audio, n_steps, engine=None):
+    """Изменяет высоту тона аудио движком engine (по умолчанию config.PITCH_ENGINE)."""
+    import pitch_shift
+    try:
+        samples = pitch_shift.shift(audio.samples, audio.sample_rate, n_steps, engine or config.PITCH_ENGINE)
+        
+        # Нормализация
+        return AudioBuffer(dynamics.normalize(samples, out=samples), audio.sample_rate)
+    except Exception as e:
+        logger.error(f"Ошибка при изменении высоты тона: {str(e)}")
+        raise
+
+async def apply_echo_effect(audio):
+    """Применяет эффект эхо к аудио с помощью ffmpeg (пока не используется)."""
+    import ffmpeg
+    import soundfile as sf
+    try:
+        logger.debug("Применение эффекта эхо")
+        
+        # Создаем временный файл для аудио
+        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
+            temp_wav_path = temp_wav.name
+            sf.write(temp_wav_path, audio.samples, audio.sample_rate)
+            logger.debug(f"Временный WAV файл создан: {temp_wav_path}")
+        
+        # Применяем эффект эхо с помощью ffmpeg
+        output_path = temp_wav_path.replace('.wav', '_echo.wav')
+        try:
+            # Эффект эхо: delay=0.5s, decay=0.5
+            stream = ffmpeg.input(temp_wav_path)
+            stream = ffmpeg.filter(stream, 'aecho', 0.8, 0.9, 1000, 0.3)
+            stream = ffmpeg.output(stream, output_path)
+            ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+            logger.debug(f"Эффект эхо применен, сохранен в: {output_path}")
+        except ffmpeg.Error as e:
+            logger.error(f"Ошибка ffmpeg: {e.stderr.decode()}")
+            raise
+        
+        # Читаем обработанный файл
+        processed_audio, new_sample_rate = sf.read(output_path, dtype='float32')
+        logger.debug(f"Обработанный файл прочитан, частота дискретизации: {new_sample_rate}")
+        
+        # Очищаем временные файлы
+        os.unlink(temp_wav_path)
+        os.unlink(output_path)
+        logger.debug("Временные файлы удалены")
+        
+        return AudioBuffer(processed_audio, new_sample_rate)
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении эффекта: {str(e)}")
+        logger.error("Полный стек ошибки при применении эффекта:")
+        logger.error(traceback.format_exc())
+        raise
+
+# Соответствие идентификатора эффекта и функции обработки
+EFFECT_FUNCTIONS = {
+    'robot': apply_robot_effect,
+    'musical': apply_musical_voice_effect,
+    'autotune': apply_autotune_effect,
+    'rough': apply_rough_voice_effect,
+    'pitch_up': apply_pitch_up_effect,
+    'pitch_down': apply_pitch_down_effect,
+}
+
+
+def resample(audio, to_rate):
+    """Полифазная передискретизация (для отношений вроде 48 кГц -> 24 кГц)."""
+    if audio.sample_rate == to_rate:
+        return audio
+    from scipy.signal import resample_poly
+    divisor = math.gcd(audio.sample_rate, to_rate)
+    samples = resample_poly(audio.samples, to_rate // divisor, audio.sample_rate // divisor)
+    return AudioBuffer(samples.astype(np.float32, copy=False), to_rate)
+
+
+def render_effect(audio, effect, tier=FULL_TIER):
+    """Задача рабочего процесса: применяет эффект к AudioBuffer на уровне качества tier.
+
+    Если PCM декодирован не на частоте обработки эффекта (например, один раз
+    для всех эффектов), он сначала передискретизируется.
+    Возвращает (AudioBuffer, время рендеринга в секундах).
+    """
+    started = time.perf_counter()
+    processed = EFFECT_FUNCTIONS[effect](resample(audio, processing_rate(effect, tier)),
+                                         **effect_options(effect, tier))
+    elapsed = time.perf_counter() - started
+    logger.debug(f"Эффект {effect} ({tier}) применен за {elapsed:.2f} сек, результат: {processed}")
+    return processed, elapsed
+
+
+def warm_up():
+    """Прогревает процесс: по разу применяет каждый эффект к короткому синтетическому клипу.
+
+    Загружает ленивые импорты и заполняет кэши, чтобы первая задача
+    пользователя не платила за них. Возвращает время прогрева по эффектам.
+    """
+    samples = int(OPUS_SAMPLE_RATE * WARM_UP_SECONDS)
+    clip = AudioBuffer(0.3 * np.sin(2 * np.pi * 220.0 * np.arange(samples) / OPUS_SAMPLE_RATE), OPUS_SAMPLE_RATE)
+    timings = {}
+    for effect in EFFECT_FUNCTIONS:
+        started = time.perf_counter()
+        render_effect(clip, effect)
+        timings[effect] = time.perf_counter() - started
+    logger.info(f"Процесс {os.getpid()} прогрет за {sum(timings.values()):.2f} сек: " +
+                ', '.join(f"{effect} {seconds:.2f}" for effect, seconds in timings.items()))
+    return timings
@@ -0,0 +1,133 @@
+"""Бэкенд эффектов на фильтрграфе ffmpeg.
+
+Эффект описывается одним фильтрграфом, который выполняется тем же
+процессом ffmpeg, что декодирует Opus и кодирует результат, поэтому PCM
+вообще не попадает в Python. Слои генераторов строятся фильтрами sine,
+aevalsrc и anoisesrc и подмешиваются через amix, компрессия — acompressor,
+пиковая нормализация заменена на однопроходный dynaudnorm (с altboundary,
+чтобы края коротких сообщений тоже усиливались). Параметры те же, что
+у функций effects.apply_*, но результат совпадает с ними только на слух,
+а не посэмплово. Автотюн фильтрами ffmpeg не выражается и всегда
+обрабатывается в NumPy (см. effects.FILTERGRAPH_EFFECTS).
+"""
+import logging
+import subprocess
+import time
+import dynamics
+import effects
+import oscillators
+from audio_io import FfmpegError, OPUS_INPUT_RATES, OPUS_SAMPLE_RATE, ogg_duration
+
+logger = logging.getLogger(__name__)
+
+# Параметры компрессии и искажения эффектов: (порог в дБ, ratio, усиление перед слоем)
+EFFECT_DYNAMICS = {
+    'robot': (-30.0, 20.0, None),
+    'musical': (-20.0, 12.0, None),
+    'rough': (-25.0, 15.0, 10.0),
+}
+# Атака и восстановление компрессора в миллисекундах (как у dynamics.Compressor)
+ATTACK_MS = 5.0
+RELEASE_MS = 50.0
+# Пиковая нормализация до -0.1 dBFS, как у dynamics.normalize
+NORMALIZE_PEAK = dynamics.db_to_gain(-0.1)
+# После жёсткой компрессии сигнал тихий: усиления dynaudnorm по умолчанию (10) не хватает
+DYNAUDNORM_MAX_GAIN = 100
+
+
+# Фильтр sine генерирует синус с амплитудой 1/8
+SINE_AMPLITUDE = 0.125
+
+
+def _square_expr(freq, gain):
+    return f"{gain:.6f}*(2*lt(mod({freq}*t,1),0.5)-1)"
+
+
+def layer_sources(components, sample_rate):
+    """Источники слоя генераторов.
+
+    Синусы — табличным фильтром sine (заметно быстрее выражений aevalsrc),
+    меандры — одним aevalsrc, шум — anoisesrc.
+    """
+    squares = []
+    sources = []
+    for kind, freq, gain_db in components:
+        gain = dynamics.db_to_gain(gain_db)
+        if kind == 'sine':
+            sources.append(f"sine=frequency={freq}:sample_rate={sample_rate},volume={gain / SINE_AMPLITUDE:.6f}")
+        elif kind == 'square':
+            squares.append(_square_expr(freq, gain))
+        elif kind == 'noise':
+            sources.append(f"anoisesrc=color=white:amplitude={gain:.6f}:sample_rate={sample_rate}"
+                           f":seed={oscillators.NOISE_SEED}")
+        else:
+            raise ValueError(f"Неизвестный тип осциллятора: {kind}")
+    if squares:
+        sources.append(f"aevalsrc=exprs='{'+'.join(squares)}':sample_rate={sample_rate}")
+    return sources
+
+
+def effect_graph(effect, sample_rate):
+    """Фильтрграф эффекта от входа [0:a] до выхода [out] на частоте sample_rate."""
+    if effect not in EFFECT_DYNAMICS:
+        raise ValueError(f"Эффект {effect} не поддерживается фильтрграфом")
+    threshold, ratio, drive = EFFECT_DYNAMICS[effect]
+    # Робот обрабатывает те же сэмплы как записанные с частотой в 1.5 раза выше
+    rate = int(sample_rate * effects.ROBOT_RATE_FACTOR) if effect == 'robot' else sample_rate
+
+    voice = [f"aresample={sample_rate}", 'aformat=sample_fmts=flt:channel_layouts=mono']
+    if rate != sample_rate:
+        voice.append(f"asetrate={rate}")
+    if drive is not None:
+        voice.append(f"aeval='clip({drive}*val(0),-1,1)'")
+    sources = layer_sources(effects.EFFECT_LAYERS[effect], rate)
+
+    chain = [
+        f"amix=inputs={len(sources) + 1}:duration=first:normalize=0",
+        "aeval='clip(val(0),-1,1)'",
+        f"acompressor=threshold={dynamics.db_to_gain(threshold):.6f}:ratio={ratio}:attack={ATTACK_MS}"
+        f":release={RELEASE_MS}:knee=1:detection=peak",
+        f"dynaudnorm=peak={NORMALIZE_PEAK:.4f}:maxgain={DYNAUDNORM_MAX_GAIN}:altboundary=1",
+    ]
+    if rate != sample_rate:
+        chain.append(f"asetrate={sample_rate}")
+
+    parts = [f"[0:a]{','.join(voice)}[voice]"]
+    parts += [f"{source}[layer{index}]" for index, source in enumerate(sources)]
+    inputs = '[voice]' + ''.join(f"[layer{index}]" for index in range(len(sources)))
+    parts.append(f"{inputs}{','.join(chain)}[out]")
+    return ';'.join(parts)
+
+
+def render_filtergraph(ogg_data, effect, sample_rate, timeout, max_seconds=None):
+    """Задача рабочего процесса: OGG -> эффект фильтрграфом ffmpeg -> OGG.
+
+    max_seconds — обработать только начало сообщения.
+    Возвращает (OGG, длительность аудио в секундах, время обработки в секундах),
+    как streaming.render_stream.
+    """
+    started = time.perf_counter()
+    output_rate = sample_rate if sample_rate in OPUS_INPUT_RATES else OPUS_SAMPLE_RATE
+    limit = ['-t', f"{max_seconds:g}"] if max_seconds else []
+    args = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-i', 'pipe:0',
+        *limit,
+        '-filter_complex', effect_graph(effect, sample_rate),
+        '-map', '[out]',
+        '-acodec', 'libopus',
+        '-ar', str(output_rate),
+        '-ac', '1',
+        '-f', 'ogg',
+        'pipe:1'
+    ]
+    try:
+        result = subprocess.run(args, input=ogg_data, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise FfmpegError(f"ffmpeg (фильтрграф) не завершился за {timeout} сек")
+    if result.returncode != 0:
+        raise FfmpegError(f"Ошибка ffmpeg (фильтрграф): {result.stderr.decode(errors='replace')}")
+    elapsed = time.perf_counter() - started
+    audio_seconds = ogg_duration(result.stdout)
+    logger.debug(f"Фильтрграф {effect}: {audio_seconds:.1f} сек аудио за {elapsed:.2f} сек")
+    return result.stdout, audio_seconds, elapsed
@@ -0,0 +1,134 @@
+"""Готовые варианты эффектов для инлайн-режима.
+
+Для каждого пользователя запоминаются последние голосовые сообщения, а для
+каждого голосового и эффекта — file_id отрендеренного результата. Ответ на
+инлайн-запрос собирается только из этих file_id, без рендеринга. Варианты
+старше max_age удаляются, а при переполнении вытесняются наименее
+популярные (по числу выдач в инлайн-ответах), среди равных — давно
+не использованные.
+"""
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# При переполнении освобождается ещё эта доля ёмкости, чтобы не сортировать на каждой вставке
+EVICT_FRACTION = 0.1
+
+
+class VoiceRef:
+    """Голосовое сообщение пользователя, для которого готовятся варианты."""
+
+    __slots__ = ('file_id', 'file_unique_id', 'duration', 'timestamp')
+
+    def __init__(self, file_id, file_unique_id, duration, timestamp=None):
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.duration = duration
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+
+class Variant:
+    """Отрендеренный эффект: file_id голосового и счётчики для вытеснения."""
+
+    __slots__ = ('file_id', 'created', 'last_used', 'hits')
+
+    def __init__(self, file_id, now):
+        self.file_id = file_id
+        self.created = now
+        self.last_used = now
+        self.hits = 0
+
+
+class InlineCache:
+    """Последние голосовые пользователей и готовые варианты эффектов для них."""
+
+    def __init__(self, capacity, max_age, recent_per_user, max_users=10000):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.recent_per_user = recent_per_user
+        self.max_users = max_users
+        self._recent = collections.OrderedDict()
+        self._variants = {}
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._variants)
+
+    def remember_voice(self, user_id, voice):
+        """Запоминает голосовое как последнее для пользователя; True, если оно новое."""
+        recent = self._recent.get(user_id)
+        if recent is None:
+            recent = self._recent[user_id] = collections.deque(maxlen=self.recent_per_user)
+        self._recent.move_to_end(user_id)
+        while len(self._recent) > self.max_users:
+            self._recent.popitem(last=False)
+        for index, known in enumerate(recent):
+            if known.file_unique_id == voice.file_unique_id:
+                del recent[index]
+                recent.append(voice)
+                return False
+        recent.append(voice)
+        return True
+
+    def has_variant(self, file_unique_id, effect):
+        return (file_unique_id, effect) in self._variants
+
+    def add_variant(self, file_unique_id, effect, file_id):
+        """Сохраняет file_id результата эффекта для голосового."""
+        now = time.time()
+        variant = self._variants.get((file_unique_id, effect))
+        if variant is None:
+            self._variants[(file_unique_id, effect)] = Variant(file_id, now)
+        else:
+            variant.file_id = file_id
+            variant.last_used = now
+        if len(self._variants) > self.capacity:
+            self.evict(now)
+
+    def discard(self, file_unique_id, effect):
+        self._variants.pop((file_unique_id, effect), None)
+
+    def lookup(self, user_id, effects, limit):
+        """Готовые варианты для последних голосовых пользователя, от новых к старым.
+
+        Возвращает список (VoiceRef, эффект, file_id) и увеличивает популярность выданных.
+        """
+        now = time.time()
+        results = []
+        for voice in reversed(self._recent.get(user_id, ())):
+            for effect in effects:
+                variant = self._variants.get((voice.file_unique_id, effect))
+                if variant is None or now - variant.created > self.max_age:
+                    continue
+                variant.hits += 1
+                variant.last_used = now
+                results.append((voice, effect, variant.file_id))
+                if len(results) >= limit:
+                    return results
+        return results
+
+    def evict(self, now=None):
+        """Удаляет устаревшие варианты и непопулярные сверх capacity; возвращает их число."""
+        now = time.time() if now is None else now
+        expired = [key for key, variant in self._variants.items() if now - variant.created > self.max_age]
+        for key in expired:
+            del self._variants[key]
+        removed = len(expired)
+        excess = len(self._variants) - self.capacity
+        if excess > 0:
+            excess = min(len(self._variants), excess + int(self.capacity * EVICT_FRACTION))
+            ranked = sorted(self._variants.items(), key=lambda item: (item[1].hits, item[1].last_used))
+            for key, _ in ranked[:excess]:
+                del self._variants[key]
+            removed += excess
+        self.evicted += removed
+        return removed
+
+    def stats(self):
+        return {
+            'variants': len(self._variants),
+            'users': len(self._recent),
+            'evicted': self.evicted,
+        }
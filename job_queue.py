@@ -0,0 +1,383 @@
+"""Общая очередь задач рендеринга: SQLite в режиме WAL или Redis.
+
+Используется в распределённом режиме: фронтенд-процесс принимает
+обновления Telegram и ставит задачи в очередь, рабочие процессы забирают
+их, рендерят и отправляют результат. Задача выдаётся в аренду на
+visibility_timeout секунд; если рабочий процесс упал и не продлил аренду,
+задача снова становится доступной. После max_attempts неудачных попыток
+задача помечается как проваленная.
+
+JobQueue хранит очередь в файле SQLite. WAL требует общей памяти, поэтому
+все процессы должны работать на одной машине с файлом базы на локальном
+диске, не на сетевой файловой системе. Для рабочих процессов на нескольких
+машинах есть RedisJobQueue с тем же интерфейсом: аренда и её продление
+выполняются Lua-скриптами атомарно на сервере Redis, время аренды
+считается по часам сервера.
+
+Запись в очередь может ждать блокировку или сеть, поэтому из event loop
+методы очереди вызываются через run в отдельном потоке.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    """Задача из очереди: payload — словарь, attempts — номер текущей попытки."""
+
+    __slots__ = ('id', 'payload', 'attempts', 'worker')
+
+    def __init__(self, job_id, payload, attempts, worker):
+        self.id = job_id
+        self.payload = payload
+        self.attempts = attempts
+        self.worker = worker
+
+    def __repr__(self):
+        return f"Job(id={self.id}, attempts={self.attempts}, worker={self.worker})"
+
+
+class JobQueue:
+    """Очередь с арендой задач; безопасна для нескольких процессов."""
+
+    def __init__(self, db_path, visibility_timeout, max_attempts=3):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        # Транзакции управляются явно (BEGIN IMMEDIATE), чтобы аренда была атомарной
+        # Соединение используется только потоком run: запросы к нему не выполняются одновременно
+        self._db = sqlite3.connect(db_path, isolation_level=None, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, status TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_until REAL, '
+            'created REAL NOT NULL, updated REAL NOT NULL, error TEXT)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until, id)')
+        # Чтение в WAL не ждёт пишущих, поэтому depth читает своим соединением прямо из event loop
+        self._reader = sqlite3.connect(db_path, timeout=1)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-queue')
+
+    async def run(self, method, *args):
+        """Выполняет метод очереди в её потоке, не блокируя event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, method, *args)
+
+    def enqueue(self, payload):
+        """Добавляет задачу; возвращает её id."""
+        now = time.time()
+        cursor = self._db.execute(
+            'INSERT INTO jobs (payload, status, created, updated) VALUES (?, ?, ?, ?)',
+            (json.dumps(payload), PENDING, now, now)
+        )
+        return cursor.lastrowid
+
+    def lease(self, worker):
+        """Выдаёт самую старую доступную задачу в аренду или возвращает None."""
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._db.execute(
+                'SELECT id, payload, attempts FROM jobs '
+                'WHERE attempts < ? AND (status = ? OR (status = ? AND lease_until < ?)) '
+                'ORDER BY id LIMIT 1',
+                (self.max_attempts, PENDING, LEASED, now)
+            ).fetchone()
+            if row is None:
+                self._db.execute('COMMIT')
+                return None
+            job_id, payload, attempts = row
+            self._db.execute(
+                'UPDATE jobs SET status = ?, attempts = ?, worker = ?, lease_until = ?, updated = ? WHERE id = ?',
+                (LEASED, attempts + 1, worker, now + self.visibility_timeout, now, job_id)
+            )
+            self._db.execute('COMMIT')
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+        if attempts:
+            logger.warning(f"Задача {job_id} выдана повторно, попытка {attempts + 1}")
+        return Job(job_id, json.loads(payload), attempts + 1, worker)
+
+    def extend(self, job):
+        """Продлевает аренду задачи; False, если её уже забрал другой процесс."""
+        now = time.time()
+        cursor = self._db.execute(
+            'UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? AND status = ?',
+            (now + self.visibility_timeout, now, job.id, job.worker, LEASED)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job):
+        self._finish(job, DONE, None)
+
+    def retry(self, job, error):
+        """Возвращает задачу в очередь после неудачной попытки."""
+        self._finish(job, PENDING, error)
+
+    def fail(self, job, error):
+        """Окончательно помечает задачу проваленной."""
+        self._finish(job, FAILED, error)
+
+    def _finish(self, job, status, error):
+        self._db.execute(
+            'UPDATE jobs SET status = ?, lease_until = NULL, updated = ?, error = ? '
+            'WHERE id = ? AND worker = ? AND status = ?',
+            (status, time.time(), error, job.id, job.worker, LEASED)
+        )
+
+    def reap(self):
+        """Помечает проваленными задачи, исчерпавшие попытки и брошенные рабочими процессами.
+
+        Возвращает их список, чтобы можно было сообщить пользователям.
+        """
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._db.execute(
+                'SELECT id, payload, attempts, worker FROM jobs '
+                'WHERE attempts >= ? AND (status = ? OR (status = ? AND lease_until < ?))',
+                (self.max_attempts, PENDING, LEASED, now)
+            ).fetchall()
+            self._db.executemany(
+                'UPDATE jobs SET status = ?, lease_until = NULL, updated = ?, '
+                "error = COALESCE(error, 'lease expired') WHERE id = ?",
+                [(FAILED, now, row[0]) for row in rows]
+            )
+            self._db.execute('COMMIT')
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+        return [Job(job_id, json.loads(payload), attempts, worker) for job_id, payload, attempts, worker in rows]
+
+    def purge(self, older_than):
+        """Удаляет завершённые и проваленные задачи старше older_than секунд."""
+        cursor = self._db.execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?',
+            (DONE, FAILED, time.time() - older_than)
+        )
+        return cursor.rowcount
+
+    def depth(self):
+        """Количество задач, ожидающих рабочего процесса."""
+        return self._reader.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (PENDING,)).fetchone()[0]
+
+    def close(self):
+        if self._db is not None:
+            self._executor.shutdown(wait=True)
+            self._db.close()
+            self._reader.close()
+            self._db = None
+
+
+class RedisJobQueue:
+    """Очередь с арендой задач на Redis для рабочих процессов на нескольких машинах.
+
+    Задача — хеш {prefix}:job:<id>; ожидающие задачи лежат в sorted set
+    pending по id, арендованные — в leased по времени окончания аренды,
+    завершённые и проваленные — в finished по времени завершения, а
+    вернувшиеся в очередь после последней попытки — в exhausted до reap.
+    """
+
+    # Самая старая задача из ожидающих и брошенных (аренда истекла, попытки остались)
+    _LEASE = """
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local max_attempts = tonumber(ARGV[1])
+    local job_id = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+    for _, expired in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. now, 'LIMIT', 0, 100)) do
+        local attempts = tonumber(redis.call('HGET', ARGV[4] .. expired, 'attempts'))
+        if attempts < max_attempts and (not job_id or tonumber(expired) < tonumber(job_id)) then
+            job_id = expired
+        end
+    end
+    if not job_id then
+        return false
+    end
+    local key = ARGV[4] .. job_id
+    local attempts = tonumber(redis.call('HGET', key, 'attempts')) + 1
+    local lease_until = now + tonumber(ARGV[2])
+    redis.call('ZREM', KEYS[1], job_id)
+    redis.call('ZADD', KEYS[2], lease_until, job_id)
+    redis.call('HSET', key, 'status', 'leased', 'attempts', attempts, 'worker', ARGV[3],
+               'lease_until', lease_until, 'updated', now)
+    return {job_id, redis.call('HGET', key, 'payload'), attempts}
+    """
+
+    _EXTEND = """
+    local key = ARGV[3] .. ARGV[1]
+    if redis.call('HGET', key, 'status') ~= 'leased' or redis.call('HGET', key, 'worker') ~= ARGV[2] then
+        return 0
+    end
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local lease_until = now + tonumber(ARGV[4])
+    redis.call('ZADD', KEYS[1], lease_until, ARGV[1])
+    redis.call('HSET', key, 'lease_until', lease_until, 'updated', now)
+    return 1
+    """
+
+    # KEYS: pending, leased, finished, exhausted; ARGV: id, worker, статус, ошибка, prefix, max_attempts
+    _FINISH = """
+    local key = ARGV[5] .. ARGV[1]
+    if redis.call('HGET', key, 'status') ~= 'leased' or redis.call('HGET', key, 'worker') ~= ARGV[2] then
+        return 0
+    end
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HSET', key, 'status', ARGV[3], 'lease_until', '', 'updated', now, 'error', ARGV[4])
+    if ARGV[3] ~= 'pending' then
+        redis.call('ZADD', KEYS[3], now, ARGV[1])
+    elseif tonumber(redis.call('HGET', key, 'attempts')) >= tonumber(ARGV[6]) then
+        redis.call('ZADD', KEYS[4], now, ARGV[1])
+    else
+        redis.call('ZADD', KEYS[1], tonumber(ARGV[1]), ARGV[1])
+    end
+    return 1
+    """
+
+    # Брошенные после последней попытки и вернувшиеся в очередь без попыток -> failed
+    _REAP = """
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local max_attempts = tonumber(ARGV[1])
+    local reaped = {}
+    local candidates = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. now)
+    for _, job_id in ipairs(redis.call('ZRANGE', KEYS[3], 0, -1)) do
+        table.insert(candidates, job_id)
+    end
+    for _, job_id in ipairs(candidates) do
+        local key = ARGV[2] .. job_id
+        local attempts = tonumber(redis.call('HGET', key, 'attempts'))
+        if attempts >= max_attempts then
+            redis.call('ZREM', KEYS[1], job_id)
+            redis.call('ZREM', KEYS[3], job_id)
+            redis.call('ZADD', KEYS[2], now, job_id)
+            local error = redis.call('HGET', key, 'error')
+            if not error or error == '' then
+                error = 'lease expired'
+            end
+            redis.call('HSET', key, 'status', 'failed', 'lease_until', '', 'updated', now, 'error', error)
+            table.insert(reaped, {job_id, redis.call('HGET', key, 'payload'), attempts,
+                                  redis.call('HGET', key, 'worker') or ''})
+        end
+    end
+    return reaped
+    """
+
+    _PURGE = """
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local old = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. (now - tonumber(ARGV[1])))
+    for _, job_id in ipairs(old) do
+        redis.call('DEL', ARGV[2] .. job_id)
+    end
+    if #old > 0 then
+        redis.call('ZREM', KEYS[1], unpack(old))
+    end
+    return #old
+    """
+
+    def __init__(self, url, visibility_timeout, max_attempts=3, prefix='voicer:jobs', client=None):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        if client is None:
+            # Пакет redis нужен только для очереди на нескольких машинах
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=10, socket_connect_timeout=10)
+        self._redis = client
+        self._job_prefix = f"{prefix}:job:"
+        self._next_id = f"{prefix}:next_id"
+        self._pending = f"{prefix}:pending"
+        self._leased = f"{prefix}:leased"
+        self._finished = f"{prefix}:finished"
+        self._exhausted = f"{prefix}:exhausted"
+        self._lease = client.register_script(self._LEASE)
+        self._extend = client.register_script(self._EXTEND)
+        self._finish_script = client.register_script(self._FINISH)
+        self._reap = client.register_script(self._REAP)
+        self._purge = client.register_script(self._PURGE)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-queue')
+
+    async def run(self, method, *args):
+        """Выполняет метод очереди в её потоке, не блокируя event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, method, *args)
+
+    def enqueue(self, payload):
+        """Добавляет задачу; возвращает её id."""
+        job_id = self._redis.incr(self._next_id)
+        now = time.time()
+        pipe = self._redis.pipeline()
+        pipe.hset(f"{self._job_prefix}{job_id}", mapping={
+            'payload': json.dumps(payload), 'status': PENDING, 'attempts': 0,
+            'worker': '', 'created': now, 'updated': now, 'error': '',
+        })
+        pipe.zadd(self._pending, {job_id: job_id})
+        pipe.execute()
+        return job_id
+
+    def lease(self, worker):
+        """Выдаёт самую старую доступную задачу в аренду или возвращает None."""
+        row = self._lease(keys=[self._pending, self._leased],
+                          args=[self.max_attempts, self.visibility_timeout, worker, self._job_prefix])
+        if not row:
+            return None
+        job_id, payload, attempts = int(row[0]), row[1], int(row[2])
+        if attempts > 1:
+            logger.warning(f"Задача {job_id} выдана повторно, попытка {attempts}")
+        return Job(job_id, json.loads(payload), attempts, worker)
+
+    def extend(self, job):
+        """Продлевает аренду задачи; False, если её уже забрал другой процесс."""
+        return self._extend(keys=[self._leased],
+                            args=[job.id, job.worker, self._job_prefix, self.visibility_timeout]) == 1
+
+    def complete(self, job):
+        self._finish(job, DONE, None)
+
+    def retry(self, job, error):
+        """Возвращает задачу в очередь после неудачной попытки."""
+        self._finish(job, PENDING, error)
+
+    def fail(self, job, error):
+        """Окончательно помечает задачу проваленной."""
+        self._finish(job, FAILED, error)
+
+    def _finish(self, job, status, error):
+        self._finish_script(keys=[self._pending, self._leased, self._finished, self._exhausted],
+                            args=[job.id, job.worker, status, error or '', self._job_prefix, self.max_attempts])
+
+    def reap(self):
+        """Помечает проваленными задачи, исчерпавшие попытки и брошенные рабочими процессами.
+
+        Возвращает их список, чтобы можно было сообщить пользователям.
+        """
+        rows = self._reap(keys=[self._leased, self._finished, self._exhausted],
+                          args=[self.max_attempts, self._job_prefix])
+        return [Job(int(job_id), json.loads(payload), int(attempts), worker.decode() or None)
+                for job_id, payload, attempts, worker in rows]
+
+    def purge(self, older_than):
+        """Удаляет завершённые и проваленные задачи старше older_than секунд."""
+        return self._purge(keys=[self._finished], args=[int(older_than), self._job_prefix])
+
+    def depth(self):
+        """Количество задач, ожидающих рабочего процесса."""
+        return self._redis.zcard(self._pending)
+
+    def close(self):
+        if self._redis is not None:
+            self._executor.shutdown(wait=True)
+            self._redis.close()
+            self._redis = None
@@ -0,0 +1,158 @@
+"""Логирование: запись в фоновом потоке, ротация файла и записи о задачах.
+
+Логгеры только кладут записи в очередь (QueueHandler), а консоль и файл
+пишет поток QueueListener, поэтому event loop не ждёт диска. Файл лога
+ротируется по размеру.
+
+По каждой задаче (нажатию кнопки эффекта) пишется одна запись в логгер
+voicer.jobs: эффект, уровень качества, итог и длительности этапов, которые
+измеряет metrics.stage_timer. Успешные задачи можно записывать выборочно
+(LOG_JOB_SAMPLE_RATE); ошибки и отказы записываются всегда.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Библиотеки, которые пишут в лог каждый HTTP-запрос
+HTTP_LOGGERS = ('httpx', 'httpcore', 'telegram', 'telegram.ext')
+JOB_LOGGER = 'voicer.jobs'
+# Итоги задач, которые не считаются проблемой
+SUCCESS_OUTCOMES = ('ok', 'cached', 'enqueued', 'coalesced', 'duplicate')
+
+job_logger = logging.getLogger(JOB_LOGGER)
+# Запись о задаче, которая сейчас обрабатывается в этой корутине
+_current_job = ContextVar('current_job', default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись; поля записи о задаче — отдельными ключами."""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей ниже WARNING; предупреждения и ошибки — все."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def _make_formatter(fmt):
+    return JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+
+
+def setup_logging(level='INFO', http_level='WARNING', path='bot.log', max_bytes=10 * 1024 * 1024,
+                  backup_count=5, fmt='text', job_sample_rate=1.0):
+    """Настраивает корневой логгер: очередь, консоль и файл с ротацией (path '' — без файла)."""
+    formatter = _make_formatter(fmt)
+    handlers = [logging.StreamHandler()]
+    if path:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    for name in HTTP_LOGGERS:
+        logging.getLogger(name).setLevel(http_level)
+    job_logger.addFilter(SamplingFilter(job_sample_rate))
+
+    def direct_logging_in_child():
+        # Поток QueueListener не переживает fork: рабочие процессы пула пишут в stderr сами
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        child_handler = logging.StreamHandler()
+        child_handler.setFormatter(_make_formatter(fmt))
+        root.addHandler(child_handler)
+
+    os.register_at_fork(after_in_child=direct_logging_in_child)
+    return listener
+
+
+class JobRecord:
+    """Поля и длительности этапов одной задачи; пишется одной записью в finish."""
+
+    def __init__(self, **fields):
+        self.started = time.perf_counter()
+        self.fields = fields
+        self.stages = {}
+        self.outcome = 'ok'
+        self.error = None
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add_stage(self, stage, seconds):
+        # Этапы, повторяющиеся в задаче (например, рендеринг всех эффектов), суммируются
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def fail(self, outcome, error):
+        self.outcome = outcome
+        self.error = error
+
+    def finish(self):
+        total = time.perf_counter() - self.started
+        level = logging.INFO if self.outcome in SUCCESS_OUTCOMES else logging.WARNING
+        if not job_logger.isEnabledFor(level):
+            return
+        fields = dict(self.fields, outcome=self.outcome, total=round(total, 3),
+                      stages={stage: round(seconds, 3) for stage, seconds in self.stages.items()})
+        if self.error:
+            fields['error'] = self.error
+        text = ' '.join(f"{name}={value}" for name, value in fields.items() if name != 'stages')
+        stages = ' '.join(f"{stage}={seconds}" for stage, seconds in fields['stages'].items())
+        job_logger.log(level, f"Задача {text} этапы: {stages or '-'}", extra={'fields': fields})
+
+
+@contextmanager
+def job_record(**fields):
+    """Запись о задаче на время блока; этапы metrics.stage_timer внутри блока попадают в неё."""
+    record = JobRecord(**fields)
+    token = _current_job.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record.fail('error', str(e) or type(e).__name__)
+        raise
+    finally:
+        _current_job.reset(token)
+        record.finish()
+
+
+def add_stage(stage, seconds):
+    """Добавляет этап к записи текущей задачи, если она есть."""
+    record = _current_job.get()
+    if record is not None:
+        record.add_stage(stage, seconds)
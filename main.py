@@ -1,41 +1,39 @@
 import os
-import time
 import sys
+import time
+# Отсчёт холодного старта: импорты, пул рендеринга, готовность к обновлениям, прогрев
+STARTED = time.perf_counter()
+import asyncio
+import signal
 import socket
-from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram import Bot, Message, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio, InlineQueryResultCachedVoice, InlineQueryResultsButton
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, InlineQueryHandler
-from pydub import AudioSegment
-from pydub.effects import speedup, normalize, compress_dynamic_range
-from pydub.generators import Sine, Square, WhiteNoise
-import numpy as np
-import soundfile as sf
 import io
-import tempfile
+import math
 import logging
 import subprocess
-import librosa
-import pyworld as pw
-from scipy.interpolate import interp1d
-import scipy
-import ffmpeg
-import traceback
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG,  # Изменяем уровень на DEBUG
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log')
-    ]
-)
+import config
+import logs
+import metrics
+from effects import EFFECT_FUNCTIONS, render_effect, preload_waveforms, effect_params, processing_rate, effect_backend, warm_up, TIERS, FULL_TIER, PREVIEW_TIER
+from result_cache import ResultCache, make_key
+from sessions import SessionStore, VoiceSession
+from audio_io import decode_voice, encode_voice, OPUS_SAMPLE_RATE
+from streaming import render_stream
+from filtergraph import render_filtergraph
+from workers import RenderPool, QueueFullError, JobTimeoutError
+from job_queue import JobQueue, RedisJobQueue
+from webhook import WebhookServer
+from inline_cache import InlineCache, VoiceRef
+from bot_api import build_requests
+from admission import AdmissionController
+from progress import ProgressMessage
+from scheduler import RateLimiter, Coalescer
 
-# Добавляем логирование для HTTP-запросов
-logging.getLogger('httpx').setLevel(logging.DEBUG)
-logging.getLogger('httpcore').setLevel(logging.DEBUG)
-logging.getLogger('telegram').setLevel(logging.DEBUG)
-logging.getLogger('telegram.ext').setLevel(logging.DEBUG)
+# Настройка логирования: запись в фоновом потоке, файл с ротацией
+logs.setup_logging(config.LOG_LEVEL, config.LOG_HTTP_LEVEL, config.LOG_FILE, config.LOG_MAX_BYTES,
+                   config.LOG_BACKUP_COUNT, config.LOG_FORMAT, config.LOG_JOB_SAMPLE_RATE)
 
 logger = logging.getLogger(__name__)
 
@@ -69,37 +67,137 @@ def check_single_instance():
 
 # Загрузка переменных окружения
 logger.debug("Загрузка переменных окружения")
-load_dotenv()
-TOKEN = os.getenv('TELEGRAM_TOKEN')
+TOKEN = config.TELEGRAM_TOKEN
 if not TOKEN:
     logger.error("Токен бота не найден в переменных окружения")
     sys.exit(1)
 logger.debug("Токен бота загружен")
 
+if config.UPDATE_MODE == 'webhook' and not config.WEBHOOK_SECRET:
+    logger.error("Для режима webhook нужно задать WEBHOOK_SECRET")
+    sys.exit(1)
+
+def bot_api_urls():
+    """Адреса Bot API и скачивания файлов для Application и Bot (None - по умолчанию)"""
+    if not config.TELEGRAM_API_URL:
+        return None, None
+    base = config.TELEGRAM_API_URL.rstrip('/')
+    return f"{base}/bot", f"{base}/file/bot"
+
 # Проверяем наличие ffmpeg
 if not check_ffmpeg():
     logger.error("ffmpeg не установлен или не работает. Установите ffmpeg и перезапустите бота.")
     sys.exit(1)
 
-# Проверяем, не запущен ли уже бот
-if not check_single_instance():
+# Проверяем, не запущен ли уже бот; рабочих процессов очереди может быть сколько угодно
+if config.RUN_MODE != 'worker' and not check_single_instance():
     logger.error("Бот уже запущен. Завершение работы.")
     sys.exit(1)
 
+def semitones_text(count):
+    """'1 полутон', '2 полутона', '5 полутонов'."""
+    if count % 10 == 1 and count % 100 != 11:
+        return f"{count} полутон"
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return f"{count} полутона"
+    return f"{count} полутонов"
+
 # Словарь с эффектами
 EFFECTS = {
     'robot': 'Эффект робота',
     'musical': 'Музыкальный эффект голоса',
     'autotune': 'Эффект автотюна',
-    'rough': 'Эффект грубого голоса'
+    'rough': 'Эффект грубого голоса',
+    'pitch_up': f"Голос выше на {semitones_text(config.PITCH_SEMITONES)}",
+    'pitch_down': f"Голос ниже на {semitones_text(config.PITCH_SEMITONES)}",
 }
+# Кнопка, применяющая все эффекты сразу к одному скачиванию
+ALL_EFFECTS = 'all'
+ALL_EFFECTS_NAME = 'Все эффекты сразу'
 logger.debug(f"Загружены эффекты: {EFFECTS}")
 
-# Глобальный словарь для хранения голосовых сообщений
-voice_messages = {}
-
 # Время жизни сохраненного сообщения (в секундах)
 MESSAGE_TIMEOUT = 300  # 5 минут
+# Как часто удалять устаревшие сообщения (в секундах)
+SESSION_SWEEP_INTERVAL = 30
+
+# Голосовые сообщения, ожидающие выбора эффекта
+session_store = SessionStore(config.SESSION_CAPACITY, MESSAGE_TIMEOUT, config.SESSION_DB)
+
+# Кэш file_id готовых результатов
+result_cache = ResultCache(config.RESULT_CACHE_SIZE, config.RESULT_CACHE_DB)
+
+# Готовые варианты эффектов для инлайн-режима
+inline_cache = InlineCache(config.INLINE_CACHE_SIZE, config.INLINE_MAX_AGE, config.INLINE_RECENT_VOICES)
+# Сколько результатов возвращать на инлайн-запрос (ограничение Telegram - 50)
+INLINE_RESULTS_LIMIT = 50
+# Сколько секунд Telegram может кэшировать ответ на инлайн-запрос
+INLINE_CACHE_TIME = 10
+# Пауза предварительного рендеринга, пока пул занят запросами пользователей
+PRERENDER_IDLE_WAIT = 1.0
+# Очередь предварительного рендеринга создаётся внутри event loop
+prerender_queue = None
+
+# Сколько хранить выполненные задачи общей очереди (в секундах)
+JOB_RETENTION = 24 * 60 * 60
+
+# Общая очередь задач для распределённого режима (front/worker)
+job_queue = None
+if config.RUN_MODE in ('front', 'worker'):
+    if config.JOB_QUEUE_URL:
+        # Рабочие процессы на нескольких машинах
+        job_queue = RedisJobQueue(config.JOB_QUEUE_URL, config.JOB_VISIBILITY_TIMEOUT, config.JOB_MAX_ATTEMPTS)
+        logger.info(f"Режим {config.RUN_MODE}, очередь задач в Redis")
+    else:
+        job_queue = JobQueue(config.JOB_QUEUE_DB, config.JOB_VISIBILITY_TIMEOUT, config.JOB_MAX_ATTEMPTS)
+        logger.info(f"Режим {config.RUN_MODE}, очередь задач: {config.JOB_QUEUE_DB}")
+
+# Пул процессов для рендеринга эффектов
+render_pool = RenderPool(
+    workers=config.RENDER_WORKERS,
+    max_queue=config.RENDER_QUEUE_SIZE,
+    job_timeout=config.RENDER_JOB_TIMEOUT,
+    notice_position=config.QUEUE_NOTICE_POSITION,
+    # Каждый процесс по разу применяет все эффекты до первой задачи
+    initializer=warm_up,
+    # Задачи разных чатов обслуживаются по кругу, по столько секунд аудио за круг
+    quantum=config.FAIR_QUANTUM_SECONDS
+)
+
+# Выбор уровня качества под нагрузкой и отказ при перегрузке
+admission = AdmissionController(render_pool, config.ADMISSION_TARGET_SECONDS, config.ADMISSION_REJECT_SECONDS)
+BUSY_TEXT = "Бот сейчас перегружен. Пожалуйста, попробуйте через минуту."
+
+# Ограничение частоты запросов на рендеринг для пользователей и чатов
+user_limiter = RateLimiter(config.RATE_LIMIT_USER_PER_MINUTE, config.RATE_LIMIT_USER_BURST)
+chat_limiter = RateLimiter(config.RATE_LIMIT_CHAT_PER_MINUTE, config.RATE_LIMIT_CHAT_BURST)
+# Выполняющиеся задачи: такой же запрос ждёт их результата вместо рендеринга
+coalescer = Coalescer()
+
+# Можно ли заменить голосовое предпросмотра полной версией (editMessageMedia);
+# после первого отказа Telegram полная версия отправляется следующим сообщением
+preview_editable = True
+# Ошибки editMessageMedia, означающие, что голосовое нельзя заменить аудиофайлом
+# вообще, а не только в этом сообщении (например, удалённом пользователем)
+PREVIEW_NOT_EDITABLE_ERRORS = ("message can't be edited", 'media_type_invalid', 'type of file mismatch')
+
+def record_startup(phase):
+    """Запоминает время от запуска процесса до окончания этапа холодного старта"""
+    seconds = time.perf_counter() - STARTED
+    metrics.STARTUP_SECONDS.set(seconds, phase=phase)
+    logger.info(f"Холодный старт: {phase} через {seconds:.2f} сек")
+    return seconds
+
+async def wait_workers_warm():
+    """Дожидается прогрева рабочих процессов и записывает его время"""
+    timings = await render_pool.wait_ready()
+    record_startup('workers')
+    warmed = [seconds for seconds in timings if seconds is not None]
+    if warmed:
+        logger.info(f"Рабочие процессы прогреты: {len(warmed)} из {len(timings)}, "
+                    f"дольше всех {max(warmed):.2f} сек")
+    else:
+        logger.warning("Ни один рабочий процесс не сообщил о готовности")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -110,7 +208,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Как использовать:\n"
             "1. Ответьте на голосовое сообщение\n"
             "2. Выберите эффект\n"
-            "3. Получите обработанное сообщение"
+            "3. Получите обработанное сообщение\n\n"
+            "В любом чате можно набрать @имя_бота и эффект: бот предложит готовые "
+            "варианты ваших последних голосовых сообщений."
         )
         logger.info(f"Отправлено приветственное сообщение пользователю {update.effective_user.id}")
     except Exception as e:
@@ -145,530 +245,1034 @@ async def handle_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        # Сохраняем информацию о голосовом сообщении
-        voice_info = {
-            'file_id': update.message.reply_to_message.voice.file_id,
-            'message_id': update.message.reply_to_message.message_id,
-            'chat_id': update.message.chat_id,
-            'reply_message_id': update.message.message_id,
-            'timestamp': time.time()
-        }
-        
-        # Сохраняем в глобальный словарь
-        voice_messages[update.effective_user.id] = voice_info
-        logger.debug(f"Текущее состояние voice_messages: {voice_messages}")
-        
         # Создаем клавиатуру с эффектами
         keyboard = [
             [InlineKeyboardButton(effect_name, callback_data=effect_id)]
             for effect_id, effect_name in EFFECTS.items()
         ]
+        keyboard.append([InlineKeyboardButton(ALL_EFFECTS_NAME, callback_data=ALL_EFFECTS)])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Отправляем сообщение с кнопками
-        await update.message.reply_text(
+        keyboard_message = await update.message.reply_text(
             "Выберите эффект для голосового сообщения:",
             reply_markup=reply_markup
         )
         logger.info(f"Отправлены кнопки эффектов пользователю {update.effective_user.id}")
         
+        # Сохраняем информацию о голосовом сообщении под ключом сообщения с кнопками
+        session = VoiceSession(
+            user_id=update.effective_user.id,
+            chat_id=update.message.chat_id,
+            message_id=update.message.reply_to_message.message_id,
+            reply_message_id=update.message.message_id,
+            file_id=update.message.reply_to_message.voice.file_id,
+            file_unique_id=update.message.reply_to_message.voice.file_unique_id,
+            duration=update.message.reply_to_message.voice.duration
+        )
+        session_store.put(keyboard_message.chat_id, keyboard_message.message_id, session)
+        logger.debug(f"Сохранена сессия {session}, всего сессий: {len(session_store)}")
+        remember_voice(update.effective_user.id, update.message.reply_to_message.voice)
+        
     except Exception as e:
         logger.error(f"Ошибка в handle_reply: {str(e)}")
         logger.exception("Полный стек ошибки:")
         await update.message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз.")
 
+async def finish_effect_request(query):
+    """Удаляет сообщение с кнопками и информацию о голосовом сообщении"""
+    # Удаляем сообщение с кнопками
+    try:
+        await query.message.delete()
+    except Exception as e:
+        logger.warning(f"Не удалось удалить сообщение с кнопками: {str(e)}")
+        logger.exception("Полный стек ошибки при удалении сообщения:")
+    
+    # Удаляем информацию о голосовом сообщении
+    session_store.pop(query.message.chat_id, query.message.message_id)
+    logger.debug(f"Информация о голосовом сообщении удалена для сообщения {query.message.message_id}")
+
+class ProcessingError(Exception):
+    """Ошибка этапа обработки; текст исключения показывается пользователю."""
+    
+    def __init__(self, message, drop_session=False):
+        super().__init__(message)
+        # Нужно ли удалить сессию (повторное нажатие кнопки не поможет)
+        self.drop_session = drop_session
+
+async def download_voice(bot, session, effect):
+    """Получает и скачивает голосовое сообщение сессии; возвращает OGG."""
+    # Получаем файл голосового сообщения
+    try:
+        with metrics.stage_timer('get_file', effect):
+            voice = await bot.get_file(session.file_id)
+        # Описание файла собирается, только если DEBUG действительно включён
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Получен файл голосового сообщения: {voice.to_dict()}")
+    except Exception as e:
+        logger.error(f"Ошибка при получении файла голосового сообщения: {str(e)}")
+        logger.exception("Полный стек ошибки при получении файла:")
+        raise ProcessingError("Ошибка при получении голосового сообщения. Пожалуйста, попробуйте еще раз.",
+                              drop_session=True) from e
+    
+    # Скачиваем файл в память
+    try:
+        ogg_buffer = io.BytesIO()
+        with metrics.stage_timer('download', effect):
+            await voice.download_to_memory(ogg_buffer)
+        ogg_data = ogg_buffer.getvalue()
+        logger.debug(f"Размер скачанного файла: {len(ogg_data)} байт")
+        if not ogg_data:
+            logger.error("Скачанный файл пуст")
+            raise Exception("Скачанный файл пуст")
+    except Exception as e:
+        logger.error(f"Ошибка при скачивании файла: {str(e)}")
+        logger.exception("Полный стек ошибки при скачивании:")
+        raise ProcessingError("Ошибка при скачивании голосового сообщения. Пожалуйста, попробуйте еще раз.") from e
+    return ogg_data
+
+def uses_ogg_pipeline(effect, session):
+    """True, если эффект рендерится из OGG в OGG без декодирования в event loop"""
+    if effect_backend(effect) == 'ffmpeg':
+        return True
+    return 0 < config.STREAMING_MIN_SECONDS <= session.duration
+
+def ogg_pipeline_job(effect, ogg_data, tier=FULL_TIER):
+    """Этап для метрик, функция и аргументы задачи пула для обработки OGG -> OGG"""
+    if effect_backend(effect) == 'ffmpeg':
+        return ('filtergraph', render_filtergraph, ogg_data, effect, processing_rate(effect, tier),
+                config.FFMPEG_TIMEOUT, TIERS[tier].max_seconds)
+    return ('stream', render_stream, ogg_data, effect, processing_rate(effect, tier),
+            config.STREAM_BLOCK_SECONDS, config.FFMPEG_TIMEOUT, tier)
+
+def effect_caption(effect, session, tier=FULL_TIER):
+    """Подпись результата; под нагрузкой — с пометкой, что обработано только начало"""
+    max_seconds = TIERS[tier].max_seconds
+    if max_seconds and session.duration > max_seconds:
+        return f"Эффект: {EFFECTS[effect]} (первые {max_seconds:g} сек)"
+    return f"Эффект: {EFFECTS[effect]}"
+
+def job_cost(session, tier=FULL_TIER):
+    """Стоимость задачи для очереди пула: сколько секунд аудио она обрабатывает"""
+    max_seconds = TIERS[tier].max_seconds
+    return max(1.0, min(session.duration, max_seconds) if max_seconds else session.duration)
+
+def observe_render(effect, tier, audio_seconds, render_seconds):
+    """Записывает рендеринг в метрики и в оценки контроля нагрузки"""
+    metrics.observe_render(effect, audio_seconds, render_seconds)
+    metrics.RENDER_TIERS.inc(effect=effect, tier=tier)
+    admission.observe(effect, tier, audio_seconds, render_seconds)
+
+async def render_voice(ogg_data, session, effect, notify_queued, tier=FULL_TIER, stage_prefix=''):
+    """Применяет эффект к OGG на уровне качества tier в пуле процессов; возвращает OGG результата."""
+    # Эффекты на фильтрграфе ffmpeg и длинные сообщения (потоково, блоками)
+    # обрабатываются из OGG в OGG целиком в рабочем процессе
+    direct = uses_ogg_pipeline(effect, session)
+    
+    if not direct:
+        # Декодируем OGG в PCM через ffmpeg
+        try:
+            with metrics.stage_timer(stage_prefix + 'decode', effect):
+                audio = await decode_voice(ogg_data, config.FFMPEG_TIMEOUT, processing_rate(effect, tier),
+                                           max_seconds=TIERS[tier].max_seconds)
+            logger.debug(f"Аудио декодировано: {audio}")
+        except Exception as e:
+            logger.error(f"Ошибка при декодировании аудио: {str(e)}")
+            logger.exception("Полный стек ошибки при декодировании:")
+            raise ProcessingError("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.") from e
+    
+    # Рендерим эффект в пуле процессов, не блокируя обработку других обновлений
+    try:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Постановка в очередь рендеринга эффекта {effect} ({tier}), "
+                         f"в очереди: {render_pool.queue_depth}, выполняется: {render_pool.in_flight}")
+        if direct:
+            stage, *job = ogg_pipeline_job(effect, ogg_data, tier)
+            result_ogg, audio_seconds, render_seconds = await render_pool.submit(
+                *job, on_queued=notify_queued, label=effect, flow=session.chat_id, cost=job_cost(session, tier)
+            )
+            metrics.observe_stage(stage_prefix + stage, effect, render_seconds)
+            logger.debug(f"Эффект {effect} применен ({stage}, {tier}) за {render_seconds:.2f} сек, длительность: {audio_seconds:.1f} сек")
+        else:
+            processed, render_seconds = await render_pool.submit(
+                render_effect, audio, effect, tier,
+                on_queued=notify_queued, label=effect, flow=session.chat_id, cost=job_cost(session, tier)
+            )
+            audio_seconds = audio.duration
+            metrics.observe_stage(stage_prefix + 'effect', effect, render_seconds)
+            logger.debug(f"Эффект {effect} применен ({tier}) за {render_seconds:.2f} сек, новая частота дискретизации: {processed.sample_rate}")
+        observe_render(effect, tier, audio_seconds, render_seconds)
+    except QueueFullError as e:
+        metrics.JOBS.inc(effect=effect, outcome='queue_full')
+        logger.warning(f"Очередь рендеринга переполнена: {str(e)}")
+        raise ProcessingError(BUSY_TEXT) from e
+    except JobTimeoutError as e:
+        metrics.JOBS.inc(effect=effect, outcome='timeout')
+        logger.error(f"Превышено время обработки эффекта {effect}: {str(e)}")
+        raise ProcessingError("Обработка заняла слишком много времени. Попробуйте более короткое сообщение.") from e
+    except Exception as e:
+        logger.error(f"Ошибка при применении эффекта {effect}: {str(e)}")
+        logger.exception("Полный стек ошибки при применении эффекта:")
+        raise ProcessingError("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.") from e
+    
+    if not direct:
+        # Кодируем в OGG/Opus через ffmpeg
+        try:
+            with metrics.stage_timer(stage_prefix + 'encode', effect):
+                result_ogg = await encode_voice(processed, config.FFMPEG_TIMEOUT)
+            logger.debug(f"Размер OGG: {len(result_ogg)} байт")
+        except Exception as e:
+            logger.error(f"Ошибка при кодировании в OGG: {str(e)}")
+            logger.exception("Полный стек ошибки при кодировании в OGG:")
+            raise ProcessingError("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.") from e
+    return result_ogg
+
+def wants_preview(effect, session, tier=FULL_TIER):
+    """True, если результат отправляется прогрессивно: сначала предпросмотр начала, затем полная версия"""
+    return (effect != ALL_EFFECTS and tier == FULL_TIER
+            and 0 < config.PROGRESSIVE_MIN_SECONDS <= session.duration
+            and session.duration > config.PREVIEW_SECONDS)
+
+def remaining_text(seconds):
+    if seconds >= 1:
+        return f"Осталось примерно {int(seconds + 0.5)} сек."
+    return "Почти готово."
+
+async def render_preview(ogg_data, session, effect, progress):
+    """OGG предпросмотра начала сообщения или None, если предпросмотр не получился"""
+    # Под нагрузкой место в очереди нужнее полной версии
+    if render_pool.max_queue - render_pool.queue_depth < 2:
+        return None
+    await progress.set_stage(f"Обработка: готовлю первые {config.PREVIEW_SECONDS:g} сек.")
+    try:
+        return await render_voice(ogg_data, session, effect, None, PREVIEW_TIER, stage_prefix='preview_')
+    except ProcessingError as e:
+        logger.warning(f"Предпросмотр эффекта {effect} не получился, будет только полная версия: {str(e)}")
+        return None
+
+async def send_preview(bot, session, effect, preview_ogg, progress):
+    """Отправляет предпросмотр; возвращает сообщение или None, если отправить не удалось"""
+    try:
+        with metrics.stage_timer('send_preview', effect):
+            message = await bot.send_voice(
+                chat_id=session.chat_id,
+                voice=preview_ogg,
+                caption=f"{effect_caption(effect, session, PREVIEW_TIER)}, полная версия скоро будет",
+                reply_to_message_id=session.message_id
+            )
+    except Exception as e:
+        logger.warning(f"Не удалось отправить предпросмотр эффекта {effect}: {str(e)}")
+        return None
+    await progress.set_stage("Обработка полной версии: начало уже отправлено.")
+    progress.start()
+    return message
+
+def audio_cache_key(session, effect):
+    """Ключ кэша результата, отправленного аудиофайлом (альбом всех эффектов, заменённый предпросмотр)"""
+    return make_key(session.file_unique_id, effect, effect_params(effect) + ('audio',))
+
+async def replace_preview(bot, session, effect, preview, result_ogg):
+    """Заменяет предпросмотр полной версией; None, если её нужно отправить отдельным сообщением"""
+    global preview_editable
+    if not preview_editable:
+        return None
+    try:
+        with metrics.stage_timer('edit_media', effect):
+            message = await bot.edit_message_media(
+                media=InputMediaAudio(result_ogg, caption=effect_caption(effect, session),
+                                      title=EFFECTS[effect], filename=f"{effect}.ogg"),
+                chat_id=session.chat_id,
+                message_id=preview.message_id
+            )
+    except BadRequest as e:
+        if any(error in str(e).lower() for error in PREVIEW_NOT_EDITABLE_ERRORS):
+            # Telegram не даёт заменить голосовое: дальше полная версия сразу идёт следующим сообщением
+            preview_editable = False
+            logger.info(f"Предпросмотр нельзя заменить ({str(e)}), полная версия отправляется отдельно")
+        else:
+            logger.warning(f"Не удалось заменить предпросмотр эффекта {effect}: {str(e)}")
+        return None
+    except Exception as e:
+        logger.warning(f"Не удалось заменить предпросмотр эффекта {effect}: {str(e)}")
+        return None
+    metrics.JOBS.inc(effect=effect, outcome='ok')
+    # Сообщение стало аудиофайлом: его file_id годится для альбома всех эффектов
+    # и для повторных нажатий этого эффекта
+    if isinstance(message, Message) and message.audio is not None:
+        result_cache.put(audio_cache_key(session, effect), message.audio.file_id)
+    return message
+
+async def process_voice(bot, session, effect, cache_key, notify_queued, tier=FULL_TIER, progress=None):
+    """Скачивает голосовое сообщение, применяет эффект на уровне качества tier и отправляет результат.
+    
+    Если передан progress (ProgressMessage сообщения с кнопками), длинные сообщения
+    отправляются прогрессивно: сначала предпросмотр начала, затем полная версия.
+    Возвращает отправленное сообщение (для всех эффектов сразу - None).
+    Ошибки этапов выбрасываются как ProcessingError с текстом для пользователя.
+    """
+    if effect == ALL_EFFECTS:
+        await process_all_effects(bot, session, notify_queued, tier)
+        return None
+    
+    started = time.perf_counter()
+    ogg_data = await download_voice(bot, session, effect)
+    
+    preview = None
+    full_render = None
+    try:
+        if progress is not None and wants_preview(effect, session, tier):
+            # Полная версия рендерится одновременно с предпросмотром; предпросмотр
+            # короче, его декодирование заканчивается раньше, и в пул он попадает первым
+            full_render = asyncio.create_task(render_voice(ogg_data, session, effect, notify_queued, tier))
+            preview_ogg = await render_preview(ogg_data, session, effect, progress)
+            # Если полная версия уже готова, предпросмотр не нужен
+            if preview_ogg is not None and not full_render.done():
+                expected = started + admission.estimate([effect], session.duration, tier)
+                progress.detail = lambda: remaining_text(expected - time.perf_counter())
+                preview = await send_preview(bot, session, effect, preview_ogg, progress)
+        if preview is not None:
+            metrics.observe_stage('first_audio', effect, time.perf_counter() - started)
+        if full_render is not None:
+            result_ogg = await full_render
+        else:
+            result_ogg = await render_voice(ogg_data, session, effect, notify_queued, tier)
+    finally:
+        if full_render is not None:
+            full_render.cancel()
+    
+    if preview is not None:
+        progress.close()
+        replaced = await replace_preview(bot, session, effect, preview, result_ogg)
+        if replaced is not None:
+            return replaced
+    
+    # Отправляем обработанное сообщение
+    try:
+        with metrics.stage_timer('send_voice', effect):
+            sent_message = await bot.send_voice(
+                chat_id=session.chat_id,
+                # bytes загружаются как есть, без копии в BytesIO
+                voice=result_ogg,
+                caption=effect_caption(effect, session, tier),
+                reply_to_message_id=session.message_id
+            )
+        metrics.JOBS.inc(effect=effect, outcome='ok')
+        if preview is None:
+            metrics.observe_stage('first_audio', effect, time.perf_counter() - started)
+        logger.debug(f"Обработанное голосовое сообщение отправлено в чат {session.chat_id}")
+        # Упрощённый под нагрузкой результат не кэшируется: в следующий раз рендерим полностью
+        if tier == FULL_TIER:
+            result_cache.put(cache_key, sent_message.voice.file_id)
+            inline_cache.add_variant(session.file_unique_id, effect, sent_message.voice.file_id)
+    except Exception as e:
+        logger.error(f"Ошибка при отправке обработанного сообщения: {str(e)}")
+        logger.exception("Полный стек ошибки при отправке:")
+        raise ProcessingError("Ошибка при отправке обработанного сообщения. Пожалуйста, попробуйте еще раз.") from e
+    return sent_message
+
+async def render_all_effects(ogg_data, session, effect_ids, notify_queued, tier=FULL_TIER):
+    """Рендерит несколько эффектов параллельно в пуле процессов; возвращает {эффект: OGG}."""
+    if render_pool.max_queue - render_pool.queue_depth < len(effect_ids):
+        raise QueueFullError(f"В очереди нет места для {len(effect_ids)} задач")
+    direct = [effect_id for effect_id in effect_ids if uses_ogg_pipeline(effect_id, session)]
+    decoded = [effect_id for effect_id in effect_ids if effect_id not in direct]
+    notified = []
+    
+    async def notify_once(position):
+        if not notified:
+            notified.append(position)
+            await notify_queued(position)
+    
+    jobs = []
+    stages = {}
+    for effect_id in direct:
+        stages[effect_id], *job = ogg_pipeline_job(effect_id, ogg_data, tier)
+        jobs.append(render_pool.submit(*job, on_queued=notify_once, label=effect_id,
+                                       flow=session.chat_id, cost=job_cost(session, tier)))
+    if decoded:
+        # Декодируем один раз на родной частоте Opus; эффекты с другой частотой
+        # обработки передискретизируют PCM в рабочем процессе
+        with metrics.stage_timer('decode', ALL_EFFECTS):
+            audio = await decode_voice(ogg_data, config.FFMPEG_TIMEOUT, OPUS_SAMPLE_RATE,
+                                       max_seconds=TIERS[tier].max_seconds)
+        jobs.extend(
+            render_pool.submit(render_effect, audio, effect_id, tier, on_queued=notify_once,
+                               label=effect_id, flow=session.chat_id, cost=job_cost(session, tier))
+            for effect_id in decoded
+        )
+    rendered = await asyncio.gather(*jobs, return_exceptions=True)
+    for result in rendered:
+        if isinstance(result, BaseException):
+            raise result
+    
+    results = {}
+    encodes = []
+    for effect_id, result in zip(direct + decoded, rendered):
+        if effect_id in stages:
+            result_ogg, audio_seconds, render_seconds = result
+            results[effect_id] = result_ogg
+            observe_render(effect_id, tier, audio_seconds, render_seconds)
+            metrics.observe_stage(stages[effect_id], effect_id, render_seconds)
+        else:
+            processed, render_seconds = result
+            encodes.append((effect_id, encode_voice(processed, config.FFMPEG_TIMEOUT)))
+            observe_render(effect_id, tier, audio.duration, render_seconds)
+            metrics.observe_stage('effect', effect_id, render_seconds)
+    if encodes:
+        with metrics.stage_timer('encode', ALL_EFFECTS):
+            encoded = await asyncio.gather(*(job for _, job in encodes))
+        for (effect_id, _), result_ogg in zip(encodes, encoded):
+            results[effect_id] = result_ogg
+    return results
+
+async def process_all_effects(bot, session, notify_queued, tier=FULL_TIER):
+    """Применяет все эффекты к одному скачиванию и отправляет их одним альбомом."""
+    effect_ids = list(EFFECT_FUNCTIONS)
+    # Файлы альбома отправляются как аудио, их file_id кэшируются отдельно от голосовых
+    keys = {effect_id: audio_cache_key(session, effect_id) for effect_id in effect_ids}
+    cached = {effect_id: result_cache.get(key) for effect_id, key in keys.items()}
+    missing = [effect_id for effect_id in effect_ids if cached[effect_id] is None]
+    logger.debug(f"Все эффекты для {session}: из кэша {len(effect_ids) - len(missing)}, рендеринг {missing}")
+    
+    rendered = {}
+    if missing:
+        ogg_data = await download_voice(bot, session, ALL_EFFECTS)
+        try:
+            rendered = await render_all_effects(ogg_data, session, missing, notify_queued, tier)
+        except QueueFullError as e:
+            metrics.JOBS.inc(effect=ALL_EFFECTS, outcome='queue_full')
+            logger.warning(f"Очередь рендеринга переполнена: {str(e)}")
+            raise ProcessingError(BUSY_TEXT) from e
+        except JobTimeoutError as e:
+            metrics.JOBS.inc(effect=ALL_EFFECTS, outcome='timeout')
+            logger.error(f"Превышено время обработки всех эффектов: {str(e)}")
+            raise ProcessingError("Обработка заняла слишком много времени. Попробуйте более короткое сообщение.") from e
+        except Exception as e:
+            logger.error(f"Ошибка при применении всех эффектов: {str(e)}")
+            logger.exception("Полный стек ошибки при применении всех эффектов:")
+            raise ProcessingError("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.") from e
+    
+    media = [
+        InputMediaAudio(
+            cached[effect_id] or rendered[effect_id],
+            caption=effect_caption(effect_id, session, tier) if effect_id in rendered else f"Эффект: {EFFECTS[effect_id]}",
+            title=EFFECTS[effect_id],
+            filename=f"{effect_id}.ogg"
+        )
+        for effect_id in effect_ids
+    ]
+    try:
+        with metrics.stage_timer('send_media_group', ALL_EFFECTS):
+            messages = await bot.send_media_group(
+                chat_id=session.chat_id,
+                media=media,
+                reply_to_message_id=session.message_id
+            )
+    except Exception as e:
+        logger.error(f"Ошибка при отправке альбома эффектов: {str(e)}")
+        logger.exception("Полный стек ошибки при отправке альбома:")
+        # Кэшированный file_id мог устареть: в следующий раз рендерим заново
+        for effect_id in effect_ids:
+            if cached[effect_id] is not None:
+                result_cache.discard(keys[effect_id])
+        raise ProcessingError("Ошибка при отправке обработанного сообщения. Пожалуйста, попробуйте еще раз.") from e
+    
+    for effect_id, message in zip(effect_ids, messages):
+        attachment = message.audio or message.document
+        if effect_id in rendered and attachment is not None and tier == FULL_TIER:
+            result_cache.put(keys[effect_id], attachment.file_id)
+    metrics.JOBS.inc(effect=ALL_EFFECTS, outcome='ok')
+    logger.debug(f"Альбом из {len(messages)} эффектов отправлен в чат {session.chat_id}")
+
 async def apply_effect(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Применяет выбранный эффект к аудио."""
     query = update.callback_query
-    await query.answer()
     
     effect = query.data
     user_id = update.effective_user.id
-    logger.info(f"Пользователь {user_id} выбрал эффект: {effect}")
-    logger.debug(f"Полная информация о callback_query: {query.to_dict()}")
-    logger.debug(f"Текущее состояние контекста: {context.user_data}")
-    
-    # Получаем информацию о голосовом сообщении из глобального словаря
-    if user_id not in voice_messages:
-        logger.error(f"Информация о голосовом сообщении не найдена для пользователя {user_id}")
-        logger.debug(f"Текущее состояние voice_messages: {voice_messages}")
-        logger.debug(f"Все ключи в voice_messages: {list(voice_messages.keys())}")
-        logger.debug(f"Текущий user_id: {user_id}, тип: {type(user_id)}")
-        await query.message.edit_text("Пожалуйста, ответьте на голосовое сообщение.")
+    chat_id = query.message.chat_id
+    keyboard_id = query.message.message_id
+    logger.debug(f"Пользователь {user_id} выбрал эффект: {effect}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Полная информация о callback_query: {query.to_dict()}")
+    
+    # Получаем информацию о голосовом сообщении по сообщению с кнопками
+    session = session_store.get(chat_id, keyboard_id)
+    if session is None:
+        await query.answer()
+        if session_store.is_expired(chat_id, keyboard_id):
+            logger.warning(f"Время действия сообщения {keyboard_id} истекло для пользователя {user_id}")
+            await query.message.edit_text("Время действия сообщения истекло. Пожалуйста, ответьте на голосовое сообщение снова.")
+            session_store.pop(chat_id, keyboard_id)
+        else:
+            logger.error(f"Информация о голосовом сообщении не найдена для сообщения {keyboard_id}")
+            await query.message.edit_text("Пожалуйста, ответьте на голосовое сообщение.")
         return
     
-    voice_info = voice_messages[user_id]
-    logger.debug(f"Получена информация о голосовом сообщении: {voice_info}")
-    logger.debug(f"Типы данных в voice_info: { {k: type(v) for k, v in voice_info.items()} }")
-    logger.debug(f"Полная информация о сообщении: {query.message.to_dict()}")
-    
-    # Проверяем, не истекло ли время действия сообщения
-    current_time = time.time()
-    message_age = current_time - voice_info['timestamp']
-    logger.debug(f"Текущее время: {current_time}, время сообщения: {voice_info['timestamp']}, возраст: {message_age} сек")
-    logger.debug(f"Таймаут сообщения: {MESSAGE_TIMEOUT} сек")
-    
-    if message_age > MESSAGE_TIMEOUT:
-        logger.warning(f"Время действия сообщения истекло для пользователя {user_id}")
-        logger.debug(f"Возраст сообщения: {message_age} сек, таймаут: {MESSAGE_TIMEOUT} сек")
-        await query.message.edit_text("Время действия сообщения истекло. Пожалуйста, ответьте на голосовое сообщение снова.")
-        del voice_messages[user_id]
+    if session.user_id != user_id:
+        logger.warning(f"Пользователь {user_id} нажал кнопку пользователя {session.user_id}")
+        await query.answer("Эти кнопки предназначены для другого пользователя.")
         return
     
-    logger.info(f"Обработка голосового сообщения с информацией: {voice_info}")
+    if effect not in EFFECT_FUNCTIONS and effect != ALL_EFFECTS:
+        await query.answer()
+        logger.warning(f"Неизвестный эффект {effect} выбран пользователем {user_id}")
+        await query.message.edit_text("Неизвестный эффект.")
+        return
     
+    # Одна запись в логе на задачу: итог и длительности этапов
+    with logs.job_record(effect=effect, user=user_id, chat=chat_id, duration=session.duration) as record:
+        await run_effect_request(query, context, session, effect, record)
+
+def cached_result(session, effect, cache_key):
+    """(ключ, file_id, вид) готового результата эффекта или None; вид - 'voice' или 'audio'"""
+    file_id = result_cache.get(cache_key)
+    if file_id is not None:
+        return cache_key, file_id, 'voice'
+    # Полная версия, заменившая предпросмотр, сохранена как аудиофайл
+    audio_key = audio_cache_key(session, effect)
+    file_id = result_cache.get(audio_key)
+    if file_id is not None:
+        return audio_key, file_id, 'audio'
+    return None
+
+async def run_effect_request(query, context, session, effect, record):
+    """Отправляет результат эффекта из кэша или рендерит его; итог записывается в record."""
+    user_id = session.user_id
+    chat_id = query.message.chat_id
+    
+    # Если этот эффект уже применялся к этому голосовому, отправляем готовый file_id
+    cache_key = make_key(session.file_unique_id, effect, effect_params(effect))
+    # Для всех эффектов сразу кэш проверяется по каждому эффекту отдельно
+    cached = cached_result(session, effect, cache_key) if effect != ALL_EFFECTS else None
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Кэш результатов: {result_cache.stats()}")
+    
+    if cached is None:
+        # Такая же задача уже выполняется: ждём её результат вместо повторного рендеринга
+        pending = coalescer.pending(cache_key)
+        if pending is not None:
+            if coalescer.owner(cache_key) == (chat_id, query.message.message_id):
+                # Повторное нажатие той же кнопки: результат уже готовится и придёт один раз
+                await query.answer()
+                record.outcome = 'duplicate'
+                return
+            await send_coalesced_result(query, context, session, effect, pending, record)
+            return
+        # Ограничение частоты: один пользователь или чат не занимает весь пул
+        if await throttle(query, effect, user_id, chat_id, record):
+            return
+    
+    # Уровень качества по текущей нагрузке; при перегрузке кнопки остаются, чтобы повторить позже
+    tier = FULL_TIER
+    effect_ids = list(EFFECT_FUNCTIONS) if effect == ALL_EFFECTS else [effect]
+    admitted = cached is None and config.RUN_MODE == 'single'
+    if admitted:
+        tier = admission.choose(effect_ids, session.duration)
+        if tier is None:
+            metrics.JOBS.inc(effect=effect, outcome='rejected')
+            logger.warning(f"Запрос {effect} пользователя {user_id} отклонён: {admission.stats()}")
+            record.fail('rejected', BUSY_TEXT)
+            await query.answer(BUSY_TEXT, show_alert=True)
+            return
+    # Принятая задача держит места в оценке нагрузки, пока не завершится любым образом,
+    # в том числе если не удалось даже ответить на нажатие
+    try:
+        if cached is None:
+            user_limiter.take(user_id)
+            chat_limiter.take(chat_id)
+        
+        # Такие же запросы, пришедшие во время рендеринга, получат его результат;
+        # все эффекты сразу не объединяются, их кэш проверяется по каждому эффекту
+        if not admitted or effect == ALL_EFFECTS:
+            await deliver_effect(query, context, session, effect, cache_key, cached, tier, record)
+            return
+        coalescer.lead(cache_key, (chat_id, query.message.message_id))
+        sent_message = None
+        try:
+            sent_message = await deliver_effect(query, context, session, effect, cache_key, None, tier, record)
+        finally:
+            coalescer.finish(cache_key, shared_result(sent_message, tier))
+    finally:
+        if admitted:
+            admission.release(len(effect_ids))
+
+async def throttle(query, effect, user_id, chat_id, record):
+    """Отказывает в рендеринге, если пользователь или чат превысили ограничение частоты; True - отказано"""
+    for scope, limiter, key in (('user', user_limiter, user_id), ('chat', chat_limiter, chat_id)):
+        seconds = limiter.wait_seconds(key)
+        if seconds:
+            metrics.THROTTLED.inc(scope=scope)
+            metrics.JOBS.inc(effect=effect, outcome='throttled')
+            logger.warning(f"Запрос {effect} пользователя {user_id} в чате {chat_id} ограничен ({scope}), ждать {seconds:.1f} сек")
+            record.fail('throttled', scope)
+            await query.answer(f"Слишком много запросов. Попробуйте через {math.ceil(seconds)} сек.", show_alert=True)
+            return True
+    return False
+
+def shared_result(message, tier):
+    """(вид, file_id, уровень качества) отправленного результата для таких же запросов или None"""
+    if not isinstance(message, Message):
+        return None
+    if message.voice is not None:
+        return ('voice', message.voice.file_id, tier)
+    if message.audio is not None:
+        # Предпросмотр, заменённый полной версией, становится аудиофайлом
+        return ('audio', message.audio.file_id, tier)
+    return None
+
+async def send_coalesced_result(query, context, session, effect, pending, record):
+    """Ждёт результат такой же выполняющейся задачи и отправляет его file_id"""
+    await query.answer()
+    metrics.COALESCED.inc(effect=effect)
+    record.outcome = 'coalesced'
+    try:
+        await query.message.edit_text("Обработка: такой же запрос уже выполняется, ждём его результат.")
+    except Exception as e:
+        logger.debug(f"Не удалось обновить сообщение с кнопками: {str(e)}")
+    shared = await asyncio.shield(pending)
+    if shared is None:
+        record.fail('error', 'такая же задача не выполнена')
+        await query.message.edit_text("Произошла ошибка при обработке голосового сообщения. Пожалуйста, попробуйте еще раз.")
+        return
+    kind, file_id, tier = shared
+    send = context.bot.send_voice if kind == 'voice' else context.bot.send_audio
     try:
-        # Получаем файл голосового сообщения
+        with metrics.stage_timer('send_coalesced', effect):
+            await send(session.chat_id, file_id, caption=effect_caption(effect, session, tier),
+                       reply_to_message_id=session.message_id)
+    except Exception as e:
+        logger.warning(f"Не удалось отправить результат такой же задачи: {str(e)}")
+        record.fail('error', str(e))
+        await query.message.edit_text("Ошибка при отправке обработанного сообщения. Пожалуйста, попробуйте еще раз.")
+        return
+    metrics.JOBS.inc(effect=effect, outcome='coalesced')
+    await finish_effect_request(query)
+
+async def deliver_effect(query, context, session, effect, cache_key, cached, tier, record):
+    """Отправляет результат из кэша, ставит задачу в общую очередь или рендерит эффект.
+    
+    cached - результат cached_result или None. Возвращает отправленное сообщение с отрендеренным результатом или None.
+    """
+    user_id = session.user_id
+    chat_id = query.message.chat_id
+    keyboard_id = query.message.message_id
+    
+    await query.answer()
+    record.set(tier=tier)
+    
+    if cached is not None:
+        cached_key, cached_file_id, kind = cached
+        send = context.bot.send_voice if kind == 'voice' else context.bot.send_audio
         try:
-            logger.debug(f"Попытка получить файл с file_id: {voice_info['file_id']}")
-            logger.debug(f"Тип file_id: {type(voice_info['file_id'])}")
-            voice = await context.bot.get_file(voice_info['file_id'])
-            logger.debug(f"Получен файл голосового сообщения: {voice}")
-            logger.debug(f"Информация о файле: {voice.to_dict()}")
-            logger.debug(f"Размер файла: {voice.file_size} байт")
+            with metrics.stage_timer('send_cached', effect):
+                await send(
+                    session.chat_id,
+                    cached_file_id,
+                    caption=f"Эффект: {EFFECTS[effect]}",
+                    reply_to_message_id=session.message_id
+                )
+            metrics.JOBS.inc(effect=effect, outcome='cached')
+            record.outcome = 'cached'
+            await finish_effect_request(query)
+            return None
         except Exception as e:
-            logger.error(f"Ошибка при получении файла голосового сообщения: {str(e)}")
-            logger.exception("Полный стек ошибки при получении файла:")
-            logger.debug(f"Текущее состояние voice_messages: {voice_messages}")
-            await query.message.edit_text("Ошибка при получении голосового сообщения. Пожалуйста, попробуйте еще раз.")
-            del voice_messages[user_id]
-            return
-        
-        # Скачиваем файл
-        with tempfile.NamedTemporaryFile(suffix='.ogg') as temp_file:
-            try:
-                logger.debug(f"Начало скачивания файла в: {temp_file.name}")
-                logger.debug(f"Права доступа к временной директории: {os.stat(os.path.dirname(temp_file.name)).st_mode}")
-                await voice.download_to_drive(temp_file.name)
-                logger.debug(f"Файл скачан в: {temp_file.name}")
-                
-                # Проверяем размер файла
-                file_size = os.path.getsize(temp_file.name)
-                logger.debug(f"Размер файла: {file_size} байт")
-                if file_size == 0:
-                    logger.error("Скачанный файл пуст")
-                    raise Exception("Скачанный файл пуст")
-                
-                # Проверяем права доступа к файлу
-                file_permissions = os.stat(temp_file.name).st_mode
-                logger.debug(f"Права доступа к файлу: {file_permissions}")
-                logger.debug(f"Владелец файла: {os.stat(temp_file.name).st_uid}")
-                logger.debug(f"Группа файла: {os.stat(temp_file.name).st_gid}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка при скачивании файла: {str(e)}")
-                logger.exception("Полный стек ошибки при скачивании:")
-                logger.debug(f"Текущее состояние временного файла: {os.path.exists(temp_file.name)}")
-                await query.message.edit_text("Ошибка при скачивании голосового сообщения. Пожалуйста, попробуйте еще раз.")
-                return
-            
-            # Конвертируем в WAV с помощью ffmpeg
-            wav_file = tempfile.NamedTemporaryFile(suffix='.wav')
-            try:
-                logger.debug("Начало конвертации в WAV с помощью ffmpeg")
-                logger.debug(f"Исходный файл: {temp_file.name}")
-                logger.debug(f"Целевой файл: {wav_file.name}")
-                
-                result = subprocess.run([
-                    'ffmpeg', '-y', '-i', temp_file.name,
-                    '-acodec', 'pcm_s16le',
-                    '-ar', '44100',
-                    '-ac', '1',
-                    wav_file.name
-                ], capture_output=True, text=True)
-                
-                logger.debug(f"Вывод ffmpeg (stdout): {result.stdout}")
-                if result.returncode != 0:
-                    logger.error(f"Ошибка ffmpeg при конвертации в WAV: {result.stderr}")
-                    raise Exception(f"Ошибка ffmpeg: {result.stderr}")
-                
-                # Проверяем размер WAV файла
-                wav_size = os.path.getsize(wav_file.name)
-                logger.debug(f"Размер WAV файла: {wav_size} байт")
-                
-                logger.info("Конвертация в WAV успешно завершена")
-            except Exception as e:
-                logger.error(f"Ошибка при конвертации в WAV: {str(e)}")
-                logger.exception("Полный стек ошибки при конвертации:")
-                await query.message.edit_text("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.")
-                return
-            
-            # Загружаем WAV файл
-            try:
-                logger.debug(f"Начало чтения WAV файла: {wav_file.name}")
-                wav_data, sample_rate = sf.read(wav_file.name)
-                logger.debug(f"WAV файл загружен, частота дискретизации: {sample_rate}")
-                logger.debug(f"Размер аудио данных: {wav_data.shape}")
-                logger.debug(f"Тип данных: {wav_data.dtype}")
-                logger.debug(f"Диапазон значений: min={wav_data.min()}, max={wav_data.max()}")
-            except Exception as e:
-                logger.error(f"Ошибка при чтении WAV файла: {str(e)}")
-                logger.exception("Полный стек ошибки при чтении WAV:")
-                await query.message.edit_text("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.")
-                return
-            
-            # Применяем эффект
-            logger.debug(f"Применение эффекта {effect}")
-            try:
-                if effect == 'robot':
-                    logger.debug("Начало применения эффекта робота")
-                    processed_audio, new_sample_rate = apply_robot_effect(wav_data, sample_rate)
-                elif effect == 'musical':
-                    logger.debug("Начало применения музыкального эффекта голоса")
-                    processed_audio, new_sample_rate = apply_musical_voice_effect(wav_data, sample_rate)
-                elif effect == 'autotune':
-                    logger.debug("Начало применения эффекта автотюна")
-                    processed_audio, new_sample_rate = apply_autotune_effect(wav_data, sample_rate)
-                elif effect == 'rough':
-                    logger.debug("Начало применения эффекта грубого голоса")
-                    processed_audio, new_sample_rate = apply_rough_voice_effect(wav_data, sample_rate)
-                else:
-                    logger.warning(f"Неизвестный эффект {effect} выбран пользователем {user_id}")
-                    await query.message.edit_text("Неизвестный эффект.")
-                    return
-                
-                logger.debug(f"Эффект применен, размер обработанных данных: {processed_audio.shape}")
-                logger.debug(f"Новая частота дискретизации: {new_sample_rate}")
-                logger.debug(f"Диапазон значений после обработки: min={processed_audio.min()}, max={processed_audio.max()}")
-                
-                logger.info(f"Эффект {effect} применен, новая частота дискретизации: {new_sample_rate}")
-            except Exception as e:
-                logger.error(f"Ошибка при применении эффекта {effect}: {str(e)}")
-                logger.exception("Полный стек ошибки при применении эффекта:")
-                await query.message.edit_text("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.")
-                return
-            
-            # Сохраняем обработанный аудио
-            with tempfile.NamedTemporaryFile(suffix='.ogg') as output_file:
-                try:
-                    # Сначала сохраняем как WAV
-                    logger.debug(f"Сохранение обработанного аудио в: {output_file.name}")
-                    sf.write(output_file.name, processed_audio, new_sample_rate)
-                    logger.debug("Обработанный аудио сохранен как WAV")
-                    
-                    # Проверяем размер файла
-                    output_size = os.path.getsize(output_file.name)
-                    logger.debug(f"Размер обработанного WAV файла: {output_size} байт")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при сохранении WAV: {str(e)}")
-                    logger.exception("Полный стек ошибки при сохранении WAV:")
-                    await query.message.edit_text("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.")
-                    return
-                
-                # Конвертируем в OGG с помощью ffmpeg
-                ogg_file = tempfile.NamedTemporaryFile(suffix='.ogg')
-                try:
-                    logger.debug("Начало конвертации в OGG с помощью ffmpeg")
-                    logger.debug(f"Исходный файл: {output_file.name}")
-                    logger.debug(f"Целевой файл: {ogg_file.name}")
-                    
-                    result = subprocess.run([
-                        'ffmpeg', '-y', '-i', output_file.name,
-                        '-acodec', 'libopus',
-                        '-ar', '48000',
-                        '-ac', '1',
-                        ogg_file.name
-                    ], capture_output=True, text=True)
-                    
-                    logger.debug(f"Вывод ffmpeg (stdout): {result.stdout}")
-                    if result.returncode != 0:
-                        logger.error(f"Ошибка ffmpeg при конвертации в OGG: {result.stderr}")
-                        raise Exception(f"Ошибка ffmpeg: {result.stderr}")
-                    
-                    # Проверяем размер OGG файла
-                    ogg_size = os.path.getsize(ogg_file.name)
-                    logger.debug(f"Размер OGG файла: {ogg_size} байт")
-                    
-                    logger.info("Конвертация в OGG успешно завершена")
-                except Exception as e:
-                    logger.error(f"Ошибка при конвертации в OGG: {str(e)}")
-                    logger.exception("Полный стек ошибки при конвертации в OGG:")
-                    await query.message.edit_text("Ошибка при обработке аудио. Пожалуйста, попробуйте еще раз.")
-                    return
-                
-                # Отправляем обработанное сообщение
-                try:
-                    logger.debug(f"Отправка обработанного сообщения в чат {voice_info['chat_id']}")
-                    logger.debug(f"ID сообщения для ответа: {voice_info['message_id']}")
-                    
-                    await context.bot.send_voice(
-                        chat_id=voice_info['chat_id'],
-                        voice=open(ogg_file.name, 'rb'),
-                        caption=f"Эффект: {EFFECTS[effect]}",
-                        reply_to_message_id=voice_info['message_id']
-                    )
-                    logger.info(f"Обработанное голосовое сообщение отправлено в чат {voice_info['chat_id']}")
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке обработанного сообщения: {str(e)}")
-                    logger.exception("Полный стек ошибки при отправке:")
-                    await query.message.edit_text("Ошибка при отправке обработанного сообщения. Пожалуйста, попробуйте еще раз.")
-                    return
-                
-                # Удаляем сообщение с кнопками
-                try:
-                    logger.debug("Удаление сообщения с кнопками")
-                    await query.message.delete()
-                    logger.info("Сообщение с кнопками удалено")
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить сообщение с кнопками: {str(e)}")
-                    logger.exception("Полный стек ошибки при удалении сообщения:")
-                
-                # Удаляем информацию о голосовом сообщении
-                del voice_messages[user_id]
-                logger.info(f"Информация о голосовом сообщении удалена для пользователя {user_id}")
-                logger.debug(f"Текущее состояние voice_messages: {voice_messages}")
+            logger.warning(f"Не удалось отправить результат из кэша, выполняем рендеринг: {str(e)}")
+            result_cache.discard(cached_key)
+    
+    # В распределённом режиме задачу выполнит один из рабочих процессов
+    if config.RUN_MODE == 'front':
+        await enqueue_effect_request(query, session, effect, cache_key)
+        record.outcome = 'enqueued'
+        return None
     
+    # Длинные сообщения отправляются прогрессивно, ход обработки виден в сообщении с кнопками
+    progress = None
+    if wants_preview(effect, session, tier):
+        progress = ProgressMessage(query.message.edit_text, config.PROGRESS_INTERVAL)
+    
+    async def notify_queued(position):
+        text = f"Ваш запрос в очереди, позиция {position}. Пожалуйста, подождите."
+        if progress is not None:
+            await progress.set_stage(text)
+        else:
+            await query.message.edit_text(text)
+    
+    try:
+        try:
+            sent_message = await process_voice(context.bot, session, effect, cache_key, notify_queued, tier, progress)
+        finally:
+            if progress is not None:
+                progress.close()
+        await finish_effect_request(query)
+        return sent_message
+    except ProcessingError as e:
+        record.fail('error', str(e.__cause__ or e))
+        await query.message.edit_text(str(e))
+        if e.drop_session:
+            session_store.pop(chat_id, keyboard_id)
     except Exception as e:
+        metrics.JOBS.inc(effect=effect, outcome='error')
         logger.error(f"Ошибка при обработке голосового сообщения для пользователя {user_id}: {str(e)}")
         logger.exception("Полный стек ошибки:")
+        record.fail('error', str(e))
         await query.message.edit_text("Произошла ошибка при обработке голосового сообщения. Пожалуйста, попробуйте еще раз.")
         # В случае ошибки также удаляем информацию о сообщении
-        if user_id in voice_messages:
-            del voice_messages[user_id]
-            logger.info(f"Информация о голосовом сообщении удалена после ошибки для пользователя {user_id}")
-            logger.debug(f"Текущее состояние voice_messages: {voice_messages}")
+        if session_store.pop(chat_id, keyboard_id) is not None:
+            logger.info(f"Информация о голосовом сообщении удалена после ошибки для сообщения {keyboard_id}")
+    return None
 
-def apply_robot_effect(audio_data, sample_rate):
-    """Применяет максимально радикальный эффект робота к аудио."""
-    try:
-        # Конвертируем в формат pydub
-        audio = AudioSegment(
-            audio_data.tobytes(),
-            frame_rate=sample_rate,
-            sample_width=2,
-            channels=1
-        )
-        
-        # Изменяем высоту тона для механического звука
-        audio = audio._spawn(audio.raw_data, overrides={
-            "frame_rate": int(audio.frame_rate * 1.5)
-        })
-        
-        # Добавляем квадратную волну
-        square_wave = Square(2000).to_audio_segment(duration=len(audio))
-        square_wave = square_wave - 10
-        audio = audio.overlay(square_wave)
-        
-        # Добавляем шум
-        noise = WhiteNoise().to_audio_segment(duration=len(audio))
-        noise = noise - 15
-        audio = audio.overlay(noise)
-        
-        # Компрессия
-        audio = audio.compress_dynamic_range(threshold=-30.0, ratio=20.0)
-        
-        # Нормализация
-        audio = audio.normalize()
+async def enqueue_effect_request(query, session, effect, cache_key):
+    """Ставит задачу в общую очередь (режим front)"""
+    job_id = await job_queue.run(job_queue.enqueue, {
+        'session': session.to_dict(),
+        'effect': effect,
+        'cache_key': cache_key,
+        'keyboard_id': query.message.message_id,
+    })
+    metrics.JOBS.inc(effect=effect, outcome='enqueued')
+    logger.info(f"Задача {job_id} ({effect}) поставлена в очередь, ожидают: {await job_queue.run(job_queue.depth)}")
+    # Кнопки убираем сразу: сообщение удалит рабочий процесс после отправки результата
+    session_store.pop(query.message.chat_id, query.message.message_id)
+    await query.message.edit_text("Запрос принят. Обработка может занять некоторое время.")
+
+async def keep_lease(job):
+    """Продлевает аренду задачи, пока она обрабатывается"""
+    while True:
+        await asyncio.sleep(config.JOB_VISIBILITY_TIMEOUT / 3)
+        if not await job_queue.run(job_queue.extend, job):
+            logger.warning(f"Аренда задачи {job.id} потеряна, её может выполнить другой процесс")
+            return
+
+async def handle_job(bot, job):
+    """Выполняет задачу из общей очереди (режим worker)"""
+    session = VoiceSession.from_dict(job.payload['session'])
+    effect = job.payload['effect']
+    keyboard_id = job.payload['keyboard_id']
+    logger.debug(f"Обработка задачи {job}: {effect}, {session}")
+    
+    async def edit_keyboard_message(text):
+        await bot.edit_message_text(text, chat_id=session.chat_id, message_id=keyboard_id)
+    
+    async def notify_queued(position):
+        text = f"Ваш запрос в очереди, позиция {position}. Пожалуйста, подождите."
+        if progress is not None:
+            await progress.set_stage(text)
+        else:
+            await edit_keyboard_message(text)
+    
+    with logs.job_record(effect=effect, job=job.id, attempt=job.attempts, duration=session.duration) as record:
+        # Задача уже принята в общую очередь: под нагрузкой она упрощается, но не отклоняется
+        effect_ids = list(EFFECT_FUNCTIONS) if effect == ALL_EFFECTS else [effect]
+        tier = admission.choose(effect_ids, session.duration, can_reject=False)
+        record.set(tier=tier)
+        progress = None
+        if wants_preview(effect, session, tier):
+            progress = ProgressMessage(edit_keyboard_message, config.PROGRESS_INTERVAL)
         
-        # Конвертируем обратно в numpy array
-        processed_audio = np.array(audio.get_array_of_samples())
-        return processed_audio, sample_rate
+        lease_task = asyncio.create_task(keep_lease(job))
+        try:
+            await process_voice(bot, session, effect, job.payload['cache_key'], notify_queued, tier, progress)
+        except Exception as e:
+            if job.attempts < config.JOB_MAX_ATTEMPTS:
+                logger.warning(f"Попытка {job.attempts} задачи {job.id} не удалась, задача возвращена в очередь: {str(e)}")
+                await job_queue.run(job_queue.retry, job, str(e))
+                record.fail('retry', str(e))
+                return
+            logger.error(f"Задача {job.id} не выполнена после {job.attempts} попыток: {str(e)}")
+            await job_queue.run(job_queue.fail, job, str(e))
+            record.fail('error', str(e))
+            metrics.JOBS.inc(effect=effect, outcome='error')
+            message = str(e) if isinstance(e, ProcessingError) else "Произошла ошибка при обработке голосового сообщения. Пожалуйста, попробуйте еще раз."
+            await notify_job_failed(bot, session.chat_id, keyboard_id, message)
+            return
+        finally:
+            lease_task.cancel()
+            if progress is not None:
+                progress.close()
+            admission.release(len(effect_ids))
         
-    except Exception as e:
-        logger.error(f"Ошибка в apply_robot_effect: {str(e)}")
-        raise
+        await job_queue.run(job_queue.complete, job)
+        try:
+            await bot.delete_message(chat_id=session.chat_id, message_id=keyboard_id)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить сообщение задачи {job.id}: {str(e)}")
 
-def apply_musical_voice_effect(audio_data, sample_rate):
-    """Применяет максимально радикальный музыкальный эффект к аудио."""
+async def notify_job_failed(bot, chat_id, message_id, text):
     try:
-        # Конвертируем в формат pydub
-        audio = AudioSegment(
-            audio_data.tobytes(),
-            frame_rate=sample_rate,
-            sample_width=2,
-            channels=1
-        )
-        
-        # Добавляем гармоники
-        for freq in [440, 880, 1320, 1760, 2200]:
-            sine_wave = Sine(freq).to_audio_segment(duration=len(audio))
-            sine_wave = sine_wave - 10
-            audio = audio.overlay(sine_wave)
-        
-        # Добавляем вибрато
-        vibrato = Sine(8).to_audio_segment(duration=len(audio))
-        vibrato = vibrato - 15
-        audio = audio.overlay(vibrato)
-        
-        # Компрессия
-        audio = audio.compress_dynamic_range(threshold=-20.0, ratio=12.0)
-        
-        # Нормализация
-        audio = audio.normalize()
-        
-        # Конвертируем обратно в numpy array
-        processed_audio = np.array(audio.get_array_of_samples())
-        return processed_audio, sample_rate
-        
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
     except Exception as e:
-        logger.error(f"Ошибка в apply_musical_voice_effect: {str(e)}")
-        raise
+        logger.warning(f"Не удалось сообщить об ошибке в чат {chat_id}: {str(e)}")
 
-def apply_autotune_effect(audio_data, sample_rate):
-    """Применяет максимально радикальный эффект автотюна к аудио."""
-    try:
-        # Определяем основную частоту
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            audio_data,
-            fmin=librosa.note_to_hz('C2'),
-            fmax=librosa.note_to_hz('C7'),
-            frame_length=2048,
-            hop_length=512
-        )
-        
-        # Определяем базовую ноту
-        base_note = librosa.hz_to_note(np.nanmean(f0[voiced_flag]))
-        key = base_note[0]
-        
-        # Применяем коррекцию высоты тона
-        y_shifted = librosa.effects.pitch_shift(
-            audio_data,
-            sr=sample_rate,
-            n_steps=12,
-            bins_per_octave=24
-        )
-        
-        # Конвертируем в формат pydub
-        audio = AudioSegment(
-            y_shifted.tobytes(),
-            frame_rate=sample_rate,
-            sample_width=2,
-            channels=1
+async def reap_abandoned_jobs(bot):
+    """Сообщает об ошибке по задачам, брошенным упавшими процессами после всех попыток"""
+    for job in await job_queue.run(job_queue.reap):
+        logger.error(f"Задача {job.id} брошена после {job.attempts} попыток")
+        metrics.JOBS.inc(effect=job.payload['effect'], outcome='error')
+        await notify_job_failed(bot, job.payload['session']['chat_id'], job.payload['keyboard_id'],
+                                "Не удалось обработать голосовое сообщение. Пожалуйста, попробуйте еще раз.")
+    removed = await job_queue.run(job_queue.purge, JOB_RETENTION)
+    if removed:
+        logger.debug(f"Удалено старых задач из очереди: {removed}")
+
+async def run_worker():
+    """Основной цикл рабочего процесса: берёт задачи из общей очереди и выполняет их"""
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    # Задач в работе не больше, чем процессов рендеринга
+    slots = asyncio.Semaphore(config.RENDER_WORKERS)
+    tasks = set()
+    metrics_server = None
+    
+    def job_done(task):
+        tasks.discard(task)
+        slots.release()
+    
+    request, _ = build_requests()
+    bot_kwargs = {'request': request}
+    base_url, base_file_url = bot_api_urls()
+    if base_url:
+        bot_kwargs.update(base_url=base_url, base_file_url=base_file_url)
+    async with Bot(TOKEN, **bot_kwargs) as bot:
+        metrics.QUEUE_DEPTH.set_function(lambda: render_pool.queue_depth)
+        metrics.IN_FLIGHT.set_function(lambda: render_pool.in_flight)
+        metrics.ADMISSION_BACKLOG.set_function(admission.backlog_seconds)
+        if config.METRICS_PORT:
+            metrics_server = await metrics.start_http_server(config.METRICS_HOST, config.METRICS_PORT)
+        # Задачи из общей очереди берутся только после прогрева процессов рендеринга
+        await wait_workers_warm()
+        record_startup('ready')
+        logger.info(f"Рабочий процесс {worker_name} запущен")
+        last_reap = 0.0
+        try:
+            while True:
+                if time.monotonic() - last_reap > config.JOB_VISIBILITY_TIMEOUT:
+                    await reap_abandoned_jobs(bot)
+                    last_reap = time.monotonic()
+                await slots.acquire()
+                job = await job_queue.run(job_queue.lease, worker_name)
+                if job is None:
+                    slots.release()
+                    await asyncio.sleep(config.JOB_POLL_INTERVAL)
+                    continue
+                task = asyncio.create_task(handle_job(bot, job))
+                tasks.add(task)
+                task.add_done_callback(job_done)
+        finally:
+            # Незавершённые задачи вернутся в очередь по истечении аренды
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if metrics_server is not None:
+                metrics_server.close()
+                await metrics_server.wait_closed()
+            await render_pool.shutdown()
+            job_queue.close()
+            result_cache.close()
+
+async def run_webhook(application: Application):
+    """Запускает приложение с приёмом обновлений через вебхук"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    
+    server = WebhookServer(application, config.WEBHOOK_PATH, config.WEBHOOK_SECRET)
+    async with application:
+        await start_background_tasks(application)
+        await application.start()
+        await server.start(config.WEBHOOK_LISTEN, config.WEBHOOK_PORT)
+        if config.WEBHOOK_URL:
+            await application.bot.set_webhook(
+                config.WEBHOOK_URL,
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Вебхук зарегистрирован: {config.WEBHOOK_URL}")
+        try:
+            await stop.wait()
+        finally:
+            logger.info(f"Остановка вебхука, принято обновлений: {server.received}, отклонено: {server.rejected}")
+            await server.close()
+            await application.stop()
+            await shutdown_render_pool(application)
+
+def remember_voice(user_id, voice):
+    """Запоминает голосовое пользователя для инлайн-режима и ставит его варианты в очередь рендеринга"""
+    voice_ref = VoiceRef(voice.file_id, voice.file_unique_id, voice.duration)
+    inline_cache.remember_voice(user_id, voice_ref)
+    if prerender_queue is None or voice.duration > config.INLINE_MAX_SECONDS:
+        return
+    for effect_id in EFFECT_FUNCTIONS:
+        if inline_cache.has_variant(voice.file_unique_id, effect_id):
+            continue
+        try:
+            prerender_queue.put_nowait((user_id, voice_ref, effect_id))
+        except asyncio.QueueFull:
+            logger.debug("Очередь предварительного рендеринга заполнена, вариант пропущен")
+            return
+
+async def prerender_variants(bot):
+    """Фоновый рендеринг вариантов для инлайн-режима с низким приоритетом"""
+    while True:
+        user_id, voice_ref, effect_id = await prerender_queue.get()
+        # Запросы пользователей важнее: ждём, пока в пуле не освободится процесс
+        while render_pool.queue_depth or render_pool.in_flight >= render_pool.size:
+            await asyncio.sleep(PRERENDER_IDLE_WAIT)
+        if inline_cache.has_variant(voice_ref.file_unique_id, effect_id):
+            continue
+        session = VoiceSession(
+            user_id=user_id,
+            chat_id=config.INLINE_STORAGE_CHAT_ID,
+            message_id=None,
+            reply_message_id=None,
+            file_id=voice_ref.file_id,
+            file_unique_id=voice_ref.file_unique_id,
+            duration=voice_ref.duration
         )
-        
-        # Добавляем вибрато
-        vibrato = Sine(10).to_audio_segment(duration=len(audio))
-        vibrato = vibrato - 15
-        audio = audio.overlay(vibrato)
-        
-        # Компрессия
-        audio = audio.compress_dynamic_range(threshold=-25.0, ratio=15.0)
-        
-        # Нормализация
-        audio = audio.normalize()
-        
-        # Конвертируем обратно в numpy array
-        processed_audio = np.array(audio.get_array_of_samples())
-        return processed_audio, sample_rate
-        
-    except Exception as e:
-        logger.error(f"Ошибка в apply_autotune_effect: {str(e)}")
-        raise
+        cache_key = make_key(voice_ref.file_unique_id, effect_id, effect_params(effect_id))
+        try:
+            with metrics.stage_timer('prerender', effect_id):
+                await process_voice(bot, session, effect_id, cache_key, None)
+            logger.debug(f"Вариант {effect_id} для {voice_ref.file_unique_id} готов, в кэше: {inline_cache.stats()}")
+        except ProcessingError as e:
+            logger.warning(f"Не удалось заранее отрендерить {effect_id} для пользователя {user_id}: {str(e)}")
+        except Exception as e:
+            # Непредвиденная ошибка одного варианта не должна останавливать фоновый рендеринг
+            logger.error(f"Ошибка при заранее выполняемом рендеринге {effect_id}: {str(e)}")
+            logger.exception("Полный стек ошибки при заранее выполняемом рендеринге:")
 
-def apply_rough_voice_effect(audio_data, sample_rate):
-    """Применяет максимально радикальный эффект грубого голоса к аудио."""
-    try:
-        # Конвертируем в формат pydub
-        audio = AudioSegment(
-            audio_data.tobytes(),
-            frame_rate=sample_rate,
-            sample_width=2,
-            channels=1
+async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик голосовых сообщений в личном чате: запоминает их для инлайн-режима"""
+    logger.info(f"Получено голосовое сообщение от пользователя {update.effective_user.id} в личном чате")
+    remember_voice(update.effective_user.id, update.message.voice)
+    await update.message.reply_text(
+        f"Голосовое сохранено. Наберите @{context.bot.username} и название эффекта в любом чате, "
+        "чтобы отправить его обработанную версию."
+    )
+
+def match_effects(text):
+    """Эффекты, подходящие под текст инлайн-запроса (пустой запрос - все)."""
+    text = text.strip().lower()
+    if not text:
+        return list(EFFECTS)
+    return [effect_id for effect_id, effect_name in EFFECTS.items()
+            if text in effect_id or text in effect_name.lower()]
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отвечает на инлайн-запрос готовыми вариантами без рендеринга"""
+    query = update.inline_query
+    user_id = query.from_user.id
+    variants = inline_cache.lookup(user_id, match_effects(query.query), INLINE_RESULTS_LIMIT)
+    logger.debug(f"Инлайн-запрос '{query.query}' от {user_id}: вариантов {len(variants)}")
+    results = [
+        InlineQueryResultCachedVoice(
+            id=f"{voice_ref.file_unique_id}:{effect_id}"[:64],
+            voice_file_id=file_id,
+            title=f"{EFFECTS[effect_id]} ({voice_ref.duration} сек)"
         )
-        
-        # Добавляем искажение
-        audio = audio + 20
-        
-        # Добавляем квадратную волну
-        square_wave = Square(1500).to_audio_segment(duration=len(audio))
-        square_wave = square_wave - 5
-        audio = audio.overlay(square_wave)
-        
-        # Добавляем шум
-        noise = WhiteNoise().to_audio_segment(duration=len(audio))
-        noise = noise - 10
-        audio = audio.overlay(noise)
-        
-        # Компрессия
-        audio = audio.compress_dynamic_range(threshold=-25.0, ratio=15.0)
-        
-        # Нормализация
-        audio = audio.normalize()
-        
-        # Конвертируем обратно в numpy array
-        processed_audio = np.array(audio.get_array_of_samples())
-        return processed_audio, sample_rate
-        
-    except Exception as e:
-        logger.error(f"Ошибка в apply_rough_voice_effect: {str(e)}")
-        raise
+        for voice_ref, effect_id, file_id in variants
+    ]
+    button = None
+    if not results:
+        button = InlineQueryResultsButton(text="Пришлите голосовое сообщение боту", start_parameter='inline')
+    with metrics.stage_timer('inline_query'):
+        await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, button=button)
 
-def change_pitch(audio_data, sample_rate, n_steps):
-    """Изменяет высоту тона аудио с использованием librosa"""
-    try:
-        # Конвертируем в формат, который понимает librosa
-        y = audio_data.astype(np.float32)
-        
-        # Изменяем высоту тона
-        y_shifted = librosa.effects.pitch_shift(
-            y,
-            sr=sample_rate,
-            n_steps=n_steps,
-            bins_per_octave=12
+async def start_background_tasks(application: Application):
+    """Запускает фоновые задачи после старта приложения"""
+    global prerender_queue
+    session_store.start_sweeper(SESSION_SWEEP_INTERVAL)
+    
+    # Бот уже принимает обновления, рабочие процессы прогреваются в фоне
+    if config.RUN_MODE == 'single':
+        application.bot_data['warm_up_task'] = asyncio.create_task(wait_workers_warm())
+    
+    # Предварительный рендеринг для инлайн-режима нужен только там, где есть пул рендеринга
+    if config.INLINE_STORAGE_CHAT_ID and config.RUN_MODE == 'single':
+        prerender_queue = asyncio.Queue(maxsize=config.INLINE_PRERENDER_QUEUE)
+        application.bot_data['prerender_task'] = asyncio.create_task(prerender_variants(application.bot))
+    
+    # Локальный HTTP-эндпоинт с метриками в формате Prometheus
+    if job_queue is not None:
+        metrics.QUEUE_DEPTH.set_function(job_queue.depth)
+    else:
+        metrics.QUEUE_DEPTH.set_function(lambda: render_pool.queue_depth)
+        metrics.IN_FLIGHT.set_function(lambda: render_pool.in_flight)
+        metrics.ADMISSION_BACKLOG.set_function(admission.backlog_seconds)
+    if config.METRICS_PORT:
+        application.bot_data['metrics_server'] = await metrics.start_http_server(
+            config.METRICS_HOST, config.METRICS_PORT
         )
-        
-        return y_shifted, sample_rate
-    except Exception as e:
-        logger.error(f"Ошибка при изменении высоты тона: {str(e)}")
-        return audio_data, sample_rate
+    record_startup('ready')
 
-async def apply_effect(audio_data, sample_rate, effect_type):
-    """Применяет выбранный эффект к аудио."""
-    try:
-        logger.debug(f"Применение эффекта {effect_type}")
-        
-        # Создаем временный файл для аудио
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
-            temp_wav_path = temp_wav.name
-            sf.write(temp_wav_path, audio_data, sample_rate)
-            logger.debug(f"Временный WAV файл создан: {temp_wav_path}")
-        
-        # Применяем эффект эхо с помощью ffmpeg
-        output_path = temp_wav_path.replace('.wav', '_echo.wav')
-        try:
-            # Эффект эхо: delay=0.5s, decay=0.5
-            stream = ffmpeg.input(temp_wav_path)
-            stream = ffmpeg.filter(stream, 'aecho', 0.8, 0.9, 1000, 0.3)
-            stream = ffmpeg.output(stream, output_path)
-            ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
-            logger.debug(f"Эффект эхо применен, сохранен в: {output_path}")
-        except ffmpeg.Error as e:
-            logger.error(f"Ошибка ffmpeg: {e.stderr.decode()}")
-            raise
-        
-        # Читаем обработанный файл
-        processed_audio, new_sample_rate = sf.read(output_path)
-        logger.debug(f"Обработанный файл прочитан, частота дискретизации: {new_sample_rate}")
-        
-        # Очищаем временные файлы
-        os.unlink(temp_wav_path)
-        os.unlink(output_path)
-        logger.debug("Временные файлы удалены")
-        
-        return processed_audio, new_sample_rate
-        
-    except Exception as e:
-        logger.error(f"Ошибка при применении эффекта: {str(e)}")
-        logger.error("Полный стек ошибки при применении эффекта:")
-        logger.error(traceback.format_exc())
-        raise
+async def shutdown_render_pool(application: Application):
+    """Останавливает пул рендеринга при завершении приложения"""
+    for name in ('prerender_task', 'warm_up_task'):
+        task = application.bot_data.pop(name, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await render_pool.shutdown()
+    await session_store.close()
+    result_cache.close()
+    if job_queue is not None:
+        job_queue.close()
 
 def main():
     """Основная функция"""
     logger.info("Запуск бота")
+    record_startup('imports')
     try:
+        # Фронтенд только ставит задачи в очередь и не рендерит сам
+        if config.RUN_MODE != 'front':
+            # Таблицы генераторов строятся один раз и наследуются рабочими процессами
+            preload_waveforms()
+            
+            # Запускаем рабочие процессы до старта event loop
+            render_pool.start()
+            record_startup('pool')
+        
+        if config.RUN_MODE == 'worker':
+            try:
+                asyncio.run(run_worker())
+            except KeyboardInterrupt:
+                logger.info("Рабочий процесс остановлен")
+            return
+        
         # Создаем приложение
-        application = Application.builder().token(TOKEN).build()
+        request, get_updates_request = build_requests()
+        builder = (
+            Application.builder()
+            .token(TOKEN)
+            .request(request)
+            .get_updates_request(get_updates_request)
+            .concurrent_updates(config.CONCURRENT_UPDATES)
+            .post_init(start_background_tasks)
+            .post_shutdown(shutdown_render_pool)
+        )
+        base_url, base_file_url = bot_api_urls()
+        if base_url:
+            builder = builder.base_url(base_url).base_file_url(base_file_url)
+        application = builder.build()
         
         # Добавляем обработчики
         application.add_handler(CommandHandler("start", start))
         application.add_handler(MessageHandler(filters.REPLY & filters.TEXT, handle_reply))
-        application.add_handler(CallbackQueryHandler(apply_effect))
+        application.add_handler(MessageHandler(filters.VOICE & filters.ChatType.PRIVATE, handle_voice))
+        application.add_handler(InlineQueryHandler(inline_query))
+        # block=False: рендеринг не задерживает обработку следующих обновлений
+        application.add_handler(CallbackQueryHandler(apply_effect, block=False))
         
         # Запускаем бота
-        logger.info("Бот запущен")
-        application.run_polling()
+        logger.info(f"Бот запущен, приём обновлений: {config.UPDATE_MODE}")
+        if config.UPDATE_MODE == 'webhook':
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling()
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {str(e)}")
         logger.exception("Полный стек ошибки:")
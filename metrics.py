@@ -0,0 +1,244 @@
+"""Метрики задержек и нагрузки в текстовом формате Prometheus.
+
+Без внешних зависимостей: гистограммы, счётчики и датчики хранятся
+в памяти процесса бота и отдаются по GET /metrics небольшим HTTP-сервером
+на asyncio.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+import logs
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DURATION_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+RTF_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in pairs)
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Датчик; значение может вычисляться функцией в момент запроса метрик."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        lines = self.header()
+        if self._function is not None:
+            self._values[()] = self._function()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, ('le', '+Inf'))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'voicer_stage_seconds', 'Длительность этапов обработки голосового сообщения', ('stage', 'effect')
+))
+AUDIO_SECONDS = REGISTRY.register(Histogram(
+    'voicer_audio_duration_seconds', 'Длительность обработанного аудио', ('effect',), DURATION_BUCKETS
+))
+REAL_TIME_FACTOR = REGISTRY.register(Histogram(
+    'voicer_real_time_factor', 'Время рендеринга эффекта, делённое на длительность аудио', ('effect',), RTF_BUCKETS
+))
+JOBS = REGISTRY.register(Counter(
+    'voicer_jobs_total', 'Запросы эффектов по результату', ('effect', 'outcome')
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'voicer_render_queue_depth', 'Задачи, ожидающие свободного рабочего процесса'
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'voicer_render_in_flight', 'Задачи, выполняющиеся в рабочих процессах'
+))
+RENDER_TIERS = REGISTRY.register(Counter(
+    'voicer_render_tier_total', 'Рендеринги эффектов по уровню качества', ('effect', 'tier')
+))
+ADMISSION_BACKLOG = REGISTRY.register(Gauge(
+    'voicer_admission_backlog_seconds', 'Оценка ожидания свободного рабочего процесса для новой задачи'
+))
+THROTTLED = REGISTRY.register(Counter(
+    'voicer_throttled_total', 'Запросы, отклонённые ограничением частоты', ('scope',)
+))
+COALESCED = REGISTRY.register(Counter(
+    'voicer_coalesced_total', 'Запросы, получившие результат такой же выполнявшейся задачи', ('effect',)
+))
+API_RETRIES = REGISTRY.register(Counter(
+    'voicer_bot_api_retries_total', 'Повторы запросов к Bot API после ответов 429 и 5xx', ('endpoint', 'status')
+))
+RESULT_CACHE_HITS = REGISTRY.register(Counter(
+    'voicer_result_cache_hits_total', 'Попадания в кэш готовых результатов по уровню кэша', ('level',)
+))
+RESULT_CACHE_MISSES = REGISTRY.register(Counter(
+    'voicer_result_cache_misses_total', 'Промахи кэша готовых результатов'
+))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    'voicer_startup_seconds', 'Время от запуска процесса до окончания этапа холодного старта', ('phase',)
+))
+
+
+def observe_stage(stage, effect, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage, effect=effect)
+    # Длительность этапа попадает и в запись о текущей задаче в логе
+    logs.add_stage(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage, effect=''):
+    """Измеряет длительность блока как этап stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, effect, time.perf_counter() - started)
+
+
+def observe_render(effect, audio_seconds, render_seconds):
+    """Записывает длительность аудио и коэффициент реального времени эффекта."""
+    AUDIO_SECONDS.observe(audio_seconds, effect=effect)
+    if audio_seconds > 0:
+        REAL_TIME_FACTOR.observe(render_seconds / audio_seconds, effect=effect)
+
+
+async def _handle_connection(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Остальные заголовки запроса не нужны, дочитываем до пустой строки
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', REGISTRY.render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug(f"Ошибка соединения с сервером метрик: {str(e)}")
+    finally:
+        writer.close()
+
+
+async def start_http_server(host, port):
+    """Запускает сервер метрик на host:port."""
+    server = await asyncio.start_server(_handle_connection, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,87 @@
+"""Кэш предвычисленных осцилляторов и шума для наложения на голос.
+
+Для генератора с целой частотой f при частоте дискретизации sr блок длиной
+sr / gcd(sr, f) содержит целое число периодов, а значит любой такой блок
+укладывается в секунду без разрыва фазы. Слой эффекта (сумма нескольких
+генераторов с их усилением) строится один раз на секундном блоке (или на
+блоке шума) и при обработке просто повторяется до нужной длины.
+"""
+import math
+from functools import lru_cache
+import numpy as np
+
+# Длина блока белого шума в секундах: достаточно, чтобы повтор не был слышен
+NOISE_SECONDS = 4
+NOISE_SEED = 20240601
+
+
+@lru_cache(maxsize=None)
+def tone_block(kind, freq, sample_rate):
+    """Блок из целого числа периодов: 'sine' или 'square' с амплитудой 1.0."""
+    length = sample_rate // math.gcd(sample_rate, int(freq))
+    phase = (np.arange(length, dtype=np.float64) * freq / sample_rate) % 1.0
+    if kind == 'sine':
+        block = np.sin(2 * np.pi * phase)
+    elif kind == 'square':
+        block = np.where(phase < 0.5, 1.0, -1.0)
+    else:
+        raise ValueError(f"Неизвестный тип осциллятора: {kind}")
+    block = block.astype(np.float32)
+    block.flags.writeable = False
+    return block
+
+
+@lru_cache(maxsize=None)
+def noise_block(sample_rate):
+    """Фиксированный блок равномерного белого шума в диапазоне [-1, 1)."""
+    rng = np.random.default_rng(NOISE_SEED)
+    block = rng.uniform(-1.0, 1.0, sample_rate * NOISE_SECONDS).astype(np.float32)
+    block.flags.writeable = False
+    return block
+
+
+@lru_cache(maxsize=None)
+def layer(components, sample_rate):
+    """Смешанный слой генераторов.
+
+    components — кортеж (тип, частота, усиление в дБ); для шума частота None.
+    """
+    has_noise = any(kind == 'noise' for kind, _, _ in components)
+    length = sample_rate * (NOISE_SECONDS if has_noise else 1)
+    table = np.zeros(length, dtype=np.float32)
+    for kind, freq, gain_db in components:
+        block = noise_block(sample_rate) if kind == 'noise' else tone_block(kind, freq, sample_rate)
+        gain = np.float32(10 ** (gain_db / 20.0))
+        table += np.tile(block, length // len(block)) * gain
+    table.flags.writeable = False
+    return table
+
+
+def add_layer(samples, components, sample_rate):
+    """Прибавляет слой к сигналу (на месте) и ограничивает результат [-1, 1]."""
+    table = layer(components, sample_rate)
+    for start in range(0, len(samples), len(table)):
+        chunk = samples[start:start + len(table)]
+        chunk += table[:len(chunk)]
+    np.clip(samples, -1.0, 1.0, out=samples)
+    return samples
+
+
+class LayerOscillator:
+    """Слой генераторов для потоковой обработки: фаза сохраняется между блоками."""
+
+    def __init__(self, components, sample_rate):
+        self.table = layer(components, sample_rate)
+        self.position = 0
+
+    def process(self, block):
+        """Прибавляет следующий участок слоя к блоку (на месте) с ограничением [-1, 1]."""
+        table = self.table
+        done = 0
+        while done < len(block):
+            count = min(len(block) - done, len(table) - self.position)
+            block[done:done + count] += table[self.position:self.position + count]
+            done += count
+            self.position = (self.position + count) % len(table)
+        np.clip(block, -1.0, 1.0, out=block)
+        return block
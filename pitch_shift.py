@@ -0,0 +1,119 @@
+"""Сдвиг высоты тона на заданное число полутонов.
+
+Движки:
+- world — ресинтез вокодером WORLD (pyworld): F0 умножается на коэффициент,
+  спектральная огибающая остаётся прежней, поэтому форманты не сдвигаются
+  и голос не становится «мультяшным»;
+- wsola — во временной области: WSOLA растягивает сигнал по времени без
+  изменения тона, затем полифазная передискретизация возвращает исходную
+  длительность. Самый быстрый, форманты сдвигаются вместе с тоном;
+- librosa — librosa.effects.pitch_shift (фазовый вокодер на STFT и
+  передискретизация), эталон для сравнения качества и скорости.
+
+Скорость движков сравнивает benchmarks/bench_pitch.py.
+"""
+import math
+from fractions import Fraction
+import numpy as np
+
+ENGINES = ('world', 'wsola', 'librosa')
+
+# Окно WSOLA и допуск поиска лучшего совпадения, секунды
+WSOLA_FRAME_SECONDS = 0.04
+WSOLA_TOLERANCE_SECONDS = 0.01
+# Прореживание при грубом поиске совпадения; затем уточнение с точностью до сэмпла
+WSOLA_SEARCH_DECIMATION = 4
+# Наибольший знаменатель отношения частот при передискретизации после WSOLA
+RESAMPLE_MAX_DENOMINATOR = 64
+
+
+def semitones_to_ratio(n_steps):
+    return 2.0 ** (n_steps / 12.0)
+
+
+def _fit_length(y, length):
+    if len(y) < length:
+        y = np.pad(y, (0, length - len(y)))
+    return np.ascontiguousarray(y[:length], dtype=np.float32)
+
+
+def world_shift(samples, sample_rate, n_steps, fast=True):
+    """Сдвиг тона ресинтезом WORLD с сохранением спектральной огибающей."""
+    import autotune
+    x = np.ascontiguousarray(samples, dtype=np.float64)
+    f0, t = autotune.extract_f0(x, sample_rate, fast=fast)
+    spectral_envelope, aperiodicity = autotune.extract_envelopes(x, f0, t, sample_rate, fast=fast)
+    return autotune.resynthesize(f0 * semitones_to_ratio(n_steps), spectral_envelope, aperiodicity,
+                                 sample_rate, len(x), fast=fast)
+
+
+def _best_offset(region, template):
+    """Сдвиг template внутри region с максимальной корреляцией: грубо по прореженным сэмплам, затем точно."""
+    step = WSOLA_SEARCH_DECIMATION
+    coarse = np.correlate(region[::step], template[::step], mode='valid')
+    center = int(np.argmax(coarse)) * step
+    low = max(0, center - step + 1)
+    high = min(len(region) - len(template), center + step - 1)
+    fine = [np.dot(region[offset:offset + len(template)], template) for offset in range(low, high + 1)]
+    return low + int(np.argmax(fine))
+
+
+def wsola_stretch(samples, sample_rate, factor):
+    """Растягивает сигнал по времени в factor раз без изменения высоты тона.
+
+    Окна Ханна идут с шагом в половину окна; каждое следующее окно берётся
+    из окрестности своей номинальной позиции там, где оно лучше всего
+    продолжает предыдущее (максимум корреляции), чтобы не рвать периоды голоса.
+    """
+    x = np.asarray(samples, dtype=np.float32)
+    frame = max(4, int(sample_rate * WSOLA_FRAME_SECONDS) // 2 * 2)
+    hop = frame // 2
+    tolerance = int(sample_rate * WSOLA_TOLERANCE_SECONDS)
+    # Периодическое окно Ханна с шагом в половину окна даёт в сумме ровно 1
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+
+    frames = int(math.ceil(len(x) * factor / hop)) + 1
+    padded = np.pad(x, (tolerance, frame + hop + tolerance + int(math.ceil(frames * hop / factor)) - len(x)))
+    output = np.zeros(frames * hop + frame, dtype=np.float32)
+    position = tolerance
+    for index in range(frames):
+        if index:
+            nominal = tolerance + int(index * hop / factor)
+            # Естественное продолжение предыдущего окна и окрестность номинальной позиции
+            template = padded[position + hop:position + hop + frame]
+            region = padded[nominal - tolerance:nominal + tolerance + frame]
+            position = nominal - tolerance + _best_offset(region, template)
+        output[index * hop:index * hop + frame] += window * padded[position:position + frame]
+    return output[:int(len(x) * factor)]
+
+
+def wsola_shift(samples, sample_rate, n_steps):
+    """Сдвиг тона во временной области: WSOLA и передискретизация к исходной длине."""
+    from scipy.signal import resample_poly
+    ratio = semitones_to_ratio(n_steps)
+    stretched = wsola_stretch(samples, sample_rate, ratio)
+    fraction = Fraction(ratio).limit_denominator(RESAMPLE_MAX_DENOMINATOR)
+    # Растянутый в ratio раз сигнал сжимается обратно: тон поднимается в ratio раз
+    y = resample_poly(stretched, fraction.denominator, fraction.numerator)
+    return _fit_length(y, len(samples))
+
+
+def librosa_shift(samples, sample_rate, n_steps):
+    """Сдвиг тона фазовым вокодером librosa."""
+    import librosa
+    y = librosa.effects.pitch_shift(np.asarray(samples, dtype=np.float32), sr=sample_rate,
+                                    n_steps=n_steps, bins_per_octave=12)
+    return _fit_length(y, len(samples))
+
+
+def shift(samples, sample_rate, n_steps, engine='world'):
+    """Сдвигает высоту тона на n_steps полутонов; длина сигнала не меняется."""
+    if not n_steps:
+        return np.array(samples, dtype=np.float32)
+    if engine == 'world':
+        return world_shift(samples, sample_rate, n_steps)
+    if engine == 'wsola':
+        return wsola_shift(samples, sample_rate, n_steps)
+    if engine == 'librosa':
+        return librosa_shift(samples, sample_rate, n_steps)
+    raise ValueError(f"Неизвестный движок сдвига тона: {engine}")
@@ -0,0 +1,67 @@
+"""Прогресс обработки в сообщении с кнопками эффектов.
+
+Telegram ограничивает частоту редактирования сообщений, поэтому текст
+меняется не чаще раза в interval секунд. Этап обработки (set_stage)
+показывается сразу, если с прошлого редактирования прошло достаточно
+времени, иначе — при следующем обновлении фоновой задачи, которая раз
+в interval секунд дописывает к этапу строку detail() (например, оценку
+оставшегося времени).
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressMessage:
+    """Редактирует сообщение функцией edit(text) не чаще раза в interval секунд."""
+
+    def __init__(self, edit, interval, detail=None):
+        self._edit = edit
+        self.interval = interval
+        self.detail = detail
+        self.stage = ''
+        self._shown = None
+        self._last_edit = None
+        self._ticker = None
+        self.closed = False
+
+    def _text(self):
+        detail = self.detail() if self.detail is not None else ''
+        return f"{self.stage}\n{detail}" if detail else self.stage
+
+    async def refresh(self):
+        """Показывает текущий этап, если текст изменился и интервал прошёл."""
+        text = self._text()
+        if self.closed or not text or text == self._shown:
+            return
+        if self._last_edit is not None and time.monotonic() - self._last_edit < self.interval:
+            return
+        self._last_edit = time.monotonic()
+        self._shown = text
+        try:
+            await self._edit(text)
+        except Exception as e:
+            # Например, сообщение уже удалено; прогресс не должен мешать обработке
+            logger.debug(f"Не удалось обновить прогресс: {str(e)}")
+
+    async def set_stage(self, stage):
+        self.stage = stage
+        await self.refresh()
+
+    async def _tick(self):
+        while not self.closed:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    def start(self):
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._tick())
+
+    def close(self):
+        """Останавливает обновления; после этого сообщение можно удалять или менять."""
+        self.closed = True
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
@@ -0,0 +1,122 @@
+"""Кэш готовых результатов: file_id отправленного голосового сообщения.
+
+Ключ — file_unique_id исходного голосового, идентификатор эффекта и его
+параметры. Повторный запрос того же эффекта отвечает одним send_voice по
+file_id без скачивания и рендеринга. Первый уровень — LRU в памяти,
+второй (необязательный) — SQLite, переживающий перезапуск.
+
+Запись в SQLite может ждать диск или блокировку другого процесса, поэтому
+put и discard сразу обновляют память, а в базу пишут в отдельном потоке
+(по одной записи, в порядке вызовов). Чтение в режиме WAL не ждёт пишущих
+и выполняется своим соединением.
+"""
+import collections
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(file_unique_id, effect, params=()):
+    """Строит ключ кэша из исходного файла, эффекта и его параметров."""
+    return '|'.join([file_unique_id, effect] + [str(value) for value in params])
+
+
+class ResultCache:
+    """Двухуровневый кэш file_id результатов со счётчиками попаданий."""
+
+    def __init__(self, capacity, db_path=None):
+        self.capacity = capacity
+        self._memory = collections.OrderedDict()
+        self._db = None
+        self._reader = None
+        self._executor = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            # Соединение используется только потоком записи
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, file_id TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            self._db.commit()
+            self._reader = sqlite3.connect(db_path, timeout=1)
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='result-cache')
+            logger.info(f"Кэш результатов использует SQLite: {db_path}")
+
+    def _remember(self, key, file_id):
+        self._memory[key] = file_id
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Возвращает file_id результата или None."""
+        file_id = self._memory.get(key)
+        if file_id is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            metrics.RESULT_CACHE_HITS.inc(level='memory')
+            return file_id
+        if self._reader is not None:
+            try:
+                row = self._reader.execute('SELECT file_id FROM results WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Не удалось прочитать кэш результатов: {str(e)}")
+                row = None
+            if row is not None:
+                self._remember(key, row[0])
+                self.hits += 1
+                self.disk_hits += 1
+                metrics.RESULT_CACHE_HITS.inc(level='disk')
+                return row[0]
+        self.misses += 1
+        metrics.RESULT_CACHE_MISSES.inc()
+        return None
+
+    def _write(self, sql, params):
+        try:
+            self._db.execute(sql, params)
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось записать кэш результатов: {str(e)}")
+
+    def put(self, key, file_id):
+        """Сохраняет file_id результата."""
+        self._remember(key, file_id)
+        if self._executor is not None:
+            self._executor.submit(
+                self._write, 'INSERT OR REPLACE INTO results (key, file_id, created) VALUES (?, ?, ?)',
+                (key, file_id, time.time())
+            )
+
+    def discard(self, key):
+        """Удаляет запись (например, если Telegram больше не принимает file_id)."""
+        self._memory.pop(key, None)
+        if self._executor is not None:
+            self._executor.submit(self._write, 'DELETE FROM results WHERE key = ?', (key,))
+
+    def stats(self):
+        return {
+            'size': len(self._memory),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+    def close(self):
+        """Дожидается отложенных записей и закрывает базу."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._reader.close()
+            self._db.close()
+            self._reader = None
+            self._db = None
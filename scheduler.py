@@ -0,0 +1,169 @@
+"""Справедливое распределение рендеринга между чатами и пользователями.
+
+- FairQueue — очередь пула рендеринга с обслуживанием по кругу между чатами
+  (deficit round robin): за каждый круг чат получает quantum секунд аудио,
+  поэтому один активный групповой чат не занимает все процессы, а длинные
+  сообщения расходуют свою долю быстрее коротких;
+- RateLimiter — ограничение частоты запросов на рендеринг: token bucket
+  на каждого пользователя или чат;
+- Coalescer — одинаковые задачи (то же голосовое, эффект и параметры),
+  выполняющиеся одновременно: второй запрос ждёт результата первого,
+  а не рендерит то же самое ещё раз.
+"""
+import asyncio
+import collections
+import time
+
+
+class FairQueue:
+    """Очередь задач потоков (чатов) с обслуживанием deficit round robin."""
+
+    def __init__(self, quantum):
+        self.quantum = quantum
+        self._flows = {}
+        self._deficit = {}
+        # Потоки с задачами в порядке обслуживания; первый — тот, чья очередь сейчас
+        self._active = collections.deque()
+        self._in_turn = False
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def flows(self):
+        """Количество потоков, у которых есть задачи."""
+        return len(self._active)
+
+    def append(self, item, flow=None, cost=1.0):
+        """Добавляет задачу потока flow; cost — её стоимость в единицах quantum."""
+        queue = self._flows.get(flow)
+        if queue is None:
+            queue = self._flows[flow] = collections.deque()
+            self._deficit[flow] = 0.0
+            self._active.append(flow)
+        queue.append((item, cost))
+        self._size += 1
+
+    def popleft(self):
+        """Следующая задача по кругу между потоками."""
+        if not self._size:
+            raise IndexError('pop from an empty FairQueue')
+        while True:
+            flow = self._active[0]
+            if not self._in_turn:
+                self._deficit[flow] += self.quantum
+                self._in_turn = True
+            queue = self._flows[flow]
+            item, cost = queue[0]
+            if cost <= self._deficit[flow]:
+                self._deficit[flow] -= cost
+                queue.popleft()
+                self._size -= 1
+                if not queue:
+                    # Опустевший поток не копит дефицит на будущее
+                    self._active.popleft()
+                    del self._flows[flow]
+                    del self._deficit[flow]
+                    self._in_turn = False
+                return item
+            self._active.rotate(-1)
+            self._in_turn = False
+
+    def ahead(self, flow=None):
+        """Сколько задач будет выдано раньше последней задачи потока flow.
+
+        Порядок выдачи моделируется по текущему состоянию очереди; задачи,
+        добавленные позже, могут его изменить.
+        """
+        if flow not in self._flows:
+            return self._size
+        costs = {key: collections.deque(cost for _, cost in queue) for key, queue in self._flows.items()}
+        deficit = dict(self._deficit)
+        active = collections.deque(self._active)
+        in_turn = self._in_turn
+        served = 0
+        while True:
+            current = active[0]
+            if not in_turn:
+                deficit[current] += self.quantum
+                in_turn = True
+            queue = costs[current]
+            if queue[0] <= deficit[current]:
+                deficit[current] -= queue.popleft()
+                if not queue:
+                    if current == flow:
+                        return served
+                    active.popleft()
+                    in_turn = False
+                served += 1
+                continue
+            active.rotate(-1)
+            in_turn = False
+
+
+class RateLimiter:
+    """Token bucket на каждый ключ: burst запросов сразу, дальше per_minute в минуту.
+
+    per_minute = 0 выключает ограничение. Хранятся корзины max_keys
+    последних ключей: давно не обращавшиеся ключи вытесняются, их корзины
+    к этому времени всё равно полны.
+    """
+
+    def __init__(self, per_minute, burst, max_keys=100000):
+        self.rate = per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def wait_seconds(self, key, now=None):
+        """Сколько секунд до следующего разрешённого запроса ключа (0 — можно сейчас)."""
+        if not self.rate:
+            return 0.0
+        tokens = self._tokens(key, time.monotonic() if now is None else now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, key, now=None):
+        """Расходует один запрос ключа."""
+        if not self.rate:
+            return
+        now = time.monotonic() if now is None else now
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class Coalescer:
+    """Результаты выполняющихся задач по ключу для одинаковых запросов."""
+
+    def __init__(self):
+        self._futures = {}
+        self._owners = {}
+
+    def __len__(self):
+        return len(self._futures)
+
+    def pending(self, key):
+        """Future результата такой же задачи в работе или None."""
+        return self._futures.get(key)
+
+    def owner(self, key):
+        """Чей запрос выполняет задачу key (owner из lead) или None."""
+        return self._owners.get(key)
+
+    def lead(self, key, owner=None):
+        """Отмечает, что задача key выполняется для owner; результат передаётся в finish."""
+        self._futures[key] = asyncio.get_running_loop().create_future()
+        self._owners[key] = owner
+
+    def finish(self, key, result):
+        """Отдаёт result (None — задача не удалась) всем ждущим такую же задачу."""
+        self._owners.pop(key, None)
+        future = self._futures.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
@@ -0,0 +1,182 @@
+"""Хранилище ожидающих выбора эффекта голосовых сообщений.
+
+Ключ — (chat_id, message_id сообщения с кнопками), поэтому несколько
+запросов одного пользователя не перетирают друг друга. Хранилище
+ограничено по размеру (вытесняются самые старые записи), а устаревшие
+записи удаляет фоновая задача. При указании db_path записи дублируются
+в SQLite и восстанавливаются после перезапуска; запись в базу идёт
+в отдельном потоке, чтобы нажатия кнопок не ждали диска.
+"""
+import asyncio
+import collections
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceSession:
+    """Голосовое сообщение, для которого показаны кнопки эффектов."""
+
+    __slots__ = ('user_id', 'chat_id', 'message_id', 'reply_message_id',
+                 'file_id', 'file_unique_id', 'timestamp', 'duration')
+
+    def __init__(self, user_id, chat_id, message_id, reply_message_id,
+                 file_id, file_unique_id, timestamp=None, duration=0):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.reply_message_id = reply_message_id
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.timestamp = time.time() if timestamp is None else timestamp
+        # Длительность голосового сообщения в секундах (из Telegram)
+        self.duration = duration
+
+    def age(self, now=None):
+        return (time.time() if now is None else now) - self.timestamp
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def __repr__(self):
+        return (f"VoiceSession(user_id={self.user_id}, chat_id={self.chat_id}, "
+                f"message_id={self.message_id}, file_unique_id={self.file_unique_id})")
+
+
+class SessionStore:
+    """Ограниченное хранилище сессий с временем жизни ttl секунд."""
+
+    def __init__(self, capacity, ttl, db_path=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._sessions = collections.OrderedDict()
+        self._sweeper = None
+        self._db = None
+        self._executor = None
+        if db_path:
+            # После _load соединение используется только потоком записи
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'chat_id INTEGER, keyboard_id INTEGER, user_id INTEGER, message_id INTEGER, '
+                'reply_message_id INTEGER, file_id TEXT, file_unique_id TEXT, timestamp REAL, '
+                'duration REAL, PRIMARY KEY (chat_id, keyboard_id))'
+            )
+            self._db.commit()
+            self._load()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-store')
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _load(self):
+        self._db.execute('DELETE FROM sessions WHERE timestamp < ?', (time.time() - self.ttl,))
+        self._db.commit()
+        rows = self._db.execute(
+            'SELECT chat_id, keyboard_id, user_id, message_id, reply_message_id, '
+            'file_id, file_unique_id, timestamp, duration FROM sessions ORDER BY timestamp'
+        ).fetchall()
+        for chat_id, keyboard_id, *fields in rows:
+            user_id, message_id, reply_message_id, file_id, file_unique_id, timestamp, duration = fields
+            self._sessions[(chat_id, keyboard_id)] = VoiceSession(
+                user_id, chat_id, message_id, reply_message_id, file_id, file_unique_id, timestamp, duration or 0
+            )
+        logger.info(f"Восстановлено сессий из SQLite: {len(rows)}")
+
+    def _write(self, statements):
+        """Выполняет запросы statements одной транзакцией (в потоке записи)."""
+        try:
+            for sql, params in statements:
+                self._db.execute(sql, params)
+            self._db.commit()
+        except sqlite3.Error as e:
+            self._db.rollback()
+            logger.warning(f"Не удалось сохранить сессии в SQLite: {str(e)}")
+
+    def _persist(self, statements):
+        if self._executor is not None and statements:
+            self._executor.submit(self._write, statements)
+
+    def put(self, chat_id, keyboard_id, session):
+        """Сохраняет сессию для сообщения с кнопками."""
+        key = (chat_id, keyboard_id)
+        self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        statements = [(
+            'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (chat_id, keyboard_id, session.user_id, session.message_id, session.reply_message_id,
+             session.file_id, session.file_unique_id, session.timestamp, session.duration)
+        )]
+        while len(self._sessions) > self.capacity:
+            old_key, _ = self._sessions.popitem(last=False)
+            statements.append(self._delete_statement(old_key))
+        self._persist(statements)
+
+    def get(self, chat_id, keyboard_id):
+        """Возвращает сессию или None, если её нет или она устарела."""
+        session = self._sessions.get((chat_id, keyboard_id))
+        if session is not None and session.age() > self.ttl:
+            return None
+        return session
+
+    def is_expired(self, chat_id, keyboard_id):
+        session = self._sessions.get((chat_id, keyboard_id))
+        return session is not None and session.age() > self.ttl
+
+    def pop(self, chat_id, keyboard_id):
+        """Удаляет сессию и возвращает её (или None)."""
+        key = (chat_id, keyboard_id)
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            self._persist([self._delete_statement(key)])
+        return session
+
+    @staticmethod
+    def _delete_statement(key):
+        return 'DELETE FROM sessions WHERE chat_id = ? AND keyboard_id = ?', key
+
+    def sweep(self):
+        """Удаляет устаревшие сессии; возвращает их количество."""
+        now = time.time()
+        statements = []
+        # Записи упорядочены по времени добавления, поэтому достаточно просмотреть начало
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.age(now) <= self.ttl:
+                break
+            del self._sessions[key]
+            statements.append(self._delete_statement(key))
+        self._persist(statements)
+        return len(statements)
+
+    async def _sweep_forever(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"Удалено устаревших сессий: {removed}, осталось: {len(self._sessions)}")
+
+    def start_sweeper(self, interval):
+        """Запускает фоновую очистку устаревших сессий (внутри event loop)."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever(interval))
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        if self._executor is not None:
+            # Отложенные записи должны попасть в базу до её закрытия
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,267 @@
+"""Потоковая обработка длинных голосовых сообщений блоками.
+
+ffmpeg декодирует OGG в PCM, сэмплы читаются из его stdout блоками
+фиксированной длины, проходят цепочку обработчиков с состоянием и сразу
+пишутся в stdin второго ffmpeg, кодирующего результат в OGG/Opus. В памяти
+одновременно находятся только сжатые вход и выход и несколько блоков PCM,
+поэтому пиковое потребление не зависит от длины сообщения.
+
+Обработчики переносят состояние между блоками: фазу генераторов
+(oscillators.LayerOscillator), огибающую и восстановление компрессора
+(dynamics.Compressor), хвост перекрытия для эффектов, которым нужен
+контекст (OverlapAdd). Единственное отличие от обработки целиком —
+нормализация по накопленному пику (dynamics.RunningNormalizer).
+"""
+import logging
+import subprocess
+import threading
+import time
+import numpy as np
+import config
+import dynamics
+import effects
+import oscillators
+from audio_io import FfmpegError, decode_args, encode_args
+
+logger = logging.getLogger(__name__)
+
+# Перекрытие соседних сегментов автотюна с плавным переходом, секунды
+AUTOTUNE_OVERLAP_SECONDS = 0.1
+# Перекрытие сегментов сдвига тона, секунды
+PITCH_OVERLAP_SECONDS = 0.1
+# Размер чтения из stdout кодировщика
+READ_CHUNK = 65536
+
+
+class Chain:
+    """Последовательность обработчиков с методами process(block) и (необязательно) flush()."""
+
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def process(self, block):
+        for stage in self.stages:
+            block = stage.process(block)
+        return block
+
+    def flush(self):
+        """Досылает то, что обработчики задержали, через все последующие этапы."""
+        carry = np.zeros(0, dtype=np.float32)
+        for stage in self.stages:
+            if len(carry):
+                carry = stage.process(carry)
+            if hasattr(stage, 'flush'):
+                carry = np.concatenate((carry, stage.flush()))
+        return carry
+
+
+class Distortion:
+    """Усиление с жёстким ограничением; состояния нет."""
+
+    def __init__(self, gain):
+        self.gain = np.float32(gain)
+
+    def process(self, block):
+        return np.clip(block * self.gain, -1.0, 1.0)
+
+
+class OverlapAdd:
+    """Обработка сегментами с перекрытием для функций, которым нужен контекст.
+
+    Каждый сегмент начинается с последних overlap сэмплов предыдущего блока;
+    результат на перекрытии сводится с хвостом прошлого сегмента линейным
+    переходом. Выход отстаёт от входа на overlap сэмплов до вызова flush().
+    """
+
+    def __init__(self, function, overlap):
+        self.function = function
+        self.overlap = overlap
+        self._input_tail = np.zeros(0, dtype=np.float32)
+        self._output_tail = np.zeros(0, dtype=np.float32)
+
+    def process(self, block):
+        if not len(block):
+            return np.zeros(0, dtype=np.float32)
+        segment = np.concatenate((self._input_tail, block))
+        output = np.asarray(self.function(segment), dtype=np.float32)
+        shared = len(self._input_tail)
+        fade = np.linspace(0.0, 1.0, shared, endpoint=False, dtype=np.float32)
+        head = self._output_tail * (1.0 - fade) + output[:shared] * fade
+        keep = min(self.overlap, len(block))
+        body = output[shared:len(output) - keep]
+        self._input_tail = segment[len(segment) - keep:]
+        self._output_tail = output[len(output) - keep:]
+        return np.concatenate((head, body))
+
+    def flush(self):
+        tail = self._output_tail
+        self._input_tail = np.zeros(0, dtype=np.float32)
+        self._output_tail = np.zeros(0, dtype=np.float32)
+        return tail
+
+
+class StreamingAutotune:
+    """Автотюн сегмента; тональность определяется по первому сегменту и дальше не меняется."""
+
+    def __init__(self, sample_rate, fast=None):
+        import autotune
+        self.sample_rate = sample_rate
+        self.key = autotune.parse_key(config.AUTOTUNE_KEY)
+        self.fast = config.AUTOTUNE_MODE == 'fast' if fast is None else fast
+
+    def __call__(self, segment):
+        import autotune
+        if self.key is None:
+            f0, _ = autotune.extract_f0(segment, self.sample_rate, fast=self.fast)
+            self.key = autotune.detect_key(f0)
+            logger.debug(f"Тональность потокового автотюна: {self.key}")
+        return autotune.autotune(segment, self.sample_rate, key=self.key, fast=self.fast,
+                                 shift_semitones=effects.AUTOTUNE_SHIFT)
+
+
+class StreamingPitchShift:
+    """Сдвиг тона сегмента движком engine (по умолчанию config.PITCH_ENGINE)."""
+
+    def __init__(self, sample_rate, n_steps, engine=None):
+        self.sample_rate = sample_rate
+        self.n_steps = n_steps
+        self.engine = engine or config.PITCH_ENGINE
+
+    def __call__(self, segment):
+        import pitch_shift
+        return pitch_shift.shift(segment, self.sample_rate, self.n_steps, self.engine)
+
+
+def make_processor(effect, sample_rate, tier=effects.FULL_TIER):
+    """Цепочка обработчиков эффекта; параметры те же, что у функций effects.apply_*."""
+    options = effects.effect_options(effect, tier)
+    if effect == 'robot':
+        robot_rate = int(sample_rate * effects.ROBOT_RATE_FACTOR)
+        return Chain(
+            oscillators.LayerOscillator(effects.ROBOT_LAYER, robot_rate),
+            dynamics.Compressor(robot_rate, threshold=-30.0, ratio=20.0),
+            dynamics.RunningNormalizer(),
+        )
+    if effect == 'musical':
+        return Chain(
+            oscillators.LayerOscillator(effects.MUSICAL_LAYER, sample_rate),
+            dynamics.Compressor(sample_rate, threshold=-20.0, ratio=12.0),
+            dynamics.RunningNormalizer(),
+        )
+    if effect == 'autotune':
+        return Chain(
+            OverlapAdd(StreamingAutotune(sample_rate, **options), int(sample_rate * AUTOTUNE_OVERLAP_SECONDS)),
+            oscillators.LayerOscillator(effects.AUTOTUNE_LAYER, sample_rate),
+            dynamics.Compressor(sample_rate, threshold=-25.0, ratio=15.0),
+            dynamics.RunningNormalizer(),
+        )
+    if effect == 'rough':
+        return Chain(
+            Distortion(10.0),
+            oscillators.LayerOscillator(effects.ROUGH_LAYER, sample_rate),
+            dynamics.Compressor(sample_rate, threshold=-25.0, ratio=15.0),
+            dynamics.RunningNormalizer(),
+        )
+    if effect in effects.PITCH_EFFECTS:
+        n_steps = config.PITCH_SEMITONES if effect == 'pitch_up' else -config.PITCH_SEMITONES
+        return Chain(
+            OverlapAdd(StreamingPitchShift(sample_rate, n_steps, **options), int(sample_rate * PITCH_OVERLAP_SECONDS)),
+            dynamics.RunningNormalizer(),
+        )
+    raise ValueError(f"Неизвестный эффект: {effect}")
+
+
+def _start_ffmpeg(args):
+    """Запускает ffmpeg; возвращает процесс, поток чтения stderr и список его частей.
+
+    stderr читается сразу: при битом входе ffmpeg может написать больше,
+    чем вмещает канал, и остановиться, пока stdout ещё не дочитан.
+    """
+    process = subprocess.Popen(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error'] + args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    errors = []
+    stderr_reader = threading.Thread(target=_drain, args=(process.stderr, errors), daemon=True)
+    stderr_reader.start()
+    return process, stderr_reader, errors
+
+
+def _feed(pipe, data):
+    try:
+        pipe.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        pipe.close()
+
+
+def _drain(pipe, chunks):
+    while True:
+        chunk = pipe.read(READ_CHUNK)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+
+def _finish(ffmpeg, name, timeout):
+    process, stderr_reader, errors = ffmpeg
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise FfmpegError(f"ffmpeg ({name}) не завершился за {timeout} сек")
+    stderr_reader.join()
+    if process.returncode != 0:
+        raise FfmpegError(f"Ошибка ffmpeg ({name}): {b''.join(errors).decode(errors='replace')}")
+
+
+def render_stream(ogg_data, effect, sample_rate, block_seconds, timeout, tier=effects.FULL_TIER):
+    """Задача рабочего процесса: OGG -> эффект блоками -> OGG на уровне качества tier.
+
+    Возвращает (OGG, длительность аудио в секундах, время обработки в секундах).
+    """
+    started = time.perf_counter()
+    processor = make_processor(effect, sample_rate, tier)
+    block_samples = max(1, int(sample_rate * block_seconds))
+    decoding = _start_ffmpeg(decode_args(sample_rate, max_seconds=effects.TIERS[tier].max_seconds))
+    encoding = _start_ffmpeg(encode_args('f32le', sample_rate))
+    decoder, encoder = decoding[0], encoding[0]
+    chunks = []
+    feeder = threading.Thread(target=_feed, args=(decoder.stdin, ogg_data), daemon=True)
+    reader = threading.Thread(target=_drain, args=(encoder.stdout, chunks), daemon=True)
+    feeder.start()
+    reader.start()
+    total = 0
+    try:
+        while True:
+            # PCM читается сразу в массив блока и пишется кодировщику через memoryview, без копий
+            block = np.empty(block_samples, dtype=np.float32)
+            read = decoder.stdout.readinto(memoryview(block).cast('B'))
+            if not read:
+                break
+            # Неполный хвост float32 возможен только при обрыве декодера
+            block = block[:read // 4]
+            total += len(block)
+            encoder.stdin.write(memoryview(processor.process(block)).cast('B'))
+        encoder.stdin.write(memoryview(processor.flush()).cast('B'))
+        encoder.stdin.close()
+        _finish(decoding, 'декодирование', timeout)
+        _finish(encoding, 'кодирование', timeout)
+    except BrokenPipeError:
+        _finish(encoding, 'кодирование', timeout)
+        raise
+    finally:
+        for process, stderr_reader, _ in (decoding, encoding):
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            stderr_reader.join()
+        feeder.join()
+        reader.join()
+    elapsed = time.perf_counter() - started
+    logger.debug(f"Потоковая обработка {effect}: {total} сэмплов за {elapsed:.2f} сек")
+    return b''.join(chunks), total / sample_rate, elapsed
@@ -0,0 +1,88 @@
+"""Выбор уровня качества, отказ и освобождение мест в admission.AdmissionController."""
+import pytest
+
+import effects
+from admission import AdmissionController
+
+
+class Pool:
+    """Состояние пула рендеринга, которое читает контроллер."""
+
+    def __init__(self, size=2, max_queue=4):
+        self.size = size
+        self.max_queue = max_queue
+        self.queue_depth = 0
+        self.in_flight = 0
+
+
+def controller(pool=None, target=20.0, reject=90.0):
+    admission = AdmissionController(pool or Pool(), target, reject)
+    # Рендеринг длится столько же, сколько звук; на пониженных уровнях — быстрее
+    for tier, rtf in (('full', 1.0), ('reduced', 0.5), ('minimal', 0.2)):
+        for effect in effects.EFFECT_FUNCTIONS:
+            admission.observe(effect, tier, 10.0, 10.0 * rtf)
+    return admission
+
+
+def test_idle_pool_renders_full_quality():
+    admission = controller()
+    assert admission.choose(['robot'], 10.0) == 'full'
+    assert admission.admitted == 1
+
+
+def test_long_message_gets_cheaper_tier():
+    admission = controller()
+    assert admission.choose(['robot'], 30.0) == 'reduced'
+    assert admission.choose(['robot'], 90.0) == 'minimal'
+
+
+def test_tier_without_savings_is_skipped(monkeypatch):
+    # Частота автотюна уже равна частоте пониженного уровня, а быстрый анализ включён всегда
+    monkeypatch.setattr(effects.config, 'AUTOTUNE_MODE', 'fast')
+    monkeypatch.setattr(effects.config, 'PROCESSING_RATE', 'effect')
+    assert effects.tier_work('autotune', 'reduced') == effects.tier_work('autotune', 'full')
+    assert effects.tier_work('robot', 'reduced') != effects.tier_work('robot', 'full')
+
+    admission = controller()
+    assert admission.choose(['autotune'], 30.0) == 'minimal'
+
+
+def test_saturated_pool_rejects_and_keeps_slots_free():
+    pool = Pool(size=2, max_queue=4)
+    admission = controller(pool)
+    for _ in range(6):
+        assert admission.choose(['robot'], 1.0) is not None
+    assert admission.choose(['robot'], 1.0) is None
+    assert admission.rejected == 1
+    assert admission.admitted == 6
+    # Уже принятая задача (из общей очереди) не отклоняется, а упрощается
+    assert admission.choose(['robot'], 1.0, can_reject=False) == 'minimal'
+    assert admission.admitted == 7
+
+
+def test_release_frees_admitted_slots():
+    admission = controller(Pool(size=2, max_queue=32))
+    tiers = [admission.choose(list(effects.EFFECT_FUNCTIONS), 5.0) for _ in range(2)]
+    assert None not in tiers
+    assert admission.admitted == 2 * len(effects.EFFECT_FUNCTIONS)
+    assert admission.backlog_seconds() > 0
+    for _ in tiers:
+        admission.release(len(effects.EFFECT_FUNCTIONS))
+    assert admission.admitted == 0
+    assert admission.backlog_seconds() == 0
+    admission.release(1)
+    assert admission.admitted == 0
+
+
+def test_backlog_counts_pool_jobs():
+    pool = Pool(size=2, max_queue=4)
+    admission = controller(pool)
+    pool.in_flight, pool.queue_depth = 2, 4
+    assert admission.jobs_ahead() == 6
+    assert admission.choose(['robot'], 1.0) is None
+
+
+@pytest.mark.parametrize('target', [0, 0.0])
+def test_target_zero_always_full(target):
+    admission = controller(target=target)
+    assert admission.choose(['robot'], 600.0) == 'full'
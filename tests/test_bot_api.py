@@ -0,0 +1,127 @@
+"""Повторы и пулы соединений bot_api на локальной заглушке Bot API."""
+import asyncio
+import json
+import time
+
+import pytest
+from telegram import Bot
+from telegram.error import RetryAfter, TelegramError
+
+import bot_api
+from fake_bot_api import FakeBotApi
+
+TOKEN = '123:fake'
+VOICE = b'OggS' + bytes(1000)
+
+
+def make_request(retries=3, max_wait=5.0):
+    options = dict(retries=retries, backoff=0.01, max_wait=max_wait, connection_pool_size=4)
+    return bot_api.PooledRequest(
+        bot_api.RetryingRequest(**options), bot_api.RetryingRequest(**options), **options
+    )
+
+
+def run_with_bot(scenario, **request_options):
+    """Запускает scenario(bot, api) с ботом, который ходит в заглушку через PooledRequest."""
+    async def main():
+        api = FakeBotApi({'voice': (VOICE, 1.0)})
+        port = await api.start('127.0.0.1', 0)
+        bot = Bot(TOKEN, request=make_request(**request_options),
+                  base_url=f"http://127.0.0.1:{port}/bot", base_file_url=f"http://127.0.0.1:{port}/file/bot")
+        try:
+            async with bot:
+                return await scenario(bot, api)
+        finally:
+            await api.close()
+    return asyncio.run(main())
+
+
+def test_5xx_is_retried():
+    async def scenario(bot, api):
+        api.inject_error('getFile', 503, count=2)
+        voice_file = await bot.get_file('voice:1')
+        assert voice_file.file_id == 'voice:1'
+        assert api.calls['getFile'] == 3
+    run_with_bot(scenario)
+
+
+def test_5xx_on_send_is_not_retried():
+    async def scenario(bot, api):
+        # Прокси мог ответить 502, когда Telegram уже принял сообщение
+        api.inject_error('sendVoice', 502)
+        with pytest.raises(TelegramError):
+            await bot.send_voice(1, VOICE)
+        assert api.calls['sendVoice'] == 1
+        api.inject_error('editMessageText', 504)
+        with pytest.raises(TelegramError):
+            await bot.edit_message_text('текст', 1, 1)
+        assert api.calls['editMessageText'] == 1
+    run_with_bot(scenario)
+
+
+def test_429_on_send_is_retried():
+    async def scenario(bot, api):
+        api.inject_error('sendVoice', 429, retry_after=0.01)
+        await bot.send_voice(1, VOICE)
+        assert api.calls['sendVoice'] == 2
+    run_with_bot(scenario)
+
+
+def test_retry_after_is_respected():
+    async def scenario(bot, api):
+        api.inject_error('sendMessage', 429, retry_after=1)
+        started = time.monotonic()
+        await bot.send_message(1, 'текст')
+        assert time.monotonic() - started >= 1.0
+        assert api.calls['sendMessage'] == 2
+    run_with_bot(scenario)
+
+
+def test_retry_after_above_max_wait_is_raised():
+    async def scenario(bot, api):
+        api.inject_error('sendMessage', 429, retry_after=60)
+        with pytest.raises(RetryAfter):
+            await bot.send_message(1, 'текст')
+        assert api.calls['sendMessage'] == 1
+    run_with_bot(scenario, max_wait=5.0)
+
+
+def test_retries_are_limited():
+    async def scenario(bot, api):
+        api.inject_error('getFile', 502, count=3)
+        with pytest.raises(TelegramError):
+            await bot.get_file('voice:1')
+        assert api.calls['getFile'] == 3
+    run_with_bot(scenario, retries=2)
+
+
+def test_download_is_retried():
+    async def scenario(bot, api):
+        api.inject_error('file', 500)
+        voice_file = await bot.get_file('voice:1')
+        assert bytes(await voice_file.download_as_bytearray()) == VOICE
+        assert api.calls['file'] == 2
+    run_with_bot(scenario)
+
+
+def test_downloads_and_uploads_use_separate_pools():
+    async def scenario(bot, api):
+        await bot.send_message(1, 'текст')
+        voice_file = await bot.get_file('voice:1')
+        await voice_file.download_as_bytearray()
+        await bot.send_voice(1, VOICE)
+        methods = api.connections['sendMessage'] | api.connections['getFile']
+        assert methods.isdisjoint(api.connections['file'])
+        assert methods.isdisjoint(api.connections['sendVoice'])
+        assert api.connections['file'].isdisjoint(api.connections['sendVoice'])
+    run_with_bot(scenario)
+
+
+def test_retry_delay():
+    request = bot_api.RetryingRequest(backoff=0.5, max_wait=30.0)
+    payload = json.dumps({'ok': False, 'parameters': {'retry_after': 3}}).encode()
+    assert 3.0 <= request.retry_delay(payload, 0) <= 3.5
+    assert request.retry_delay(json.dumps({'parameters': {'retry_after': 31}}).encode(), 0) is None
+    # Тело 5xx от прокси не в JSON: экспоненциальная задержка, не больше max_wait
+    for attempt in range(10):
+        assert 0.0 <= request.retry_delay(b'<html>Bad Gateway</html>', attempt) <= min(30.0, 0.5 * 2 ** attempt)
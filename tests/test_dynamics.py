@@ -0,0 +1,86 @@
+"""Сравнение dynamics с pydub.effects на синтетическом сигнале int16."""
+import warnings
+
+import numpy as np
+import pytest
+
+import dynamics
+
+with warnings.catch_warnings():
+    # pydub предупреждает об отсутствии ffmpeg, а для эффектов он не нужен
+    warnings.simplefilter('ignore', RuntimeWarning)
+    from pydub import AudioSegment
+    from pydub import effects as pydub_effects
+
+SAMPLE_RATE = 16000
+# Окно сравнения громкости, 10 мс
+FRAME = SAMPLE_RATE // 100
+# Пороги и ratio компрессоров эффектов
+EFFECT_SETTINGS = [(-30.0, 20.0), (-20.0, 12.0), (-25.0, 15.0)]
+
+
+def synthetic_voice(seconds=2.0):
+    """Тон с медленно меняющейся громкостью и шумом, int16."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    envelope = 0.1 + 0.9 * np.abs(np.sin(2 * np.pi * 1.3 * t))
+    signal = 0.6 * np.sin(2 * np.pi * 220 * t) * envelope + 0.01 * rng.standard_normal(len(t))
+    return np.round(signal * 32767).astype(np.int16)
+
+
+def to_segment(pcm):
+    return AudioSegment(pcm.tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=1)
+
+
+def from_segment(segment):
+    return np.frombuffer(segment.raw_data, dtype=np.int16) / 32768.0
+
+
+def frame_rms_db(samples):
+    frames = samples[:len(samples) // FRAME * FRAME].reshape(-1, FRAME).astype(np.float64)
+    return 20.0 * np.log10(np.sqrt(np.mean(np.square(frames), axis=1)) + 1e-9)
+
+
+@pytest.mark.parametrize('threshold,ratio', EFFECT_SETTINGS)
+def test_compress_matches_pydub(threshold, ratio):
+    pcm = synthetic_voice()
+    expected = from_segment(pydub_effects.compress_dynamic_range(to_segment(pcm), threshold=threshold, ratio=ratio))
+    actual = dynamics.compress_dynamic_range(pcm / 32768.0, SAMPLE_RATE, threshold=threshold, ratio=ratio)
+
+    deviation = np.abs(frame_rms_db(expected) - frame_rms_db(actual))
+    assert np.percentile(deviation, 95) < 1.0
+    assert deviation.max() < 2.0
+
+
+@pytest.mark.parametrize('threshold,ratio', EFFECT_SETTINGS)
+def test_compress_and_normalize_match_pydub(threshold, ratio):
+    pcm = synthetic_voice()
+    compressed = pydub_effects.compress_dynamic_range(to_segment(pcm), threshold=threshold, ratio=ratio)
+    expected = from_segment(pydub_effects.normalize(compressed))
+    actual = dynamics.normalize(dynamics.compress_dynamic_range(pcm / 32768.0, SAMPLE_RATE, threshold, ratio))
+
+    deviation = np.abs(frame_rms_db(expected) - frame_rms_db(actual))
+    assert np.percentile(deviation, 95) < 1.0
+    assert deviation.max() < 2.0
+
+
+def test_normalize_matches_pydub():
+    pcm = synthetic_voice()
+    expected = from_segment(pydub_effects.normalize(to_segment(pcm)))
+    actual = dynamics.normalize(pcm / 32768.0)
+
+    # pydub округляет результат до int16
+    assert np.max(np.abs(expected - actual)) <= 2 / 32768.0
+
+
+@pytest.mark.parametrize('threshold,ratio', EFFECT_SETTINGS)
+def test_compressor_blocks_match_whole_signal(threshold, ratio):
+    samples = synthetic_voice() / 32768.0
+    whole = dynamics.Compressor(SAMPLE_RATE, threshold, ratio).process(samples)
+
+    compressor = dynamics.Compressor(SAMPLE_RATE, threshold, ratio)
+    # Блоки короче и длиннее окна огибающей, в том числе пустой
+    blocks = np.array_split(samples, [1, 1, 50, 130, 4096, 20000, 20001])
+    streamed = np.concatenate([compressor.process(block) for block in blocks])
+
+    assert np.array_equal(whole, streamed)
@@ -0,0 +1,91 @@
+"""Аренда задач общей очереди: SQLite и Redis (на fakeredis, если он установлен)."""
+import time
+
+import pytest
+
+from job_queue import JobQueue, RedisJobQueue
+
+VISIBILITY = 0.3
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def queue(request, tmp_path):
+    if request.param == 'sqlite':
+        job_queue = JobQueue(str(tmp_path / 'jobs.db'), VISIBILITY, max_attempts=2)
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        job_queue = RedisJobQueue('', VISIBILITY, max_attempts=2, client=fakeredis.FakeRedis())
+    yield job_queue
+    job_queue.close()
+
+
+def test_jobs_are_leased_in_order(queue):
+    first = queue.enqueue({'n': 1})
+    second = queue.enqueue({'n': 2})
+    assert queue.depth() == 2
+
+    job = queue.lease('a')
+    assert (job.id, job.payload, job.attempts, job.worker) == (first, {'n': 1}, 1, 'a')
+    assert queue.lease('b').id == second
+    assert queue.lease('c') is None
+    assert queue.depth() == 0
+
+
+def test_expired_lease_is_given_to_another_worker(queue):
+    queue.enqueue({'n': 1})
+    job = queue.lease('a')
+    assert queue.extend(job)
+    time.sleep(VISIBILITY + 0.2)
+
+    again = queue.lease('b')
+    assert (again.id, again.attempts, again.worker) == (job.id, 2, 'b')
+    # Задачу забрал другой процесс: первый не может ни продлить, ни завершить её
+    assert not queue.extend(job)
+    queue.complete(job)
+    assert queue.extend(again)
+
+
+def test_retry_and_complete(queue):
+    queue.enqueue({'n': 1})
+    job = queue.lease('a')
+    queue.retry(job, 'ошибка')
+    assert queue.depth() == 1
+
+    job = queue.lease('a')
+    assert job.attempts == 2
+    queue.complete(job)
+    assert queue.lease('a') is None
+    assert queue.reap() == []
+    assert queue.purge(-1) == 1
+
+
+def test_reap_fails_exhausted_jobs(queue):
+    abandoned = queue.enqueue({'n': 1})
+    returned = queue.enqueue({'n': 2})
+    assert queue.lease('a').id == abandoned
+    time.sleep(VISIBILITY + 0.2)
+    assert queue.lease('a').attempts == 2
+    for attempt in (1, 2):
+        job = queue.lease('b')
+        assert (job.id, job.attempts) == (returned, attempt)
+        queue.retry(job, 'ошибка')
+    # Попытки исчерпаны: задачи больше не выдаются, их помечает проваленными reap
+    assert queue.lease('c') is None
+
+    time.sleep(VISIBILITY + 0.2)
+    assert queue.lease('c') is None
+    reaped = queue.reap()
+    assert sorted(job.id for job in reaped) == [abandoned, returned]
+    assert queue.reap() == []
+
+
+def test_finished_jobs_are_not_leased_again(queue):
+    queue.enqueue({'n': 1})
+    queue.enqueue({'n': 2})
+    queue.complete(queue.lease('a'))
+    queue.fail(queue.lease('a'), 'ошибка')
+    time.sleep(VISIBILITY + 0.2)
+    assert queue.lease('a') is None
+    assert queue.reap() == []
+    assert queue.purge(-1) == 2
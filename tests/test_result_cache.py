@@ -0,0 +1,31 @@
+"""Кэш результатов: отложенная запись в SQLite и счётчики попаданий."""
+import metrics
+from result_cache import ResultCache
+
+
+def test_writes_survive_restart(tmp_path):
+    path = str(tmp_path / 'results.db')
+    cache = ResultCache(8, path)
+    cache.put('a', 'file-a')
+    cache.put('b', 'file-b')
+    cache.discard('b')
+    # Запись идёт в фоне, close дожидается её
+    cache.close()
+
+    cache = ResultCache(8, path)
+    assert cache.get('a') == 'file-a'
+    assert cache.get('b') is None
+    assert cache.stats()['disk_hits'] == 1
+    cache.close()
+
+
+def test_lookups_are_counted_in_metrics():
+    cache = ResultCache(1)
+    hits = metrics.RESULT_CACHE_HITS.value(level='memory')
+    misses = metrics.RESULT_CACHE_MISSES.value()
+    cache.put('a', 'file-a')
+    cache.put('b', 'file-b')
+    assert cache.get('b') == 'file-b'
+    assert cache.get('a') is None
+    assert metrics.RESULT_CACHE_HITS.value(level='memory') == hits + 1
+    assert metrics.RESULT_CACHE_MISSES.value() == misses + 1
@@ -0,0 +1,135 @@
+"""Справедливая очередь, ограничение частоты и объединение одинаковых задач."""
+import asyncio
+import random
+
+from scheduler import Coalescer, FairQueue, RateLimiter
+
+
+def drain(queue):
+    return [queue.popleft() for _ in range(len(queue))]
+
+
+def test_flows_are_served_in_turn():
+    queue = FairQueue(quantum=1.0)
+    for index in range(4):
+        queue.append(f"a{index}", flow='a')
+    queue.append('b0', flow='b')
+    queue.append('c0', flow='c')
+    # Одиночные задачи тихих чатов не ждут всю очередь занятого чата
+    assert drain(queue) == ['a0', 'b0', 'c0', 'a1', 'a2', 'a3']
+
+
+def test_cost_limits_share_of_flow():
+    queue = FairQueue(quantum=2.0)
+    for index in range(3):
+        queue.append(f"long{index}", flow='long', cost=2.0)
+        queue.append(f"short{index}", flow='short', cost=1.0)
+    queue.append('short3', flow='short', cost=1.0)
+    # За круг поток получает quantum: одну длинную задачу или две короткие
+    assert drain(queue) == ['long0', 'short0', 'short1', 'long1', 'short2', 'short3', 'long2']
+
+
+def test_cost_above_quantum_accumulates_deficit():
+    queue = FairQueue(quantum=1.0)
+    queue.append('huge', flow='a', cost=2.5)
+    queue.append('b0', flow='b')
+    queue.append('b1', flow='b')
+    queue.append('b2', flow='b')
+    # Дорогая задача копит дефицит три круга, короткие идут по одной за круг
+    assert drain(queue) == ['b0', 'b1', 'huge', 'b2']
+
+
+def test_ahead_matches_service_order():
+    generator = random.Random(1)
+    for _ in range(200):
+        queue = FairQueue(quantum=generator.choice([0.5, 1.0, 3.0]))
+        for index in range(generator.randint(1, 12)):
+            queue.append(index, flow=generator.randint(0, 3), cost=generator.choice([0.5, 1.0, 2.0, 4.0]))
+        # Часть задач уже выдана: очередь в середине круга
+        for _ in range(generator.randint(0, len(queue) - 1)):
+            queue.popleft()
+        flow = generator.randint(0, 4)
+        queue.append('new', flow=flow, cost=generator.choice([0.5, 1.0, 2.0]))
+        expected = queue.ahead(flow)
+        assert drain(queue).index('new') == expected
+
+
+def test_ahead_of_unknown_flow_is_whole_queue():
+    queue = FairQueue(quantum=1.0)
+    queue.append('a0', flow='a')
+    queue.append('a1', flow='a')
+    assert queue.ahead('b') == 2
+
+
+def test_rate_limiter_allows_burst_then_refills():
+    limiter = RateLimiter(per_minute=60, burst=2)
+    assert limiter.wait_seconds('user', now=0.0) == 0.0
+    limiter.take('user', now=0.0)
+    limiter.take('user', now=0.0)
+    assert limiter.wait_seconds('user', now=0.0) == 1.0
+    assert limiter.wait_seconds('user', now=0.5) == 0.5
+    assert limiter.wait_seconds('user', now=1.0) == 0.0
+    # Другие ключи не затронуты
+    assert limiter.wait_seconds('other', now=0.0) == 0.0
+
+
+def test_rate_limiter_caps_tokens_at_burst():
+    limiter = RateLimiter(per_minute=60, burst=2)
+    limiter.take('user', now=0.0)
+    # За час простоя копится не больше burst запросов
+    limiter.take('user', now=3600.0)
+    limiter.take('user', now=3600.0)
+    assert limiter.wait_seconds('user', now=3600.0) == 1.0
+
+
+def test_rate_limiter_disabled_and_evicts_old_keys():
+    disabled = RateLimiter(per_minute=0, burst=1)
+    for _ in range(10):
+        disabled.take('user', now=0.0)
+    assert disabled.wait_seconds('user', now=0.0) == 0.0
+
+    limiter = RateLimiter(per_minute=1, burst=1, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        limiter.take(key, now=0.0)
+    # Вытесненный ключ снова получает полную корзину
+    assert limiter.wait_seconds('a', now=0.0) == 0.0
+    assert limiter.wait_seconds('c', now=0.0) == 60.0
+
+
+def test_coalescer_shares_result_with_waiters():
+    async def scenario():
+        coalescer = Coalescer()
+        assert coalescer.pending('key') is None
+        coalescer.lead('key', owner=(1, 10))
+        waiters = [coalescer.pending('key') for _ in range(3)]
+        assert len(coalescer) == 1
+        coalescer.finish('key', 'file-id')
+        assert [await waiter for waiter in waiters] == ['file-id'] * 3
+        assert coalescer.pending('key') is None
+        assert len(coalescer) == 0
+    asyncio.run(scenario())
+
+
+def test_coalescer_failure_is_none():
+    async def scenario():
+        coalescer = Coalescer()
+        coalescer.lead('key')
+        waiter = coalescer.pending('key')
+        coalescer.finish('key', None)
+        assert await waiter is None
+        # Повторный finish без лидера ничего не делает
+        coalescer.finish('key', 'late')
+    asyncio.run(scenario())
+
+
+def test_coalescer_owner_identifies_same_keyboard():
+    async def scenario():
+        coalescer = Coalescer()
+        coalescer.lead('key', owner=(1, 10))
+        # Повторное нажатие на клавиатуре лидера не должно ждать само себя
+        assert coalescer.owner('key') == (1, 10)
+        assert coalescer.owner('key') != (1, 11)
+        assert coalescer.owner('other') is None
+        coalescer.finish('key', 'file-id')
+        assert coalescer.owner('key') is None
+    asyncio.run(scenario())
@@ -0,0 +1,40 @@
+"""Хранилище сессий: отложенная запись в SQLite и восстановление после перезапуска."""
+import asyncio
+import time
+
+from sessions import SessionStore, VoiceSession
+
+
+def session(chat_id, timestamp=None):
+    return VoiceSession(1, chat_id, 10, 11, 'file', 'unique', timestamp=timestamp, duration=3)
+
+
+def test_sessions_survive_restart(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = SessionStore(2, ttl=60, db_path=path)
+    store.put(1, 100, session(1))
+    store.put(2, 200, session(2))
+    store.put(3, 300, session(3))
+    assert store.pop(2, 200) is not None
+    asyncio.run(store.close())
+
+    store = SessionStore(2, ttl=60, db_path=path)
+    # Первая сессия вытеснена по размеру, вторая удалена pop
+    assert store.get(1, 100) is None
+    assert store.get(2, 200) is None
+    assert store.get(3, 300).duration == 3
+    asyncio.run(store.close())
+
+
+def test_sweep_removes_expired_sessions_from_disk(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = SessionStore(10, ttl=60, db_path=path)
+    store.put(1, 100, session(1, timestamp=time.time() - 120))
+    store.put(2, 200, session(2))
+    assert store.sweep() == 1
+    asyncio.run(store.close())
+
+    # С большим ttl устаревшая запись восстановилась бы, если бы осталась в базе
+    store = SessionStore(10, ttl=600, db_path=path)
+    assert len(store) == 1
+    asyncio.run(store.close())
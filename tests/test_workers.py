@@ -0,0 +1,22 @@
+"""Пул рендеринга: ёмкость очереди при одновременной постановке задач."""
+import asyncio
+import time
+
+from workers import QueueFullError, RenderPool
+
+
+def test_burst_fills_workers_before_queue():
+    async def scenario():
+        pool = RenderPool(workers=2, max_queue=3, job_timeout=10)
+        pool.start()
+        try:
+            await pool.wait_ready()
+            results = await asyncio.gather(
+                *(pool.submit(time.sleep, 0.2) for _ in range(6)), return_exceptions=True
+            )
+        finally:
+            await pool.shutdown()
+        # Два процесса и три места в очереди: лишней оказывается одна задача
+        assert sum(isinstance(result, QueueFullError) for result in results) == 1
+        assert results.count(None) == 5
+    asyncio.run(scenario())
@@ -0,0 +1,108 @@
+"""Приём обновлений Telegram через вебхук вместо long polling.
+
+Небольшой HTTP-сервер на asyncio принимает POST с JSON-обновлением,
+проверяет заголовок X-Telegram-Bot-Api-Secret-Token и кладёт обновление
+в update_queue приложения python-telegram-bot. Ответ 200 отправляется
+сразу, обработка идёт параллельно (см. concurrent_updates приложения).
+"""
+import asyncio
+import hmac
+import json
+import logging
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+# Обновление Telegram заметно меньше; всё крупнее отклоняется
+MAX_BODY_BYTES = 1024 * 1024
+READ_TIMEOUT = 10
+
+
+def _response(writer, status, body=b''):
+    writer.write(
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: text/plain; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode() + body
+    )
+
+
+async def _read_request(reader):
+    """Возвращает (метод, путь, заголовки в нижнем регистре, тело) или None при ошибке размера."""
+    request_line = await asyncio.wait_for(reader.readline(), timeout=READ_TIMEOUT)
+    parts = request_line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout=READ_TIMEOUT)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY_BYTES:
+        return None
+    body = await asyncio.wait_for(reader.readexactly(length), timeout=READ_TIMEOUT) if length else b''
+    method, path = (parts[0], parts[1].split('?')[0]) if len(parts) >= 2 else ('', '')
+    return method, path, headers, body
+
+
+class WebhookServer:
+    """Сервер вебхука для приложения application на host:port и пути path."""
+
+    def __init__(self, application, path, secret_token):
+        self.application = application
+        self.path = path if path.startswith('/') else '/' + path
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await _read_request(reader)
+            if request is None:
+                self.rejected += 1
+                _response(writer, '413 Payload Too Large')
+            else:
+                await self._dispatch(writer, *request)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            logger.debug(f"Ошибка соединения с вебхуком: {str(e)}")
+        finally:
+            writer.close()
+
+    async def _dispatch(self, writer, method, path, headers, body):
+        if path != self.path:
+            _response(writer, '404 Not Found', b'not found\n')
+            return
+        if method != 'POST':
+            _response(writer, '405 Method Not Allowed')
+            return
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode(), self.secret_token.encode()):
+            self.rejected += 1
+            logger.warning("Запрос к вебхуку с неверным секретным токеном")
+            _response(writer, '403 Forbidden')
+            return
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            update = None
+            logger.warning(f"Некорректное обновление в вебхуке: {str(e)}")
+        if update is None:
+            self.rejected += 1
+            _response(writer, '400 Bad Request')
+            return
+        self.received += 1
+        await self.application.update_queue.put(update)
+        _response(writer, '200 OK')
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"Вебхук принимает обновления на http://{host}:{port}{self.path}")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
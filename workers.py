@@ -0,0 +1,257 @@
+"""Пул процессов для рендеринга эффектов вне event loop.
+
+Каждый рабочий процесс является лидером своей группы процессов, поэтому
+при превышении дедлайна задачи процесс убивается вместе с дочерними
+ffmpeg и заменяется новым, не затрагивая остальные задачи. Перед первой
+задачей процесс выполняет initializer (прогрев) и сообщает о готовности.
+Задачи разных чатов выдаются процессам по кругу (scheduler.FairQueue).
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from scheduler import FairQueue
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь рендеринга переполнена."""
+
+
+class JobTimeoutError(Exception):
+    """Задача превысила дедлайн и была прервана."""
+
+
+class RenderError(Exception):
+    """Ошибка внутри рабочего процесса."""
+
+
+def _worker_loop(conn, initializer):
+    """Цикл рабочего процесса: получает задачи из канала и возвращает результат."""
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    started = time.perf_counter()
+    if initializer is not None:
+        try:
+            initializer()
+        except Exception as e:
+            # Неудачный прогрев не мешает работе: ошибка проявится в задаче
+            logger.error(f"Ошибка инициализации рабочего процесса: {str(e)}\n{traceback.format_exc()}")
+    # Первое сообщение - о готовности и длительности инициализации
+    conn.send((True, time.perf_counter() - started))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        func, args = message
+        try:
+            conn.send((True, func(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+
+
+class _Worker:
+    """Рабочий процесс и его конец канала."""
+
+    __slots__ = ('process', 'conn', 'warm_up_seconds', '_ready_lock')
+
+    def __init__(self, context, initializer):
+        self.warm_up_seconds = None
+        self._ready_lock = threading.Lock()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_loop, args=(child_conn, initializer), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def wait_ready(self):
+        """Ждёт окончания инициализации процесса; возвращает её длительность."""
+        with self._ready_lock:
+            if self.warm_up_seconds is None:
+                _, self.warm_up_seconds = self.conn.recv()
+        return self.warm_up_seconds
+
+    def call(self, func, args):
+        self.wait_ready()
+        self.conn.send((func, args))
+        return self.conn.recv()
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'timeout', 'future', 'label', 'enqueued')
+
+    def __init__(self, func, args, timeout, future, label):
+        self.func = func
+        self.args = args
+        self.timeout = timeout
+        self.future = future
+        self.label = label
+        self.enqueued = time.monotonic()
+
+
+class RenderPool:
+    """Ограниченная очередь задач и пул процессов с дедлайнами."""
+
+    def __init__(self, workers, max_queue, job_timeout, notice_position=1, initializer=None, quantum=30.0):
+        self.size = max(1, workers)
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.notice_position = notice_position
+        self.initializer = initializer
+        # fork, а не spawn: spawn заново импортирует main.py со всеми проверками
+        self._context = multiprocessing.get_context('fork')
+        self._workers = []
+        self._pending = FairQueue(quantum)
+        self._ready = None
+        self._dispatchers = []
+        self._threads = None
+        self._busy = 0
+
+    @property
+    def queue_depth(self):
+        """Количество задач, ожидающих свободного процесса."""
+        return len(self._pending)
+
+    @property
+    def in_flight(self):
+        """Количество задач, выполняющихся прямо сейчас."""
+        return self._busy
+
+    def start(self):
+        """Запускает рабочие процессы (до старта event loop)."""
+        logger.info(f"Запуск пула рендеринга: {self.size} процессов, очередь {self.max_queue}")
+        self._workers = [_Worker(self._context, self.initializer) for _ in range(self.size)]
+        self._threads = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='render')
+
+    async def wait_ready(self):
+        """Ждёт инициализации всех рабочих процессов; возвращает длительности прогрева.
+
+        Для процесса, завершившегося во время прогрева, вместо длительности None.
+        """
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._threads, worker.wait_ready) for worker in self._workers
+        ), return_exceptions=True)
+        return [None if isinstance(result, Exception) else result for result in results]
+
+    def _ensure_dispatchers(self):
+        if self._dispatchers:
+            return
+        self._ready = asyncio.Semaphore(0)
+        self._dispatchers = [
+            asyncio.create_task(self._dispatch(index)) for index in range(self.size)
+        ]
+
+    async def submit(self, func, *args, timeout=None, on_queued=None, label='', flow=None, cost=1.0):
+        """Ставит задачу в очередь и ждёт результат.
+
+        on_queued(position) вызывается, если задаче придётся ждать
+        не меньше notice_position других задач. label — метка задачи
+        (эффект) для метрики времени ожидания в очереди. flow — чат, между
+        чатами очередь обслуживается по кругу; cost — стоимость задачи
+        (секунды аудио) в единицах quantum.
+        """
+        # Задачи, которые ещё не забрали свободные процессы, ждать не будут
+        waiting = len(self._pending) - (self.size - self._busy)
+        if waiting >= self.max_queue:
+            raise QueueFullError(f"В очереди уже {waiting} задач")
+        self._ensure_dispatchers()
+        job = _Job(func, args, timeout or self.job_timeout,
+                   asyncio.get_running_loop().create_future(), label)
+        self._pending.append(job, flow, cost)
+        # Очередь обслуживает чаты по кругу, поэтому впереди не обязательно все ожидающие задачи
+        position = self._pending.ahead(flow) + self._busy - self.size + 1
+        self._ready.release()
+        if on_queued is not None and position >= max(1, self.notice_position):
+            try:
+                await on_queued(position)
+            except Exception as e:
+                logger.warning(f"Не удалось сообщить позицию в очереди: {str(e)}")
+        return await job.future
+
+    async def _dispatch(self, index):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.acquire()
+            job = self._pending.popleft()
+            if job.future.done():
+                continue
+            self._busy += 1
+            started = time.monotonic()
+            metrics.observe_stage('queue_wait', job.label, started - job.enqueued)
+            worker = self._workers[index]
+            try:
+                ok, payload = await asyncio.wait_for(
+                    loop.run_in_executor(self._threads, worker.call, job.func, job.args),
+                    timeout=job.timeout
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"Задача превысила дедлайн {job.timeout} сек, процесс {worker.process.pid} будет перезапущен")
+                self._replace_worker(index)
+                if not job.future.done():
+                    job.future.set_exception(JobTimeoutError(f"Превышено время обработки ({job.timeout} сек)"))
+            except (EOFError, OSError) as e:
+                logger.error(f"Рабочий процесс {worker.process.pid} завершился аварийно: {str(e)}")
+                self._replace_worker(index)
+                if not job.future.done():
+                    job.future.set_exception(RenderError("Рабочий процесс завершился аварийно"))
+            else:
+                if not job.future.done():
+                    if ok:
+                        job.future.set_result(payload)
+                    else:
+                        job.future.set_exception(RenderError(payload))
+            finally:
+                self._busy -= 1
+            logger.debug(f"Задача выполнена процессом #{index} за {time.monotonic() - started:.2f} сек")
+
+    def _replace_worker(self, index):
+        self._workers[index].kill()
+        self._workers[index] = _Worker(self._context, self.initializer)
+
+    async def shutdown(self):
+        """Останавливает диспетчеры и рабочие процессы."""
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        while self._pending:
+            job = self._pending.popleft()
+            if not job.future.done():
+                job.future.cancel()
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        if self._threads is not None:
+            self._threads.shutdown(wait=False)
+        logger.info("Пул рендеринга остановлен")